@@ -0,0 +1,387 @@
+"""Approximate nearest neighbour (HNSW) index of the embeddings of large tables"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import numpy as np
+from src.emb_codec import normalize
+from src.emb_snapshot import snapshot_name
+from src.config import (
+    ANN_DIR,
+    ANN_EF_CONSTRUCTION,
+    ANN_EF_SEARCH,
+    ANN_M,
+    EMB_SNAPSHOT_CHECK_INTERVAL,
+)
+
+META = "meta.json"  # version header, points to the index file of the version
+
+
+def _hnswlib():
+    try:
+        import hnswlib  # optional dependency
+    except ImportError as e:
+        raise ImportError("the ANN index requires hnswlib: pip install hnswlib") from e
+    return hnswlib
+
+
+class AnnIndex:
+    """
+    HNSW index (hnswlib) of the embeddings of a table, searched in sub-linear
+    time at the cost of some recall. Rows are keyed by their id, and can be
+    inserted, updated & deleted incrementally. Tunable parameters:
+    - M: graph links per node (recall & memory)
+    - ef_construction: candidates considered when inserting (recall & build time)
+    - ef_search: candidates considered when searching (recall & latency)
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        max_elements: int = 1024,
+        M: int = ANN_M,
+        ef_construction: int = ANN_EF_CONSTRUCTION,
+        ef_search: int = ANN_EF_SEARCH,
+        index=None,
+    ):
+        """
+        Args:
+            dim (int): embedding size
+            max_elements (int): initial capacity, grown as rows are added
+            M (int): graph links per node
+            ef_construction (int): candidates considered when inserting
+            ef_search (int): candidates considered when searching
+            index (hnswlib.Index): loaded index, instead of a new empty one
+        """
+        self.dim = dim
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        if index is None:
+            index = _hnswlib().Index(space="cosine", dim=dim)
+            index.init_index(
+                max_elements=max_elements,
+                ef_construction=ef_construction,
+                M=M,
+                allow_replace_deleted=True,
+            )
+        self.index = index
+        self.keys = {}  # id -> hnsw label
+        self.rows = {}  # hnsw label -> (id, name)
+        self.next_label = 0
+        self.version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def upsert(self, ids: list, names: list, embs):
+        """
+        Insert rows, or update the embedding & name of rows already indexed.
+        Args:
+            ids (list): ids of the rows
+            names (list): labels of the rows
+            embs (np.ndarray): embeddings of the rows
+        """
+        if len(ids) == 0:
+            return
+        embs = normalize(np.asarray(embs, dtype=np.float32))
+        with self._lock:
+            labels = []
+            for id, name in zip(ids, names):
+                label = self.keys.get(id)
+                if label is None:
+                    label = self.keys[id] = self.next_label
+                    self.next_label += 1
+                self.rows[label] = (id, name)
+                labels.append(label)
+            needed = self.index.get_current_count() + len(labels)
+            if needed > self.index.get_max_elements():
+                self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+            # existing labels are updated in place, new ones reuse deleted slots
+            self.index.add_items(embs, np.asarray(labels), replace_deleted=True)
+
+    def delete(self, ids: list) -> int:
+        """
+        Remove rows from the index.
+        Args:
+            ids (list): ids of the rows, unknown ids are ignored
+        Returns:
+            n_deleted (int): number of rows removed
+        """
+        n_deleted = 0
+        with self._lock:
+            for id in ids:
+                label = self.keys.pop(id, None)
+                if label is not None:
+                    self.index.mark_deleted(label)
+                    del self.rows[label]
+                    n_deleted += 1
+        return n_deleted
+
+    def search(
+        self, query_emb, k: int = 10, threshold: float = 0.0, ef_search: int = None
+    ) -> list:
+        """
+        Find (approximately) the top-k rows most similar to the query embedding.
+        Args:
+            query_emb (list): query embedding
+            k (int): max number of matches to return
+            threshold (float): min cosine similarity of a match
+            ef_search (int): candidates considered (default: index setting)
+        Returns:
+            matches (list): list of dicts with id, name & sim, sorted by sim
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        query_emb = normalize(np.asarray(query_emb, dtype=np.float32))
+        # ef must be at least k to return k results
+        self.index.set_ef(max(ef_search or self.ef_search, k))
+        labels, dists = self.index.knn_query(query_emb, k=k)
+        matches = []
+        for label, dist in zip(labels[0], dists[0]):
+            sim = 1.0 - float(dist)  # cosine distance
+            row = self.rows.get(int(label))
+            if row is not None and sim > threshold:
+                matches.append({"id": row[0], "name": row[1], "sim": sim})
+        return matches
+
+    def save(self, name: str, root: str = ANN_DIR) -> str:
+        """
+        Persist the index as a new version: the index file & rows are written
+        first, then the version header is replaced atomically, so readers never
+        see a partial index.
+        Args:
+            name (str): index name, e.g. table name
+            root (str): directory of the indexes
+        Returns:
+            version (str): the new version
+        """
+        path = os.path.join(root, name)
+        os.makedirs(path, exist_ok=True)
+        version = f"v{time.time_ns()}"
+        with self._lock:
+            self.index.save_index(os.path.join(path, f"{version}.bin"))
+            labels = sorted(self.rows)
+            with open(os.path.join(path, f"{version}.rows.json"), "w") as f:
+                json.dump(
+                    {
+                        "labels": labels,
+                        "ids": [self.rows[label][0] for label in labels],
+                        "names": [self.rows[label][1] for label in labels],
+                    },
+                    f,
+                    default=str,
+                )
+        meta = {
+            "version": version,
+            "dim": self.dim,
+            "n_rows": len(self),
+            "next_label": self.next_label,
+            "M": self.M,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        previous = ann_version(name, root)
+        tmp_path = os.path.join(path, f"{META}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(path, META))
+
+        # keep the previous version for readers still switching, drop older ones
+        for entry in os.listdir(path):
+            if entry.startswith("v") and not entry.startswith((version, f"{previous}.")):
+                os.remove(os.path.join(path, entry))
+        self.version = version
+        return version
+
+    @classmethod
+    def load(cls, name: str, root: str = ANN_DIR, ef_search: int = None):
+        """
+        Load the current version of an index, or None if it was never built.
+        Args:
+            name (str): index name, e.g. table name
+            root (str): directory of the indexes
+            ef_search (int): candidates considered when searching (default: saved setting)
+        """
+        path = os.path.join(root, name)
+        try:
+            with open(os.path.join(path, META), "r") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        version = meta["version"]
+        index = _hnswlib().Index(space="cosine", dim=meta["dim"])
+        index.load_index(os.path.join(path, f"{version}.bin"), allow_replace_deleted=True)
+        with open(os.path.join(path, f"{version}.rows.json"), "r") as f:
+            rows = json.load(f)
+        ann = cls(
+            meta["dim"],
+            M=meta["M"],
+            ef_construction=meta["ef_construction"],
+            ef_search=ef_search or meta["ef_search"],
+            index=index,
+        )
+        ann.rows = {
+            label: (id, row_name)
+            for label, id, row_name in zip(rows["labels"], rows["ids"], rows["names"])
+        }
+        ann.keys = {id: label for label, (id, _) in ann.rows.items()}
+        ann.next_label = meta["next_label"]
+        ann.version = version
+        return ann
+
+
+def ann_version(name: str, root: str = ANN_DIR) -> str:
+    """
+    Current version of an index, or None if it was never built.
+    """
+    try:
+        with open(os.path.join(root, name, META), "r") as f:
+            return json.load(f)["version"]
+    except FileNotFoundError:
+        return None
+
+
+# process-level indexes, keyed by table name: (index, version, last check)
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_ann_index(table: str, root: str = ANN_DIR) -> AnnIndex:
+    """
+    Get the ANN index of a table, loaded on first use & reloaded when a new
+    version was saved, or None if it was never built.
+    Args:
+        table (str): name of table
+        root (str): directory of the indexes
+    """
+    name = snapshot_name(table)
+    with _lock:
+        entry = _indexes.get(name)
+        now = time.monotonic()
+        if entry is not None and now - entry[2] > EMB_SNAPSHOT_CHECK_INTERVAL:
+            if ann_version(name, root) != entry[1]:
+                entry = None  # new version: swap it in
+            else:
+                entry = _indexes[name] = (entry[0], entry[1], now)
+        if entry is None:
+            index = AnnIndex.load(name, root)
+            entry = _indexes[name] = (index, index and index.version, now)
+    return entry[0]
+
+
+def invalidate_ann_index(table: str = None):
+    """
+    Drop the ANN index of a table (or all indexes), so it is reloaded on next use.
+    """
+    with _lock:
+        if table is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(snapshot_name(table), None)
+
+
+def recall_report(
+    ann: AnnIndex,
+    exact,
+    n_queries: int = 200,
+    k: int = 10,
+    ef_values: list = (16, 32, 64, 128, 256),
+    dbm=None,
+    seed: int = 0,
+) -> list:
+    """
+    Recall & latency of the ANN index against exact search, per ef_search value.
+    Queries are embeddings of random rows, whose own match is left out.
+    Args:
+        ann (AnnIndex): ANN index
+        exact (EmbeddingIndex): exact index of the same table
+        n_queries (int): number of queries
+        k (int): matches per query
+        ef_values (list): ef_search values to compare
+        dbm (SQLDBManager): sql db manager, to rescore an int8 exact index
+        seed (int): seed of the sampled rows
+    Returns:
+        results (list): dicts with ef_search, recall@k & latency percentiles
+    """
+    rng = np.random.default_rng(seed)
+    labels = rng.choice(sorted(ann.rows), size=min(n_queries, len(ann)), replace=False)
+    queries = ann.index.get_items(labels)
+
+    def top_ids(matches, label):
+        own_id = ann.rows[int(label)][0]
+        return [m["id"] for m in matches if m["id"] != own_id][:k]
+
+    truths, exact_lat = [], []
+    for label, query in zip(labels, queries):
+        start_time = time.perf_counter()
+        matches = exact.search(query, k=k + 1, threshold=-1.0, dbm=dbm)
+        exact_lat.append(time.perf_counter() - start_time)
+        truths.append(set(top_ids(matches, label)))
+
+    results = [
+        {
+            "ef_search": "exact",
+            f"recall@{k}": 1.0,
+            "latency_p50_ms": float(np.percentile(exact_lat, 50) * 1000),
+            "latency_p99_ms": float(np.percentile(exact_lat, 99) * 1000),
+        }
+    ]
+    for ef in ef_values:
+        hits, latencies = 0, []
+        for label, query, truth in zip(labels, queries, truths):
+            start_time = time.perf_counter()
+            matches = ann.search(query, k=k + 1, threshold=-1.0, ef_search=ef)
+            latencies.append(time.perf_counter() - start_time)
+            hits += len(truth & set(top_ids(matches, label)))
+        results.append(
+            {
+                "ef_search": ef,
+                f"recall@{k}": hits / max(sum(map(len, truths)), 1),
+                "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+                "latency_p99_ms": float(np.percentile(latencies, 99) * 1000),
+            }
+        )
+    return results
+
+
+def main():
+    from src.conn_pool import get_pool
+    from src.emb_index import get_emb_index
+
+    parser = argparse.ArgumentParser(description="Recall vs exact search of an ANN index")
+    parser.add_argument("--table", default="pegadata.ppm_work_filtered")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--out", default="outputs/ann/recall.json")
+    args = parser.parse_args()
+
+    ann = AnnIndex.load(snapshot_name(args.table))
+    if ann is None:
+        raise SystemExit(f"no ANN index for {args.table}, build it with update_ann_index")
+    dbm = get_pool().sql_manager()
+    exact = get_emb_index(dbm, args.table)
+    results = recall_report(ann, exact, args.queries, args.k, args.ef, dbm=dbm)
+
+    for r in results:
+        print(
+            f"ef_search={r['ef_search']:>6} recall@{args.k}={r[f'recall@{args.k}']:.3f} "
+            f"p50={r['latency_p50_ms']:.2f}ms p99={r['latency_p99_ms']:.2f}ms"
+        )
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(
+            {"table": args.table, "n_rows": len(ann), "M": ann.M, "results": results},
+            f,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    main()
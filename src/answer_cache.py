@@ -0,0 +1,170 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from src.emb_cache import get_embs_model
+from src.utils import get_data_version
+from src.config import (
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SIM_THRESHOLD,
+    ANSWER_CACHE_TTL,
+)
+
+ID_REGEX = re.compile(r"\b[a-z]+-\d+\b|\b\d+(?:\.\d+)?\b")  # e.g. "us-123", "42"
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a user query: lowercase, collapsed whitespace, no trailing punctuation.
+    """
+    return re.sub(r"\s+", " ", query.lower()).strip().rstrip("?.! ")
+
+
+def query_ids(query: str) -> frozenset:
+    """
+    Ids (e.g. "us-123") & numbers of a query, which its answer depends on
+    however similar the rest of the query is.
+    """
+    return frozenset(ID_REGEX.findall(normalize_query(query)))
+
+
+class AnswerCache:
+    """
+    Cache of agent answers, with exact hits on the normalized query and semantic
+    hits on the query embedding. Entries are scoped to a namespace (e.g. the
+    schema hash of an agent) and to the data version, so they are dropped when
+    the data pipeline changes the data. Semantic hits must name the same ids &
+    numbers as the cached query ("status of US-123" is not "status of US-124").
+    """
+
+    def __init__(
+        self,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        sim_threshold: float = ANSWER_CACHE_SIM_THRESHOLD,
+        embs_model=None,
+        enabled: bool = True,
+    ):
+        """
+        Args:
+            ttl (float): time to live of an entry, in seconds
+            max_entries (int): max number of entries, least recently used are evicted
+            sim_threshold (float): min cosine similarity of a semantic hit (None to disable)
+            embs_model (Embeddings): model to embed queries (default: cached embeddings model)
+            enabled (bool): cache answers, e.g. disabled for evals
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sim_threshold = sim_threshold
+        self.embs_model = embs_model
+        self.enabled = enabled
+        # key -> (namespace, response, query emb, time, query ids)
+        self._entries = OrderedDict()
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    def _key(self, query: str, namespace: str) -> str:
+        key = f"{namespace}\0{normalize_query(query)}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _embed(self, query: str):
+        embs_model = self.embs_model or get_embs_model()
+        emb = np.asarray(embs_model.embed_query(normalize_query(query)), dtype=np.float32)
+        return emb / (np.linalg.norm(emb) or 1.0)
+
+    def _check_data_version(self):
+        # drop all entries once the data has changed
+        version = get_data_version()
+        if version != self._data_version:
+            self._entries.clear()
+            self._data_version = version
+
+    def get(self, query: str, namespace: str = ""):
+        """
+        Get the cached answer to a query, or None.
+        Args:
+            query (str): user query
+            namespace (str): cache namespace, e.g. hash of the agent's schema
+        """
+        if not self.enabled:
+            return None
+        key = self._key(query, namespace)
+        now = time.time()
+        with self._lock:
+            self._check_data_version()
+            # drop expired entries
+            for k in [k for k, e in self._entries.items() if now - e[3] > self.ttl]:
+                del self._entries[k]
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[1]
+            if self.sim_threshold is None:
+                return None
+            ids = query_ids(query)
+            candidates = [
+                (k, e)
+                for k, e in self._entries.items()
+                if e[0] == namespace and e[4] == ids
+            ]
+        if not candidates:
+            return None
+
+        # semantic hit: most similar cached query above the threshold
+        query_emb = self._embed(query)
+        embs = np.stack([e[2] for _, e in candidates])
+        sims = embs @ query_emb
+        best = int(np.argmax(sims))
+        if sims[best] < self.sim_threshold:
+            return None
+        key, entry = candidates[best]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, query: str, response: str, namespace: str = ""):
+        """
+        Cache the answer to a query.
+        Args:
+            query (str): user query
+            response (str): agent answer
+            namespace (str): cache namespace, e.g. hash of the agent's schema
+        """
+        if not self.enabled:
+            return
+        query_emb = self._embed(query) if self.sim_threshold is not None else None
+        with self._lock:
+            self._check_data_version()
+            key = self._key(query, namespace)
+            self._entries[key] = (
+                namespace,
+                response,
+                query_emb,
+                time.time(),
+                query_ids(query),
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Get the process-wide answer cache.
+    """
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+    return _answer_cache
@@ -0,0 +1,287 @@
+"""Local stand-ins for Azure OpenAI, Postgres and Neo4j, used by the benchmarks"""
+
+import hashlib
+import io
+import json
+import re
+from types import SimpleNamespace
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from src.data_utils import Neo4jGraphManager, SQLDBManager
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Deterministic chat model that replays a script of messages. The n-th
+    message of the script is returned after the n-th tool result of a run, so
+    concurrent runs replay the same script independently.
+    """
+
+    script: list
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        step = sum(isinstance(m, ToolMessage) for m in messages)
+        message = self.script[min(step, len(self.script) - 1)]
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        completion_tokens = len(str(message.content).split())
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={
+                "token_usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+            },
+        )
+
+
+def tool_call_message(tool: str, tool_input, call_id: str = "call_0") -> AIMessage:
+    """
+    Message calling a tool, in openai tools format: with a string for a
+    single-input tool, or a dict of args for a structured tool.
+    """
+    args = tool_input if isinstance(tool_input, dict) else {"__arg1": tool_input}
+    return AIMessage(
+        content="",
+        additional_kwargs={
+            "tool_calls": [
+                {
+                    "id": call_id,
+                    "type": "function",
+                    "function": {
+                        "name": tool,
+                        "arguments": json.dumps(args),
+                    },
+                }
+            ]
+        },
+    )
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings: a random unit vector seeded by the hash of the text.
+    """
+
+    def __init__(self, dim: int = 1536):
+        self.dim = dim
+
+    def embed_query(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.md5(text.encode()).digest()[:8], "little")
+        emb = np.random.default_rng(seed).standard_normal(self.dim)
+        return (emb / np.linalg.norm(emb)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+class FakeCursor:
+    """
+    DBAPI cursor answering queries with a handler function. COPY input is read
+    and counted, but not stored.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self.rowcount = -1
+        self.itersize = 2000
+        self._rows = iter(())
+
+    def execute(self, sql: str, params=None):
+        cols, rows, rowcount = self.conn.handler(sql, params)
+        self.description = (
+            [SimpleNamespace(name=col) for col in cols] if cols is not None else None
+        )
+        self._rows = iter(rows)
+        self.rowcount = rowcount
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size: int):
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def copy_expert(self, sql: str, buf: io.IOBase):
+        self.conn.bytes_copied += len(buf.read())
+
+    def close(self):
+        pass
+
+
+class FakePgConnection:
+    """
+    DBAPI connection whose cursors answer queries with a handler function.
+    The handler is called as handler(sql, params) and returns
+    (column names or None, iterable of rows, rowcount).
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.bytes_copied = 0
+
+    def cursor(self, name: str = None):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeSQLDatabase:
+    """
+    In-memory replacement for `SQLDatabase`, backed by a handler function.
+    """
+
+    def __init__(self, handler, table_info: str = ""):
+        self.table_info = table_info
+        self.conn = FakePgConnection(handler)
+        self._engine = SimpleNamespace(
+            raw_connection=lambda: self.conn, dispose=lambda: None
+        )
+
+    def get_usable_table_names(self) -> list:
+        return []
+
+    def run(self, command: str, fetch: str = "all"):
+        cols, rows, _ = self.conn.handler(command, None)
+        return str(list(rows)) if cols is not None else ""
+
+
+class FakeNeo4jGraph:
+    """
+    In-memory replacement for `Neo4jGraph`, holding nodes with embeddings in
+    numpy arrays. It answers the vector index, similarity scan and index listing
+    queries of the sim-search tool; writes are counted, not applied.
+    """
+
+    def __init__(self, nodes: dict = None, schema: str = ""):
+        """
+        Args:
+            nodes (dict): label -> (pyids, pylabels, normalized embedding matrix)
+            schema (str): schema string for agent prompts
+        """
+        self.nodes = nodes or {}
+        self.schema = schema
+        self.n_writes = 0
+        self._database = "neo4j"
+        self._driver = SimpleNamespace(
+            session=lambda database=None: _FakeSession(self),
+            verify_connectivity=lambda: None,
+            close=lambda: None,
+        )
+
+    def query(self, query: str, params: dict = None) -> list:
+        params = params or {}
+        if "db.labels()" in query:
+            return [{"labels": list(self.nodes), "rels": [], "props": []}]
+        if "SHOW INDEXES" in query:
+            return [
+                {"name": label, "labelsOrTypes": [label]} for label in self.nodes
+            ]
+        if "db.index.vector.queryNodes" in query:
+            sims = self._sims(params["index"], params["embedding"])
+            top = np.argsort(-sims)[: params["k"]]
+            ids, labels, _ = self.nodes[params["index"]]
+            # returned as cosine, as converted from neo4j's score by the tool's query
+            return [
+                {"id": ids[i], "name": labels[i], "sim": float(sims[i])} for i in top
+            ]
+        if "gds.similarity.cosine" in query:
+            matches = []
+            for label in params.get("labels", self.nodes):
+                if label not in self.nodes:
+                    continue
+                sims = self._sims(label, params["embedding"])
+                ids, labels, _ = self.nodes[label]
+                idx = np.nonzero(sims > params["threshold"])[0]
+                matches.extend(
+                    {"id": ids[i], "name": labels[i], "sim": float(sims[i])} for i in idx
+                )
+            return sorted(matches, key=lambda m: m["sim"], reverse=True)[: params["k"]]
+        self.n_writes += 1
+        return []
+
+    def _sims(self, label: str, embedding: list):
+        _, _, embs = self.nodes[label]
+        query_emb = np.asarray(embedding, dtype=np.float32)
+        return embs @ (query_emb / np.linalg.norm(query_emb))
+
+
+class _FakeSession:
+    def __init__(self, graph: FakeNeo4jGraph):
+        self.graph = graph
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute_write(self, fn):
+        return fn(self)
+
+    def run(self, query: str, **params):
+        self.graph.n_writes += 1
+        return SimpleNamespace(consume=lambda: None)
+
+
+class FakePool:
+    """
+    Stand-in for `ConnectionPool`, handing out fixed managers.
+    """
+
+    def __init__(self, sql_manager: SQLDBManager = None, graph_manager=None):
+        self._sql_manager = sql_manager
+        self._graph_manager = graph_manager
+
+    def sql_manager(self, **kwargs) -> SQLDBManager:
+        return self._sql_manager
+
+    def graph_manager(self) -> Neo4jGraphManager:
+        return self._graph_manager
+
+    def close(self):
+        pass
+
+
+def sql_manager(db: FakeSQLDatabase) -> SQLDBManager:
+    """
+    SQLDBManager using a fake database.
+    """
+    dbm = SQLDBManager()
+    dbm.db = db
+    return dbm
+
+
+def graph_manager(graph: FakeNeo4jGraph) -> Neo4jGraphManager:
+    """
+    Neo4jGraphManager using a fake graph.
+    """
+    ngm = Neo4jGraphManager()
+    ngm.graph = graph
+    return ngm
+
+
+def match(pattern: str, sql: str) -> bool:
+    """
+    Case-insensitive regex search of a pattern in a query.
+    """
+    return re.search(pattern, sql, re.IGNORECASE | re.DOTALL) is not None
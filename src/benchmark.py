@@ -0,0 +1,403 @@
+"""Offline latency/throughput benchmarks, using local stand-ins for the LLM & DBs"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import tempfile
+import time
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from src import data_utils
+from src.bench_fakes import (
+    FakeEmbeddings,
+    FakeNeo4jGraph,
+    FakePgConnection,
+    FakePool,
+    FakeSQLDatabase,
+    ScriptedChatModel,
+    graph_manager,
+    match,
+    sql_manager,
+    tool_call_message,
+)
+from src.conn_pool import set_pool
+from src.emb_codec import encode_embs
+from src.emb_cache import set_embs_model
+from src.emb_index import invalidate_emb_index, set_snapshot_dir
+from src.emb_pipeline import EmbeddingCheckpoint, EmbeddingPipeline, truncate_chars
+from src.lexical_index import set_lexical_dir
+from src.tools import GraphQueryAgent, SQLQueryAgent, db_sim_search, graph_sim_search
+from src.utils import set_data_version_path
+from src.config import DATA_VERSION_PATH, EMB_STORAGE, GRAPH_OBJ_TYPES
+
+BENCH_QUERY = "who is in charge of the user story about end-to-end testing?"
+
+
+def synthetic_objs(n_rows: int, dim: int, seed: int = 0):
+    """
+    Synthetic objects: pyids, labels & normalized float32 embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    ids = [f"US-{i}" for i in range(n_rows)]
+    labels = [f"user story {i}" for i in range(n_rows)]
+    embs = rng.standard_normal((n_rows, dim), dtype=np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    return ids, labels, embs
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of the process so far, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(name: str, size: int, latencies: list, n_rows: int = None) -> dict:
+    """
+    Summarize latencies (in seconds) of a benchmark.
+    Args:
+        name (str): benchmark name
+        size (int): number of rows of the synthetic data
+        latencies (list): latency of each repeat, in seconds
+        n_rows (int): rows processed per repeat, for throughput (default: size)
+    """
+    lat_ms = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(lat_ms, [50, 95, 99])
+    result = {
+        "name": name,
+        "size": size,
+        "repeats": len(latencies),
+        "latency_p50_ms": float(p50),
+        "latency_p95_ms": float(p95),
+        "latency_p99_ms": float(p99),
+        "rows_per_s": float((n_rows or size) / np.mean(latencies)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(
+        f"{name:<24} size={size:<8} p50={p50:9.2f}ms p95={p95:9.2f}ms "
+        f"p99={p99:9.2f}ms rows/s={result['rows_per_s']:12.0f} "
+        f"rss={result['peak_rss_mb']:.0f}MB"
+    )
+    return result
+
+
+def timeit(fn, repeats: int) -> list:
+    """
+    Time repeated calls of a function, in seconds.
+    """
+    latencies = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start_time)
+    return latencies
+
+
+def sim_search_db(n_rows: int, dim: int) -> FakeSQLDatabase:
+    """
+    Fake db with a table of synthetic objects with embeddings, stored as
+    configured by EMB_STORAGE.
+    """
+    ids, labels, embs = synthetic_objs(n_rows, dim)
+    packed = {} if EMB_STORAGE == "float64" else encode_embs(embs, EMB_STORAGE)
+    positions = {pyid: i for i, pyid in enumerate(ids)}
+
+    def value(col: str, i: int):
+        return embs[i].tolist() if col == "embeddings" else packed[col][i]
+
+    def handler(sql, params):
+        if match(r"SELECT COUNT\(\*\)", sql):
+            return ["count"], [(n_rows,)], 1
+        if match(r"= ANY", sql):  # full precision embeddings of candidates
+            rows = [(pyid, value("embeddings_f32", positions[pyid])) for pyid in params[0]]
+            return ["pyid", "embeddings_f32"], rows, len(rows)
+        col = re.search(r"SELECT pyid, pylabel, (\w+)", sql)
+        if col:
+            rows = ((ids[i], labels[i], value(col.group(1), i)) for i in range(n_rows))
+            return ["pyid", "pylabel", col.group(1)], rows, n_rows
+        return None, [], 0
+
+    return FakeSQLDatabase(handler)
+
+
+def bench_db_sim_search(n_rows: int, dim: int, repeats: int) -> list:
+    """
+    db_sim_search: index load, then repeated queries.
+    """
+    set_pool(FakePool(sql_manager=sql_manager(sim_search_db(n_rows, dim))))
+    invalidate_emb_index()
+    load = timeit(lambda: db_sim_search(BENCH_QUERY), 1)  # loads the index
+    search = timeit(lambda: db_sim_search(BENCH_QUERY), repeats)
+    return [
+        summarize("db_sim_search.load", n_rows, load),
+        summarize("db_sim_search", n_rows, search),
+    ]
+
+
+def bench_snapshot_sim_search(n_rows: int, dim: int, repeats: int) -> list:
+    """
+    db_sim_search over a memory-mapped snapshot: export, index load, then
+    repeated queries.
+    """
+    dbm = sql_manager(sim_search_db(n_rows, dim))
+    set_pool(FakePool(sql_manager=dbm))
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        set_snapshot_dir(snapshot_dir)
+        table = "pegadata.ppm_work_filtered"
+        export = timeit(lambda: dbm.export_emb_snapshot(table, path=snapshot_dir), 1)
+        load = timeit(lambda: db_sim_search(BENCH_QUERY), 1)  # maps the snapshot
+        search = timeit(lambda: db_sim_search(BENCH_QUERY), repeats)
+        set_snapshot_dir(None)  # unmap before the snapshot is deleted
+    return [
+        summarize("snapshot.export", n_rows, export),
+        summarize("snapshot_sim_search.load", n_rows, load),
+        summarize("snapshot_sim_search", n_rows, search),
+    ]
+
+
+def bench_graph_sim_search(n_rows: int, dim: int, repeats: int) -> list:
+    """
+    graph_sim_search over objects split between the object types.
+    """
+    ids, labels, embs = synthetic_objs(n_rows, dim)
+    parts = np.array_split(np.arange(n_rows), len(GRAPH_OBJ_TYPES))
+    nodes = {
+        label: ([ids[i] for i in idx], [labels[i] for i in idx], embs[idx])
+        for label, idx in zip(GRAPH_OBJ_TYPES, parts)
+    }
+    set_pool(FakePool(graph_manager=graph_manager(FakeNeo4jGraph(nodes))))
+    search = timeit(lambda: graph_sim_search(BENCH_QUERY), repeats)
+    return [summarize("graph_sim_search", n_rows, search)]
+
+
+def bench_embed_objs(n_rows: int) -> list:
+    """
+    SQLDBManager.embed_objs: read texts, embed (fake) & bulk write.
+    """
+
+    def handler(sql, params):
+        if match(r"format_type", sql):
+            return ["format_type"], [("text",)], 1
+        if match(r"^\s*UPDATE", sql):
+            return None, [], n_rows
+        if match(r"^\s*SELECT", sql):
+            rows = ((f"US-{i}", f"story {i}", f"description {i}") for i in range(n_rows))
+            return ["id", "label", "description"], rows, n_rows
+        return None, [], 0
+
+    dbm = sql_manager(FakeSQLDatabase(handler))
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        # estimated token counts: no tokenizer download
+        pipeline = EmbeddingPipeline(
+            checkpoint=EmbeddingCheckpoint(os.path.join(checkpoint_dir, "embed.json")),
+            truncate=truncate_chars,
+        )
+        latencies = timeit(
+            lambda: dbm.embed_objs(
+                "data",
+                ["label", "description"],
+                "id",
+                snapshot=False,
+                ann=False,
+                lexical=False,
+                pipeline=pipeline,
+            ),
+            1,
+        )
+    return [summarize("embed_objs", n_rows, latencies)]
+
+
+def bench_clean_html(n_rows: int) -> list:
+    """
+    SQLDBManager.clean_html: read changed rows, clean in parallel & bulk write.
+    """
+
+    def handler(sql, params):
+        if match(r"to_regclass", sql):
+            return ["to_regclass"], [("data_html_hash",)], 1
+        if match(r"^\s*SELECT t\.", sql):
+            rows = (
+                (f"US-{i}", f"<p>user <b>story</b> {i}</p><ul><li>item</li></ul>", True)
+                for i in range(n_rows)
+            )
+            return ["id", "description", "changed"], rows, n_rows
+        return None, [], 0
+
+    dbm = sql_manager(FakeSQLDatabase(handler))
+    latencies = timeit(lambda: dbm.clean_html("data", ["description"], "id"), 1)
+    return [summarize("clean_html", n_rows, latencies)]
+
+
+def bench_from_table(n_rows: int) -> list:
+    """
+    Neo4jGraphManager.from_table: stream rows & write nodes in UNWIND batches.
+    """
+    obj_classes = GRAPH_OBJ_TYPES
+    cols = ["pyid", "pylabel", "objclass", "epicid"]
+
+    def handler(sql, params):
+        if match(r"LIMIT 0", sql):
+            return cols, [], 0
+        if match(r"row_hash", sql):
+            rows = (
+                (
+                    f"ID-{i}",
+                    f"object {i}",
+                    obj_classes[i % len(obj_classes)],
+                    f"EPIC-{i // 10}",
+                    f"{i:032x}",
+                )
+                for i in range(n_rows)
+            )
+            return cols + ["row_hash"], rows, n_rows
+        return None, [], 0
+
+    ngm = graph_manager(FakeNeo4jGraph())
+    connect_postgres = data_utils._connect_postgres
+    data_utils._connect_postgres = lambda: FakePgConnection(handler)  # stand-in
+    try:
+        latencies = timeit(lambda: ngm.from_table("data", reset=True), 1)
+    finally:
+        data_utils._connect_postgres = connect_postgres
+    return [summarize("from_table", n_rows, latencies)]
+
+
+def bench_agents(n_rows: int, dim: int, repeats: int) -> list:
+    """
+    End-to-end SQLQueryAgent.run / GraphQueryAgent.run with a scripted llm:
+    one sim-search tool call, then the final answer.
+    """
+    results = []
+    final_answer = AIMessage(content="Final Answer: US-1")
+
+    # sql agent
+    db = sim_search_db(n_rows, dim)
+    set_pool(FakePool(sql_manager=sql_manager(db)))
+    invalidate_emb_index()
+    llm = ScriptedChatModel(
+        script=[
+            tool_call_message("db_sim_search", {"user_query": BENCH_QUERY}),
+            final_answer,
+        ]
+    )
+    dqa = SQLQueryAgent(db, llm, verbose=False)
+    dqa.answer_cache = None  # time full agent runs, not cache hits
+    dqa.run(BENCH_QUERY)  # warm up: load the index
+    results.append(
+        summarize(
+            "sql_agent.run", n_rows, timeit(lambda: dqa.run(BENCH_QUERY), repeats), 1
+        )
+    )
+
+    # graph agent
+    ids, labels, embs = synthetic_objs(n_rows, dim)
+    graph = FakeNeo4jGraph({GRAPH_OBJ_TYPES[0]: (ids, labels, embs)})
+    set_pool(FakePool(graph_manager=graph_manager(graph)))
+    llm = ScriptedChatModel(
+        script=[
+            tool_call_message("graph_sim_search", {"user_query": BENCH_QUERY}),
+            final_answer,
+        ]
+    )
+    gqa = GraphQueryAgent(graph, llm, verbose=False)
+    gqa.answer_cache = None  # time full agent runs, not cache hits
+    results.append(
+        summarize(
+            "graph_agent.run", n_rows, timeit(lambda: gqa.run(BENCH_QUERY), repeats), 1
+        )
+    )
+    return results
+
+
+def compare(results: list, baseline_path: str):
+    """
+    Print the change of p50 latency & throughput against a previous run.
+    """
+    with open(baseline_path, "r") as f:
+        baseline = {(r["name"], r["size"]): r for r in json.load(f)["results"]}
+    print(f"\ncompared to {baseline_path}:")
+    for r in results:
+        b = baseline.get((r["name"], r["size"]))
+        if b is None:
+            continue
+        print(
+            f"{r['name']:<24} size={r['size']:<8} "
+            f"p50 x{r['latency_p50_ms'] / b['latency_p50_ms']:.2f} "
+            f"rows/s x{r['rows_per_s'] / b['rows_per_s']:.2f}"
+        )
+
+
+BENCHMARKS = [
+    "db_sim_search",
+    "snapshot_sim_search",
+    "graph_sim_search",
+    "embed_objs",
+    "clean_html",
+    "from_table",
+    "agents",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=1536, help="embedding size")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--out", default="outputs/bench/results.json")
+    parser.add_argument("--compare", help="results json of a previous run")
+    args = parser.parse_args()
+
+    set_embs_model(FakeEmbeddings(args.dim))
+    set_snapshot_dir(None)  # measure loading from the db, not a local snapshot
+    set_lexical_dir(None)  # measure vector search, not local lexical indexes
+    # the data pipeline benchmarks bump the data version: bump a temp one, as
+    # bumping the real one invalidates the cached answers & indexes in use
+    with tempfile.TemporaryDirectory() as state_dir:
+        set_data_version_path(os.path.join(state_dir, "data_version"))
+        try:
+            results = []
+            for size in args.sizes:
+                if "db_sim_search" in args.only:
+                    results += bench_db_sim_search(size, args.dim, args.repeats)
+                if "snapshot_sim_search" in args.only:
+                    results += bench_snapshot_sim_search(size, args.dim, args.repeats)
+                if "graph_sim_search" in args.only:
+                    results += bench_graph_sim_search(size, args.dim, args.repeats)
+                if "embed_objs" in args.only:
+                    results += bench_embed_objs(size)
+                if "clean_html" in args.only:
+                    results += bench_clean_html(size)
+                if "from_table" in args.only:
+                    results += bench_from_table(size)
+                if "agents" in args.only:
+                    results += bench_agents(size, args.dim, args.repeats)
+        finally:
+            set_data_version_path(DATA_VERSION_PATH)
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(
+            {
+                "meta": {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "args": vars(args),
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"results saved to {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,173 @@ TABLE_PRIMARY_KEY = "id"
 REQ_COLS_PATH = "data/req_cols.txt"
 TEXT_COL = "description"
 COLS_TO_EMBED = ["label", "description"]
+INCREMENTAL_SYNC = True  # sync only changed rows instead of rebuilding
+CLEAN_HTML_CHUNK_SIZE = 2000  # rows read & cleaned at a time
+
+# Similarity search
+SIM_SEARCH_TOP_K = 10
+DB_SIM_THRESHOLD = 0.8
+GRAPH_SIM_THRESHOLD = 0.75
+SIM_SEARCH_FILTER_FIELDS = ["pxobjclass", "pystatuswork", "category"]  # filterable fields
+
+# Embeddings
+EMBS_MODEL = "text-embedding-ada-002"
+EMB_CACHE_PATH = "cache/embeddings.sqlite"
+EMB_CACHE_MAX_ENTRIES = 1_000_000
+EMB_WRITE_BATCH_SIZE = 5000  # rows per COPY batch
+EMB_CHUNK_SIZE = 2000  # rows read, embedded & written at a time
+EMB_BATCH_MAX_TOKENS = 50_000  # tokens per embeddings request
+EMB_BATCH_MAX_TEXTS = 256  # texts per embeddings request
+EMB_MAX_TEXT_TOKENS = 8191  # max input of the embeddings model
+EMB_MAX_WORKERS = 4  # concurrent embeddings requests
+EMB_MAX_RETRIES = 5
+EMB_CHECKPOINT_PATH = "cache/embed_checkpoint.json"
+# "float32" or "int8" (+ float32 to rescore) in BYTEA columns, or "float64" (legacy)
+EMB_STORAGE = "float32"
+EMB_RESCORE_FACTOR = 4  # candidates of an int8 search rescored at full precision, per match
+# memory-mapped snapshots of the embeddings, shared by the worker processes
+EMB_SNAPSHOT_DIR = "cache/emb_snapshots"
+EMB_SNAPSHOT_ENABLED = True  # export a snapshot after embedding
+EMB_SNAPSHOT_CHECK_INTERVAL = 10  # seconds between checks for a new snapshot version
+
+# Approximate nearest neighbour (HNSW) index, needs hnswlib
+ANN_ENABLED = False  # build the index when embedding & search it in db_sim_search
+ANN_MIN_ROWS = 100_000  # smaller tables are searched exactly
+ANN_DIR = "cache/ann"
+ANN_M = 16  # graph links per node: recall & memory
+ANN_EF_CONSTRUCTION = 200  # candidates when inserting: recall & build time
+ANN_EF_SEARCH = 64  # candidates when searching: recall & latency
+
+# Lexical (BM25) index of the embedded text
+SIM_SEARCH_MODE = "hybrid"  # "vector", "lexical", or "hybrid": lexical first, embed if unsure
+LEXICAL_DIR = "cache/lexical"
+BM25_K1 = 1.2  # term frequency saturation
+BM25_B = 0.75  # document length normalization
+LEXICAL_MIN_MARGIN = 1.5  # top BM25 score / next one, to answer without embedding
+RRF_K = 60  # rank offset of reciprocal rank fusion
+
+# Queries
+QUERY_FETCH_SIZE = 10_000  # rows fetched from server-side cursors at a time
+
+# Tool results
+TOOL_RESULT_MAX_ROWS = 20  # rows per page
+TOOL_RESULT_MAX_CHARS = 4000  # chars per page
+TOOL_RESULT_MAX_VALUE_CHARS = 500  # longer values are truncated
+TOOL_RESULT_MAX_FETCH_ROWS = 1000  # rows fetched & kept for paging
+TOOL_RESULT_MAX_CURSORS = 100  # results kept for paging
+
+# Guard of llm-generated queries
+QUERY_READ_ONLY = True  # reject write statements
+QUERY_TIMEOUT = 10  # seconds
+# LIMIT injected into queries without one, one more row than fetched marks a cut result
+QUERY_MAX_ROWS = TOOL_RESULT_MAX_FETCH_ROWS + 1
+QUERY_MAX_COST = 1_000_000  # postgres planner cost of the whole query
+QUERY_MAX_GRAPH_ROWS = 1_000_000  # neo4j estimated rows of any operator
+
+# Connection pool
+DB_POOL_SIZE = 5
+DB_POOL_HEALTH_CHECK_INTERVAL = 30  # seconds
 
 # Graph DB
 GRAPH_OBJ_TYPES = ["UserStory", "Epic", "Goal", "Project"]
+GRAPH_WRITE_BATCH_SIZE = 5000  # nodes per UNWIND transaction
+# (child label, parent key property, parent label, relationship type)
+GRAPH_REL_SPECS = [
+    ("UserStory", "epicid", "Epic", "IS_STORY_OF_EPIC"),
+    ("Epic", "goalid", "Goal", "IS_EPIC_OF_GOAL"),
+    ("Goal", "projectid", "Project", "IS_GOAL_OF_PROJECT"),
+]
+# pyid prefix -> object type
+PYID_PREFIXES = {
+    "US": "UserStory",
+    "EPIC": "Epic",
+    "GOAL": "Goal",
+    "PROJ": "Project",
+    "BL": "Backlog",
+}
+
+# Fast path for direct id lookups
+FAST_PATH_ENABLED = True
+# column / property -> words of a query asking for it
+FAST_PATH_ATTRS = {
+    "pystatuswork": r"\b(status|state)\b",
+    "category": r"\bcategor(y|ies)\b",
+    "description": r"\b(describe|description)\b",
+    "pylabel": r"\b(label|title|name|called)\b",
+    "pxobjclass": r"\b(type|class)\b",
+}
+# words a direct lookup may contain besides the id, the attribute or related
+# object type & the type of the object; any other word (counts, filters,
+# dates, other attributes...) sends the query to the agent
+FAST_PATH_FILLER_WORDS = set(
+    "a all an are belong belongs current currently do does for get give in is it "
+    "its list me of please s show tell the to what whats which".split()
+)
+# object type -> words of a query referring to it
+OBJ_TYPE_PATTERNS = {
+    "UserStory": r"\b(user ?)?stor(y|ies)\b",
+    "Epic": r"\bepics?\b",
+    "Goal": r"\bgoals?\b",
+    "Project": r"\bprojects?\b",
+    "Backlog": r"\bbacklogs?\b",
+}
+
 # OpenAI
 OPENAI_LLM_VERSION = "gpt-4"
 MAX_TOKENS = 100
 TEMPERATURE = 0.0
 
+# Answer cache
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_TTL = 3600  # seconds
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_SIM_THRESHOLD = 0.97  # min cosine similarity of a semantic hit
+DATA_VERSION_PATH = "cache/data_version"  # bumped by the data pipeline
+
+# Agent prompt schema
+SCHEMA_EXCLUDED_PROPS = [
+    "embeddings",
+    "embeddings_f32",
+    "embeddings_i8",
+    "embedding",
+    "embs_hash",
+    "src_hash",
+    "row_hash",
+]
+SCHEMA_SAMPLE_ROWS = 3  # sample rows per table
+SCHEMA_MAX_SAMPLE_CHARS = 50  # max length of a sample value
+SCHEMA_CHECK_INTERVAL = 300  # min seconds between schema change checks
+
+# Tracing
+TRACE_PATH = None  # jsonl file to write spans to, e.g. "outputs/traces.jsonl"
+
 # Eval
 TEST_QUERIES_PATH = "data/sample_queries.csv"
 SQL_RESPONSES_EVAL_PATH = "outputs/sql-rag/responses.csv"
 SQL_RESULTS_PATH = "outputs/sql-rag/results.json"
+SQL_CHECKPOINT_PATH = "outputs/sql-rag/checkpoint.jsonl"
 GRAPH_RESPONSES_EVAL_PATH = "outputs/kg-rag/responses.csv"
 GRAPH_RESULTS_PATH = "outputs/kg-rag/results.json"
+GRAPH_CHECKPOINT_PATH = "outputs/kg-rag/checkpoint.jsonl"
+EVAL_MAX_WORKERS = 4  # queries run concurrently
+EVAL_MAX_CALLS_PER_MIN = 60  # llm calls per minute
+EVAL_MAX_RETRIES = 5  # retries of a query on rate limit / transient errors
+
+# Startup
+IMPORT_REPORT_MODULES = ["src.tools", "src.data_utils", "src.conn_pool"]
+IMPORT_TIME_BUDGET_MS = 1000  # max import time of a module
+# packages imported on first use only, never when importing the src modules
+LAZY_PACKAGES = [
+    "langchain",
+    "langchain_core",
+    "langchain_openai",
+    "langchain_community",
+    "openai",
+    "neo4j",
+    "psycopg2",
+    "pandas",
+    "html2text",
+    "hnswlib",
+    "pyarrow",
+    "tiktoken",
+]
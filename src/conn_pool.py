@@ -0,0 +1,118 @@
+import atexit
+import threading
+import time
+from src.data_utils import Neo4jGraphManager, SQLDBManager
+from src.utils import load_neo4j_env_variables, load_postgres_env_variables
+from src.config import DB_POOL_SIZE, DB_POOL_HEALTH_CHECK_INTERVAL
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of db managers, keyed by connection settings.
+    Each manager owns a pooled sqlalchemy engine or neo4j driver, which is safe
+    to share between threads, so one manager is kept per set of settings.
+    """
+
+    def __init__(
+        self,
+        size: int = DB_POOL_SIZE,
+        health_check_interval: float = DB_POOL_HEALTH_CHECK_INTERVAL,
+    ):
+        """
+        Args:
+            size (int): max number of connections per manager
+            health_check_interval (float): min seconds between health checks
+        """
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self._managers = {}  # key -> manager
+        self._last_checked = {}  # key -> time of last health check
+        self._key_locks = {}  # key -> lock held while connecting
+        self._lock = threading.Lock()
+
+    def sql_manager(self, **kwargs) -> SQLDBManager:
+        """
+        Get a shared sql db manager for the postgres env settings.
+        Args:
+            kwargs: passed to `SQLDatabase.from_uri`
+        """
+        key = ("postgres", load_postgres_env_variables(), repr(sorted(kwargs.items())))
+        return self._get(
+            key, lambda: SQLDBManager.from_env(pool_size=self.size, **kwargs)
+        )
+
+    def graph_manager(self) -> Neo4jGraphManager:
+        """
+        Get a shared neo4j graph manager for the neo4j env settings.
+        """
+        key = ("neo4j", load_neo4j_env_variables())
+        return self._get(key, lambda: Neo4jGraphManager.from_env(pool_size=self.size))
+
+    def _get(self, key, factory):
+        """
+        Get the manager for a key, health-checking it and (re)creating it if needed.
+        The pool lock is only held to look up & register managers: pings and
+        connections run outside it, so a slow db doesn't block the other keys.
+        """
+        with self._lock:
+            manager = self._managers.get(key)
+            now = time.monotonic()
+            check = (
+                manager is not None
+                and now - self._last_checked.get(key, 0) > self.health_check_interval
+            )
+            if check:  # claimed by this thread, the others keep using the manager
+                self._last_checked[key] = now
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        if check and not manager.ping():
+            print(f"connection to {key[0]} unhealthy, reconnecting")
+            with self._lock:
+                if self._managers.get(key) is manager:
+                    del self._managers[key]
+            manager.close()
+            manager = None
+        if manager is None:
+            with key_lock:  # one connection per key at a time
+                with self._lock:
+                    manager = self._managers.get(key)
+                if manager is None:
+                    manager = factory()
+                    with self._lock:
+                        self._managers[key] = manager
+                        self._last_checked[key] = time.monotonic()
+        return manager
+
+    def close(self):
+        """
+        Close all managers in the pool.
+        """
+        with self._lock:
+            for manager in self._managers.values():
+                manager.close()
+            self._managers.clear()
+            self._last_checked.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Get the process-wide connection pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+            atexit.register(_pool.close)
+    return _pool
+
+
+def set_pool(pool: ConnectionPool):
+    """
+    Replace the process-wide connection pool, e.g. with local stand-ins.
+    """
+    global _pool
+    with _pool_lock:
+        _pool = pool
@@ -1,13 +1,53 @@
-from ast import literal_eval
-from html2text import html2text
-from langchain.sql_database import SQLDatabase
-from langchain.graphs import Neo4jGraph
-from langchain_openai import AzureOpenAIEmbeddings
-from langchain.vectorstores import Neo4jVector
-import psycopg2
-import pandas as pd
-from src.utils import *
-from src.config import *
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+import io
+from itertools import islice
+import json
+import os
+import struct
+import time
+from typing import TYPE_CHECKING, Literal
+import numpy as np
+from src.ann_index import AnnIndex, ann_version, invalidate_ann_index
+from src.emb_codec import EMB_COLUMNS, decode_f32, encode_embs
+from src.emb_index import facet_cols, invalidate_emb_index
+from src.lexical_index import LexicalIndex
+from src.emb_snapshot import (
+    GRAPH_SNAPSHOT,
+    SnapshotWriter,
+    current_version,
+    snapshot_name,
+)
+from src.utils import (
+    bump_data_version,
+    load_neo4j_env_variables,
+    load_postgres_env_variables,
+)
+from src.config import (
+    ANN_DIR,
+    ANN_ENABLED,
+    CLEAN_HTML_CHUNK_SIZE,
+    COLS_TO_EMBED,
+    EMB_CHUNK_SIZE,
+    EMB_SNAPSHOT_DIR,
+    EMB_SNAPSHOT_ENABLED,
+    EMB_STORAGE,
+    EMB_WRITE_BATCH_SIZE,
+    GRAPH_OBJ_TYPES,
+    GRAPH_REL_SPECS,
+    GRAPH_WRITE_BATCH_SIZE,
+    LEXICAL_DIR,
+    QUERY_FETCH_SIZE,
+    SIM_SEARCH_FILTER_FIELDS,
+    SIM_SEARCH_MODE,
+)
+
+# heavy backends (langchain, psycopg2, neo4j, html2text) & the embedding
+# pipeline are imported on first use, to keep imports of this module fast
+
+if TYPE_CHECKING:  # type hints only
+    from src.emb_pipeline import EmbeddingPipeline
 
 
 class SQLDBManager:
@@ -19,9 +59,12 @@ class SQLDBManager:
         pass
 
     @classmethod
-    def from_env(cls, **kwargs):
+    def from_env(cls, pool_size: int = None, **kwargs):
         """
         Connect to database using environment variables.
+        Args:
+            pool_size (int): size of the engine's connection pool (default: sqlalchemy's)
+            kwargs: passed to `SQLDatabase.from_uri`
         """
         instance = cls()
         # get postgres env variables
@@ -29,6 +72,15 @@ class SQLDBManager:
 
         # connect to DB
         conn_str = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{db}"
+        if pool_size:
+            # check connections are alive before handing them out
+            kwargs["engine_args"] = {
+                "pool_size": pool_size,
+                "pool_pre_ping": True,
+                **kwargs.get("engine_args", {}),
+            }
+        from langchain.sql_database import SQLDatabase
+
         try:
             instance.db = SQLDatabase.from_uri(conn_str, **kwargs)
             # print("connected to database")
@@ -37,6 +89,24 @@ class SQLDBManager:
 
         return instance
 
+    def ping(self) -> bool:
+        """
+        Check that the database is reachable.
+        """
+        try:
+            with self.db._engine.connect() as conn:
+                conn.exec_driver_sql("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        """
+        Close all connections of the engine.
+        """
+        if hasattr(self, "db"):
+            self.db._engine.dispose()
+
     def filter_table(
         self, src_table: str, req_cols_path: str, primary_key: str, overwrite=False
     ):
@@ -68,81 +138,708 @@ class SQLDBManager:
         # run query to create new table
         try:
             self.db.run(create_table_query)
+            bump_data_version()
             print(f"table {data_table} created successfully.")
         except Exception as e:
             print(f"an error occurred: {e}")
 
-    def clean_html(self, data_table: str, cols_to_clean: list, primary_key: str):
+    def sync_table(self, src_table: str, req_cols_path: str, primary_key: str):
+        """
+        Incrementally sync the filtered table with the source table: upsert only
+        new or changed rows and delete rows that are gone. Changes are detected
+        with a per-row hash of the required fields, kept in the `src_hash` column.
+        Args:
+            src_table (str): name of table to filter
+            req_cols_path (str): path to file with required fields
+            primary_key (str): name of primary key
+        """
+        with open(req_cols_path, "r") as file:
+            cols = [line.strip() for line in file.readlines() if line.strip()]
+        cols_str = ", ".join(cols)
+        data_table = f"{src_table}_filtered"
+
+        # create table on first sync
+        (exists,) = self.query("SELECT to_regclass(%s) IS NOT NULL;", (data_table,))[0]
+        if not exists:
+            self.filter_table(src_table, req_cols_path, primary_key)
+
+        row_hash = f"md5(ROW({cols_str})::text)"
+        update_cols = ", ".join(
+            f"{col} = EXCLUDED.{col}" for col in cols if col != primary_key
+        )
+        with self._raw_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f"ALTER TABLE {data_table} ADD COLUMN IF NOT EXISTS src_hash TEXT;"
+            )
+            # upsert new & changed rows
+            cur.execute(
+                f"""
+                INSERT INTO {data_table} ({cols_str}, src_hash)
+                SELECT {cols_str}, {row_hash} FROM {src_table}
+                ON CONFLICT ({primary_key}) DO UPDATE
+                SET {update_cols}, src_hash = EXCLUDED.src_hash
+                WHERE {data_table}.src_hash IS DISTINCT FROM EXCLUDED.src_hash;
+                """
+            )
+            n_upserted = cur.rowcount
+            # delete rows that are gone from the source table
+            cur.execute(
+                f"""
+                DELETE FROM {data_table} t WHERE NOT EXISTS (
+                    SELECT 1 FROM {src_table} s WHERE s.{primary_key} = t.{primary_key}
+                ) RETURNING t.pyid;
+                """
+            )
+            deleted_pyids = [row[0] for row in cur.fetchall()]  # keys of the indexes
+            n_deleted = len(deleted_pyids)
+
+        invalidate_emb_index(data_table)
+        if n_upserted or n_deleted:
+            bump_data_version()
+            if current_version(snapshot_name(data_table)) is not None:
+                self.export_emb_snapshot(data_table)  # drop deleted rows
+        if deleted_pyids and ann_version(snapshot_name(data_table)) is not None:
+            self.update_ann_index(data_table, ids=deleted_pyids)
+        lexical_path = os.path.join(LEXICAL_DIR, f"{snapshot_name(data_table)}.json")
+        if deleted_pyids and os.path.exists(lexical_path):
+            self.update_lexical_index(data_table, ids=deleted_pyids)
+        print(f"table {data_table} synced: {n_upserted} upserted, {n_deleted} deleted.")
+
+    def clean_html(
+        self,
+        data_table: str,
+        cols_to_clean: list,
+        primary_key: str,
+        chunk_size: int = CLEAN_HTML_CHUNK_SIZE,
+        n_workers: int = None,
+    ):
         """
         Clean html from columns in table.
+        Rows are read in chunks, cleaned in parallel, written to a staging table
+        and applied with a single UPDATE. The md5 of each cleaned value is kept in
+        the table `<data_table>_html_hash`, and values with an unchanged hash are
+        skipped on later runs.
         Args:
             data_table (str): name of table
             cols_to_clean (list): list of columns to clean
             primary_key (str): name of primary key
+            chunk_size (int): number of rows read & cleaned at a time
+            n_workers (int): number of worker processes (default: number of cpus)
         """
-        for col in cols_to_clean:
-            # fetch rows for the column to clean
-            rows_str = self.db.run(f"SELECT {primary_key}, {col} FROM {data_table}")
-            rows = literal_eval(rows_str)  # convert string to list
-            rows = [
-                (row[0], row[1]) for row in rows
-            ]  # convert list of tuples to list of (id, description)
-
-            # clean html and escape single quotes
-            cleaned_rows = [
-                (row[0], html2text(row[1]) if row[1] else None) for row in rows
-            ]
-            cleaned_rows = [
-                (row[0], row[1].replace("'", "''") if row[1] else "NULL")
-                for row in cleaned_rows
+        hash_table = f"{data_table}_html_hash"
+        staging = "clean_html_staging"
+        hash_cols = [f"{col}_md5" for col in cols_to_clean]
+        cols_str = ", ".join(cols_to_clean)
+        start_time = time.perf_counter()
+
+        with self._raw_conn() as conn, ProcessPoolExecutor(n_workers) as executor:
+            cur = conn.cursor()
+            # create table with hashes of cleaned values if it doesn't exist
+            cur.execute(f"SELECT to_regclass('{hash_table}');")
+            if cur.fetchone()[0] is None:
+                cur.execute(
+                    f"""
+                    CREATE TABLE {hash_table} AS
+                    SELECT {primary_key} FROM {data_table} WITH NO DATA;
+                    ALTER TABLE {hash_table} ADD PRIMARY KEY ({primary_key});
+                    """
+                )
+            for hash_col in hash_cols:
+                cur.execute(
+                    f"ALTER TABLE {hash_table} ADD COLUMN IF NOT EXISTS {hash_col} TEXT;"
+                )
+
+            conn.commit()  # make the hash table visible to the reading connection
+            cur.execute(
+                f"""
+                CREATE TEMP TABLE {staging} ON COMMIT DROP AS
+                SELECT {primary_key}, {cols_str} FROM {data_table} WITH NO DATA;
+                """
+            )
+
+            # select rows with at least one value changed since it was last cleaned
+            changed = [
+                f"md5(t.{col}) IS DISTINCT FROM h.{hash_col}"
+                for col, hash_col in zip(cols_to_clean, hash_cols)
             ]
+            batches = self.iter_batches(
+                f"""
+                SELECT t.{primary_key}, {", ".join(f"t.{col}" for col in cols_to_clean)},
+                    {", ".join(changed)}
+                FROM {data_table} t
+                LEFT JOIN {hash_table} h ON h.{primary_key} = t.{primary_key}
+                WHERE {" OR ".join(changed)};
+                """,
+                fetch_size=chunk_size,
+            )
 
-            # update the database with cleaned text
-            for pk, cleaned_text in cleaned_rows:
-                update_query = f"UPDATE {data_table} SET {col} = '{cleaned_text}' WHERE {primary_key} = '{pk}';"
-                try:
-                    self.db.run(update_query)
-                except Exception as e:
-                    print(f"error updating row {pk}: {e}")
-                    continue
+            n_cols = len(cols_to_clean)
+            n_rows = 0
+            for rows in batches:
+                # clean changed values only, unchanged ones are left as NULL
+                values = [
+                    value if is_changed else None
+                    for row in rows
+                    for value, is_changed in zip(row[1 : 1 + n_cols], row[1 + n_cols :])
+                ]
+                cleaned = list(executor.map(_clean_html_value, values, chunksize=64))
+
+                # copy cleaned rows to staging table
+                buf = io.StringIO()
+                for i, row in enumerate(rows):
+                    buf.write(
+                        _copy_text_row([row[0], *cleaned[i * n_cols : (i + 1) * n_cols]])
+                    )
+                buf.seek(0)
+                cur.copy_expert(
+                    f"COPY {staging} ({primary_key}, {cols_str}) FROM STDIN", buf
+                )
+                n_rows += len(rows)
+                rate = n_rows / (time.perf_counter() - start_time)
+                print(f"cleaned {n_rows} rows ({rate:.0f} rows/s)")
 
-    def embed_objs(self, data_table: str, cols_to_embed: list, pk: str):
+            # apply cleaned values & store their hashes
+            set_cols = ", ".join(
+                f"{col} = COALESCE(s.{col}, t.{col})" for col in cols_to_clean
+            )
+            cur.execute(
+                f"""
+                UPDATE {data_table} t SET {set_cols}
+                FROM {staging} s WHERE t.{primary_key} = s.{primary_key};
+                """
+            )
+            cur.execute(
+                f"""
+                INSERT INTO {hash_table} ({primary_key}, {", ".join(hash_cols)})
+                SELECT t.{primary_key}, {", ".join(f"md5(t.{col})" for col in cols_to_clean)}
+                FROM {data_table} t JOIN {staging} s ON t.{primary_key} = s.{primary_key}
+                ON CONFLICT ({primary_key}) DO UPDATE SET
+                {", ".join(f"{c} = EXCLUDED.{c}" for c in hash_cols)};
+                """
+            )
+        if n_rows:
+            bump_data_version()
+        print(f"cleaned html in {n_rows} rows in {time.perf_counter() - start_time:.1f}s")
+
+    def embed_objs(
+        self,
+        data_table: str,
+        cols_to_embed: list,
+        pk: str,
+        bulk: bool = True,
+        batch_size: int = EMB_WRITE_BATCH_SIZE,
+        incremental: bool = False,
+        chunk_size: int = EMB_CHUNK_SIZE,
+        storage: str = EMB_STORAGE,
+        snapshot: bool = EMB_SNAPSHOT_ENABLED,
+        ann: bool = ANN_ENABLED,
+        lexical: bool = SIM_SEARCH_MODE != "vector",
+        pipeline: "EmbeddingPipeline" = None,
+    ):
         """
         Create new column in table with embeddings.
+        Rows are streamed, embedded & written in chunks by the embedding pipeline,
+        and an interrupted run resumes after the last written chunk.
+        The embeddings are then exported to a memory-mapped snapshot for sim search.
         Args:
             data_table (str): name of table
             cols_to_embed (list): list of column names to embed
             pk (str): name of the primary key or unique identifier column
+            bulk (bool): write embeddings with COPY & a single UPDATE instead of one UPDATE per row
+            batch_size (int): number of rows per COPY batch in bulk mode
+            incremental (bool): only embed rows whose text changed since they were last embedded
+            chunk_size (int): number of rows read, embedded & written at a time
+            storage (str): embeddings storage: "float32" or "int8" packed in BYTEA
+                columns, or "float64" in a DOUBLE PRECISION[] column
+            snapshot (bool): export the embeddings to a snapshot
+            ann (bool): build the ANN index, or update it with the embedded rows
+                in incremental mode
+            lexical (bool): build the lexical index of the embedded text, or
+                update it with the embedded rows in incremental mode
+            pipeline (EmbeddingPipeline): embedding pipeline (default: embeddings
+                model, tokenizer & checkpoint of the config)
         """
-        # check and create a column for embeddings if it doesn't exist
-        embs_col_name = "embeddings"
-        self.db.run(
-            f"ALTER TABLE {data_table} ADD COLUMN IF NOT EXISTS {embs_col_name} DOUBLE PRECISION[];"
-        )
+        # check and create the columns for embeddings if they don't exist
+        emb_cols = EMB_COLUMNS[storage]
+        for col, col_type in emb_cols.items():
+            self.db.run(
+                f"ALTER TABLE {data_table} ADD COLUMN IF NOT EXISTS {col} {col_type};"
+            )
+        # hash of the embedded text, to detect changes
+        self.db.run(f"ALTER TABLE {data_table} ADD COLUMN IF NOT EXISTS embs_hash TEXT;")
 
-        # get column values to embed and the ids
         cols_to_embed_str = ", ".join(cols_to_embed)
-        result_str = self.db.run(f"SELECT {pk}, {cols_to_embed_str} FROM {data_table}")
-        ids_and_values = literal_eval(result_str)
-        ids = [row[0] for row in ids_and_values]
-        column_values = [" ".join(map(str, row[1:])) for row in ids_and_values]
-
-        # create embeddings
-        embs_model = AzureOpenAIEmbeddings(
-            azure_deployment="text-embedding-ada-002"
-        )  # instantiate embeddings model
-        embeddings = embs_model.embed_documents(column_values)
-
-        # update table with embeddings
-        for i, id in enumerate(ids):
-            embedding = embeddings[i]
-            query = f"UPDATE {data_table} SET {embs_col_name} = ARRAY{embedding} WHERE {pk} = '{id}';"
-            try:
-                self.db.run(query)
-            except Exception as e:
-                print(f"an error occurred: {e}")
+        text_hash = f"md5(ROW({cols_to_embed_str})::text)"
+
+        def read_chunks(after_key):
+            # stream ids & column values to embed, ordered by id
+            select_query = f"SELECT {pk}, {cols_to_embed_str} FROM {data_table} WHERE TRUE"
+            if incremental:
+                # also rows not yet embedded in this storage format
+                missing = " OR ".join(f"{col} IS NULL" for col in emb_cols)
+                select_query += f" AND ({text_hash} IS DISTINCT FROM embs_hash OR {missing})"
+            if after_key is not None:
+                select_query += f" AND {pk} > %s"
+            select_query += f" ORDER BY {pk};"
+            params = (after_key,) if after_key is not None else None
+            for rows in self.iter_batches(select_query, params, fetch_size=chunk_size):
+                yield [(row[0], " ".join(map(str, row[1:]))) for row in rows]
+
+        embedded_ids = []
+
+        def write_chunk(ids, embeddings):
+            embedded_ids.extend(ids)
+            # update table with embeddings
+            if bulk:
+                self.write_embs(
+                    data_table,
+                    pk,
+                    ids,
+                    embeddings,
+                    storage=storage,
+                    batch_size=batch_size,
+                    extra_set=f"embs_hash = {text_hash}",
+                )
+                return
+            values = encode_embs(embeddings, storage)  # column -> value per row
+            set_cols = ", ".join(f"{col} = %s" for col in values)
+            query = f"UPDATE {data_table} SET {set_cols}, embs_hash = {text_hash} WHERE {pk} = %s;"
+            for i, id in enumerate(ids):
+                try:
+                    self.query(query, (*[col[i] for col in values.values()], id))
+                except Exception as e:
+                    print(f"an error occurred: {e}")
 
-        print(f"embeddings col {embs_col_name} created successfully.")
+        if pipeline is None:
+            from src.emb_pipeline import EmbeddingPipeline
+
+            pipeline = EmbeddingPipeline()
+        n_embedded = pipeline.run(
+            f"sql:{data_table}:{cols_to_embed_str}", read_chunks, write_chunk
+        )
+
+        if n_embedded:  # unchanged data keeps its version, e.g. for eval resumes
+            invalidate_emb_index(data_table)  # reload sim search index on next use
+            bump_data_version()
+        print(f"embeddings cols {', '.join(emb_cols)} created successfully.")
+        if snapshot:
+            # keyed by pyid, as the index loaded from the table
+            self.export_emb_snapshot(data_table, storage=storage)
+        # sim search indexes are keyed by pyid
+        embedded_pyids = None
+        if incremental and (ann or lexical):
+            embedded_pyids = self.to_pyids(data_table, pk, embedded_ids)
+        if ann:
+            # rebuilt on full runs, as embeddings of all rows may have changed
+            self.update_ann_index(data_table, ids=embedded_pyids, storage=storage)
+        if lexical:
+            self.update_lexical_index(data_table, cols_to_embed, ids=embedded_pyids)
+
+    def to_pyids(
+        self, data_table: str, pk: str, ids: list, batch_size: int = EMB_CHUNK_SIZE
+    ) -> list:
+        """
+        pyids of the rows of a table with some primary keys.
+        Args:
+            data_table (str): name of table
+            pk (str): name of the primary key column
+            ids (list): primary keys of the rows
+            batch_size (int): number of ids looked up at a time
+        """
+        if pk == "pyid":
+            return list(ids)
+        pyids = []
+        for start in range(0, len(ids), batch_size):
+            rows = self.query(
+                f"SELECT pyid FROM {data_table} WHERE {pk} = ANY(%s);",
+                (list(ids[start : start + batch_size]),),
+            )
+            pyids.extend(row[0] for row in rows)
+        return pyids
+
+    def export_emb_snapshot(
+        self,
+        data_table: str,
+        id_col: str = "pyid",
+        label_col: str = "pylabel",
+        storage: str = EMB_STORAGE,
+        path: str = EMB_SNAPSHOT_DIR,
+        batch_size: int = EMB_CHUNK_SIZE,
+    ) -> str:
+        """
+        Export the embeddings of a table to a new snapshot version, which the
+        worker processes memory-map instead of each loading the table.
+        Args:
+            data_table (str): name of table
+            id_col (str): name of id column
+            label_col (str): name of label column
+            storage (str): embeddings storage of the table, an "int8" snapshot
+                also holds int8 codes
+            path (str): directory of the snapshots
+            batch_size (int): number of rows read at a time
+        Returns:
+            version (str): the new snapshot version
+        """
+        start_time = time.perf_counter()
+        embs_col = "embeddings" if storage == "float64" else "embeddings_f32"
+        fields = facet_cols(self, data_table)  # filterable fields of the table
+        writer = SnapshotWriter(
+            snapshot_name(data_table), path, quantize=storage == "int8", facets=fields
+        )
+        try:
+            batches = self.iter_batches(
+                f"SELECT {', '.join([id_col, label_col, embs_col, *fields])} "
+                f"FROM {data_table} WHERE {embs_col} IS NOT NULL;",
+                fetch_size=batch_size,
+            )
+            for rows in batches:
+                ids, labels, embs, *values = zip(*rows)
+                if storage == "float64":
+                    embs = np.asarray(embs, dtype=np.float32)
+                else:
+                    embs = decode_f32(embs)
+                writer.add(ids, labels, embs, facets=dict(zip(fields, values)))
+            version = writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+        print(
+            f"embeddings snapshot {version} of {data_table} exported: "
+            f"{writer.n_rows} rows in {time.perf_counter() - start_time:.1f}s"
+        )
+        return version
+
+    def write_embs(
+        self,
+        data_table: str,
+        pk: str,
+        ids: list,
+        embeddings: list,
+        storage: str = EMB_STORAGE,
+        batch_size: int = EMB_WRITE_BATCH_SIZE,
+        extra_set: str = None,
+    ):
+        """
+        Bulk write embeddings: stream (pk, embedding) rows into a staging table with
+        binary COPY, then apply them with a single UPDATE ... FROM. Embeddings are
+        copied as float4[] for "float64" storage, or packed as BYTEA otherwise.
+        Args:
+            data_table (str): name of table
+            pk (str): name of the primary key column
+            ids (list): primary keys of the rows
+            embeddings (list): embeddings of the rows, in the same order as ids
+            storage (str): embeddings storage: "float64", "float32" or "int8"
+            batch_size (int): number of rows per COPY batch
+            extra_set (str): extra assignments for the UPDATE, e.g. "col = expr"
+        """
+        emb_cols = EMB_COLUMNS[storage]
+        staging = "embs_staging"
+        n_rows = len(ids)
+        start_time = time.perf_counter()
+        with self._raw_conn() as conn:
+            cur = conn.cursor()
+            # cast staging keys to the type of the pk, so the join can use its index
+            cur.execute(
+                f"SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                f"WHERE attrelid = '{data_table}'::regclass AND attname = '{pk}';"
+            )
+            (pk_type,) = cur.fetchone()
+            staging_cols = ", ".join(
+                f"{col} {'REAL[]' if storage == 'float64' else 'BYTEA'}"
+                for col in emb_cols
+            )
+            cur.execute(
+                f"CREATE TEMP TABLE {staging} (pk TEXT, {staging_cols}) ON COMMIT DROP;"
+            )
+
+            # stream batches into staging table
+            copy_cols = ", ".join(emb_cols)
+            for i in range(0, n_rows, batch_size):
+                batch_ids = ids[i : i + batch_size]
+                batch_embs = embeddings[i : i + batch_size]
+                if storage == "float64":
+                    buf = _copy_binary_embs(batch_ids, batch_embs)
+                else:
+                    buf = _copy_binary_blobs(batch_ids, encode_embs(batch_embs, storage))
+                cur.copy_expert(
+                    f"COPY {staging} (pk, {copy_cols}) FROM STDIN BINARY", buf
+                )
+                done = min(i + batch_size, n_rows)
+                rate = done / (time.perf_counter() - start_time)
+                print(f"copied {done}/{n_rows} embeddings ({rate:.0f} rows/s)")
+
+            # apply all embeddings at once
+            set_cols = ", ".join(
+                f"{col} = s.{col}::{col_type}" for col, col_type in emb_cols.items()
+            )
+            cur.execute(
+                f"""
+                UPDATE {data_table} t SET {set_cols}
+                {f", {extra_set}" if extra_set else ""}
+                FROM {staging} s WHERE t.{pk} = s.pk::{pk_type};
+                """
+            )
+            print(f"updated {cur.rowcount} rows in {time.perf_counter() - start_time:.1f}s")
+
+    def update_ann_index(
+        self,
+        data_table: str,
+        id_col: str = "pyid",
+        label_col: str = "pylabel",
+        ids: list = None,
+        storage: str = EMB_STORAGE,
+        path: str = ANN_DIR,
+        batch_size: int = EMB_CHUNK_SIZE,
+    ) -> str:
+        """
+        Build the ANN index of a table, or update it for some rows: rows with an
+        embedding are inserted or updated, rows gone or without one are deleted.
+        The index is saved as a new version, picked up by the worker processes.
+        Args:
+            data_table (str): name of table
+            id_col (str): name of id column
+            label_col (str): name of label column
+            ids (list): ids of the rows to update, or None to rebuild the index
+            storage (str): embeddings storage of the table
+            path (str): directory of the indexes
+            batch_size (int): number of rows read at a time
+        Returns:
+            version (str): the new index version
+        """
+        start_time = time.perf_counter()
+        name = snapshot_name(data_table)
+        index = AnnIndex.load(name, path) if ids is not None else None
+        if index is None:
+            ids = None  # nothing to update, build it
+        embs_col = "embeddings" if storage == "float64" else "embeddings_f32"
+        select_query = (
+            f"SELECT {id_col}, {label_col}, {embs_col} FROM {data_table} "
+            f"WHERE {embs_col} IS NOT NULL"
+        )
+        if ids is None:
+            (n_rows,) = self.query(
+                f"SELECT COUNT(*) FROM {data_table} WHERE {embs_col} IS NOT NULL;"
+            )[0]
+            batches = self.iter_batches(f"{select_query};", fetch_size=batch_size)
+        else:
+            batches = (
+                self.query(
+                    f"{select_query} AND {id_col} = ANY(%s);",
+                    (list(ids[start : start + batch_size]),),
+                )
+                for start in range(0, len(ids), batch_size)
+            )
+
+        seen = set()
+        for rows in batches:
+            if not rows:
+                continue
+            batch_ids, labels, embs = zip(*rows)
+            if storage == "float64":
+                embs = np.asarray(embs, dtype=np.float32)
+            else:
+                embs = decode_f32(embs)
+            if index is None:
+                index = AnnIndex(embs.shape[1], max_elements=max(n_rows, 1))
+            index.upsert(batch_ids, labels, embs)
+            seen.update(batch_ids)
+        if index is None:
+            print(f"no embeddings in {data_table}, ANN index not built")
+            return None
+        n_deleted = index.delete([id for id in ids if id not in seen]) if ids else 0
+
+        version = index.save(name, path)
+        invalidate_ann_index(data_table)
+        print(
+            f"ANN index {version} of {data_table} "
+            f"{'built' if ids is None else 'updated'}: {len(seen)} rows upserted, "
+            f"{n_deleted} deleted in {time.perf_counter() - start_time:.1f}s"
+        )
+        return version
+
+    def update_lexical_index(
+        self,
+        data_table: str,
+        cols_to_embed: list = COLS_TO_EMBED,
+        ids: list = None,
+        id_col: str = "pyid",
+        label_col: str = "pylabel",
+        path: str = LEXICAL_DIR,
+        batch_size: int = EMB_CHUNK_SIZE,
+    ):
+        """
+        Build the lexical index of the embedded text of a table, or update it
+        for some rows: rows still in the table are re-indexed, others deleted.
+        Args:
+            data_table (str): name of table
+            cols_to_embed (list): list of embedded column names
+            ids (list): ids of the rows to update, or None to rebuild the index
+            id_col (str): name of id column
+            label_col (str): name of label column
+            path (str): directory of the indexes
+            batch_size (int): number of rows read at a time
+        """
+        start_time = time.perf_counter()
+        name = snapshot_name(data_table)
+        index = LexicalIndex.load(name, path) if ids is not None else None
+        if index is None:
+            index, ids = LexicalIndex(), None  # nothing to update, build it
+        select_query = (
+            f"SELECT {', '.join([id_col, label_col, *cols_to_embed])} FROM {data_table}"
+        )
+        if ids is None:
+            batches = self.iter_batches(f"{select_query};", fetch_size=batch_size)
+        else:
+            batches = (
+                self.query(
+                    f"{select_query} WHERE {id_col} = ANY(%s);",
+                    (list(ids[start : start + batch_size]),),
+                )
+                for start in range(0, len(ids), batch_size)
+            )
+
+        seen = set()
+        for rows in batches:
+            # same text as embedded
+            index.upsert(
+                [row[0] for row in rows],
+                [row[1] for row in rows],
+                [" ".join(map(str, row[2:])) for row in rows],
+            )
+            seen.update(row[0] for row in rows)
+        n_deleted = index.delete([id for id in ids if id not in seen]) if ids else 0
+        index.save(name, path)
+        print(
+            f"lexical index of {data_table} {'built' if ids is None else 'updated'}: "
+            f"{len(seen)} rows indexed, {n_deleted} deleted "
+            f"in {time.perf_counter() - start_time:.1f}s"
+        )
+
+    def query(self, sql: str, params=None) -> list:
+        """
+        Run a query and return its rows as tuples of python values.
+        Args:
+            sql (str): sql query, with %s placeholders for params
+            params (tuple | dict): query parameters
+        """
+        with self._raw_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            return cur.fetchall() if cur.description else []
+
+    def query_records(
+        self,
+        sql: str,
+        params=None,
+        max_rows: int = None,
+        timeout: float = None,
+        read_only: bool = False,
+    ):
+        """
+        Run a query and return up to `max_rows` rows as dicts of column name -> value.
+        Args:
+            sql (str): sql query, with %s placeholders for params
+            params (tuple | dict): query parameters
+            max_rows (int): max number of rows to fetch (default: all)
+            timeout (float): statement timeout in seconds (default: none)
+            read_only (bool): run the query in a read-only transaction
+        Returns:
+            records (list): rows as dicts
+            truncated (bool): whether the query had more rows
+        """
+        with self._raw_conn() as conn:
+            cur = conn.cursor()
+            if read_only:
+                cur.execute("SET TRANSACTION READ ONLY;")
+            if timeout:
+                cur.execute("SET LOCAL statement_timeout = %s;", (int(timeout * 1000),))
+            cur.execute(sql, params)
+            if not cur.description:
+                return [], False
+            names = [col.name for col in cur.description]
+            if max_rows is None:
+                rows, truncated = cur.fetchall(), False
+            else:
+                rows = cur.fetchmany(max_rows + 1)
+                truncated = len(rows) > max_rows
+                rows = rows[:max_rows]
+            return [dict(zip(names, row)) for row in rows], truncated
+
+    def explain(self, sql: str, params=None) -> dict:
+        """
+        Estimated plan of a query, without running it.
+        Args:
+            sql (str): sql query, with %s placeholders for params
+            params (tuple | dict): query parameters
+        Returns:
+            plan (dict): top plan node, with "Total Cost", "Plan Rows" & "Plans"
+        """
+        (plan,) = self.query(f"EXPLAIN (FORMAT JSON) {sql}", params)[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def iter_rows(self, sql: str, params=None, fetch_size: int = QUERY_FETCH_SIZE):
+        """
+        Stream the rows of a query as tuples, from a server-side cursor.
+        Args:
+            sql (str): sql query, with %s placeholders for params
+            params (tuple | dict): query parameters
+            fetch_size (int): number of rows fetched from the server at a time
+        """
+        for rows in self.iter_batches(sql, params, fetch_size=fetch_size):
+            yield from rows
+
+    def iter_batches(
+        self,
+        sql: str,
+        params=None,
+        fetch_size: int = QUERY_FETCH_SIZE,
+        fmt: Literal["tuples", "numpy", "arrow"] = "tuples",
+    ):
+        """
+        Stream the rows of a query in batches, from a server-side cursor.
+        Args:
+            sql (str): sql query, with %s placeholders for params
+            params (tuple | dict): query parameters
+            fetch_size (int): number of rows per batch
+            fmt (str): batch format: list of tuples, dict of column name -> numpy
+                array, or pyarrow RecordBatch
+        """
+        if fmt == "arrow":
+            import pyarrow as pa  # optional dependency
+
+        with self._raw_conn() as conn:
+            cur = conn.cursor(name=f"iter_batches_{id(conn)}")  # server-side cursor
+            cur.itersize = fetch_size
+            cur.execute(sql, params)
+            while rows := cur.fetchmany(fetch_size):
+                if fmt == "tuples":
+                    yield rows
+                    continue
+                names = [col.name for col in cur.description]
+                cols = dict(zip(names, map(list, zip(*rows))))
+                if fmt == "numpy":
+                    yield {name: _to_numpy(values) for name, values in cols.items()}
+                else:
+                    yield pa.RecordBatch.from_pydict(cols)
+            cur.close()
+
+    @contextmanager
+    def _raw_conn(self):
+        """
+        Raw DBAPI (psycopg2) connection from the engine's pool, committed on success.
+        """
+        conn = self.db._engine.raw_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
     def drop_cols(self, table_name: str, cols_to_drop: list):
         """
@@ -180,118 +877,745 @@ class SQLDBManager:
         """
         Get column names from table.
         """
-        select_cols_q = f"""
+        select_cols_q = """
             SELECT column_name
             FROM information_schema.columns
-            WHERE table_schema = '{schema}'
-            AND table_name = '{table}';
+            WHERE table_schema = %s
+            AND table_name = %s;
         """
-        cols = self.db.run(select_cols_q)
-        cols = literal_eval(cols)
+        cols = self.query(select_cols_q, (schema, table))
         cols = [col[0] for col in cols]
 
         return cols
 
 
+def _to_numpy(values: list):
+    """
+    Convert a column of values to a numpy array, with object dtype if ragged or mixed.
+    """
+    try:
+        arr = np.array(values)
+    except ValueError:
+        arr = None
+    mixed = arr is not None and arr.dtype.kind == "U" and not all(
+        isinstance(v, str) for v in values
+    )
+    if arr is None or mixed:
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+    return arr
+
+
+def _connect_postgres():
+    """
+    Open a psycopg2 connection using environment variables.
+    """
+    import psycopg2
+
+    host, port, db, user, password = load_postgres_env_variables()
+    return psycopg2.connect(
+        f"host={host} port={port} dbname={db} user={user} password={password}"
+    )
+
+
+# derived columns of a data table, rewritten by embed_objs: not loaded as node
+# properties, nor hashed (re-embedding would mark every row as changed)
+NODE_EXCLUDED_COLS = {col for cols in EMB_COLUMNS.values() for col in cols} | {
+    "embs_hash"
+}
+
+
+def _node_cols(conn, table: str) -> str:
+    """
+    Select list of the columns of a table loaded as node properties.
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT * FROM {table} LIMIT 0;")
+    cols = [
+        '"' + col.name.replace('"', '""') + '"'
+        for col in cur.description
+        if col.name not in NODE_EXCLUDED_COLS
+    ]
+    cur.close()
+    return ", ".join(cols)
+
+
+def _to_neo4j_value(value):
+    """
+    Convert a postgres value to a type supported as a neo4j property.
+    """
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, memoryview):  # BYTEA
+        return bytes(value)
+    if isinstance(value, (dict, tuple)):
+        return str(value)
+    return value
+
+
+def _clean_html_value(text):
+    """
+    Convert html to text, in a worker process.
+    """
+    from html2text import html2text
+
+    return html2text(text) if text else None
+
+
+def _copy_text_row(values: list) -> str:
+    """
+    Encode a row in postgres text COPY format.
+    """
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append("\\N")
+        else:
+            fields.append(
+                str(value)
+                .replace("\\", "\\\\")
+                .replace("\t", "\\t")
+                .replace("\n", "\\n")
+                .replace("\r", "\\r")
+            )
+    return "\t".join(fields) + "\n"
+
+
+def _copy_binary_embs(ids: list, embeddings: list) -> io.BytesIO:
+    """
+    Encode (id, embedding) rows in postgres binary COPY format, as (text, float4[]).
+    """
+    embs = np.asarray(embeddings, dtype=np.float32)
+    n_dims = embs.shape[1] if embs.ndim == 2 else 0
+    # each array element is (length, big-endian float4)
+    elems = np.empty(embs.shape, dtype=[("len", ">i4"), ("val", ">f4")])
+    elems["len"] = 4
+    elems["val"] = embs
+    # ndim, has nulls, element type (float4), dim size, lower bound
+    arr_header = struct.pack(">iiiii", 1, 0, 700, n_dims, 1)
+    arr_len = len(arr_header) + 8 * n_dims
+
+    buf = io.BytesIO()
+    buf.write(b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0))
+    for id, row in zip(ids, elems):
+        id_bytes = str(id).encode()
+        buf.write(struct.pack(">hi", 2, len(id_bytes)) + id_bytes)
+        buf.write(struct.pack(">i", arr_len) + arr_header + row.tobytes())
+    buf.write(struct.pack(">h", -1))
+    buf.seek(0)
+    return buf
+
+
+def _copy_binary_blobs(ids: list, columns: dict) -> io.BytesIO:
+    """
+    Encode (id, blob, ...) rows in postgres binary COPY format, as (text, bytea, ...).
+    Args:
+        ids (list): ids of the rows
+        columns (dict): column name -> blob of each row
+    """
+    cols = list(columns.values())
+    buf = io.BytesIO()
+    buf.write(b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0))
+    for i, id in enumerate(ids):
+        id_bytes = str(id).encode()
+        buf.write(struct.pack(">hi", 1 + len(cols), len(id_bytes)) + id_bytes)
+        for col in cols:
+            buf.write(struct.pack(">i", len(col[i])) + col[i])
+    buf.write(struct.pack(">h", -1))
+    buf.seek(0)
+    return buf
+
+
 class Neo4jGraphManager:
     """
     Class for managing Neo4j graph database.
     """
 
     def __init__(self):
-        pass
+        self._vector_indexes = None  # cached by vector_indexes
 
     @classmethod
-    def from_env(cls):
+    def from_env(cls, pool_size: int = None):
         """
         Connect to database using environment variables.
+        Args:
+            pool_size (int): max size of the driver's connection pool (default: neo4j's)
         """
+        import neo4j
+        from langchain.graphs import Neo4jGraph
+
         instance = cls()
         instance.graph = Neo4jGraph()
+        if pool_size:
+            # replace the default driver with one using the given pool size
+            url, username, password, db = load_neo4j_env_variables()
+            instance.graph._driver.close()
+            instance.graph._driver = neo4j.GraphDatabase.driver(
+                url,
+                auth=(username, password),
+                max_connection_pool_size=pool_size,
+                liveness_check_timeout=0,  # check connections before handing them out
+            )
         return instance
 
-    def from_table(self, table: str, reset=True):
+    def ping(self) -> bool:
+        """
+        Check that the database is reachable.
+        """
+        try:
+            self.graph._driver.verify_connectivity()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        """
+        Close the driver and its connections.
+        """
+        self.graph._driver.close()
+
+    def from_table(
+        self,
+        table: str,
+        reset=True,
+        batch_size: int = GRAPH_WRITE_BATCH_SIZE,
+        chunk_size: int = QUERY_FETCH_SIZE,
+    ):
         """
-        Create a neo4j graph from a table (in string format)
+        Create a neo4j graph from a table.
+        Rows are read from a server-side cursor in chunks, grouped by objclass and
+        written with batched `UNWIND` queries, so tables larger than memory can be loaded.
         Args:
             table (str): name of table
             reset (bool): reset graph if it already exists
+            batch_size (int): number of nodes created per transaction
+            chunk_size (int): number of rows read from the table at a time
         """
-        # table_data = parse_db_output(table) # convert string to list of tuples
-        # connect to postgres db
-        host, port, db, user, password = load_postgres_env_variables()
-        conn = psycopg2.connect(
-            f"host={host} port={port} dbname={db} user={user} password={password}"
-        )
-
-        # fetch data from table
-        query = f"SELECT * FROM {table};"
-        df = pd.read_sql(query, conn)
-        conn.close()
+        conn = _connect_postgres()  # connect to postgres db
 
         if reset:
             # clear graph (in case it already exists)
             self.graph.query("MATCH (n) DETACH DELETE n")
+        self.create_constraints()  # index pyid before loading
 
-        # iter over df rows
-        for _, row in df.iterrows():
-            # convert tuple to dict
-            # row_dict = {cols[i]: row[i] for i in range(len(cols))}
-            row_dict = row.to_dict()
-            obj_class = row_dict.get("objclass", "Object")
-            # create a node for each row with dynamic properties
-            self.graph.query(
-                f"CREATE (n:{obj_class}) SET n += $props", {"props": row_dict}
+        # fetch data from table in chunks & write nodes in batches per objclass
+        start_time = time.perf_counter()
+        n_nodes = 0
+        batches = {}  # objclass -> rows waiting to be written
+        try:
+            node_cols = _node_cols(conn, table)
+            cur = conn.cursor(name="from_table_read")  # server-side cursor
+            cur.itersize = chunk_size
+            # keep a hash of each row, for incremental syncs
+            cur.execute(
+                f"SELECT {node_cols}, md5(ROW({node_cols})::text) AS row_hash "
+                f"FROM {table} t;"
             )
+            cols = None
+            while rows := cur.fetchmany(chunk_size):
+                cols = cols or [col.name for col in cur.description]
+                for row in rows:
+                    row_dict = {
+                        col: _to_neo4j_value(value) for col, value in zip(cols, row)
+                    }
+                    obj_class = row_dict.get("objclass") or "Object"
+                    batch = batches.setdefault(obj_class, [])
+                    batch.append(row_dict)
+                    if len(batch) >= batch_size:
+                        n_nodes += self._write_nodes(obj_class, batch)
+                        batches[obj_class] = []
+                rate = n_nodes / (time.perf_counter() - start_time)
+                print(f"created {n_nodes} nodes ({rate:.0f} nodes/s)")
+            cur.close()
+        finally:
+            conn.close()
+        for obj_class, batch in batches.items():
+            n_nodes += self._write_nodes(obj_class, batch)
+        print(f"created {n_nodes} nodes in {time.perf_counter() - start_time:.1f}s")
 
         # create relationships ---> Note: This is specific to the data model, adjust as needed
-        # user stories belonging to epics
-        self.graph.query(
-            """
-            MATCH (us:UserStory), (epic:Epic) WHERE us.epicid = epic.pyid
-            MERGE (us)-[:IS_STORY_OF_EPIC]->(epic)
-            """
-        )
-        # epics belonging to goals
-        self.graph.query(
-            """
-            MATCH (epic:Epic), (goal:Goal) WHERE epic.goalid = goal.pyid
-            MERGE (epic)-[:IS_EPIC_OF_GOAL]->(goal)
-            """
+        self.create_relationships()
+        bump_data_version()
+
+    def sync_from_table(
+        self,
+        table: str,
+        batch_size: int = GRAPH_WRITE_BATCH_SIZE,
+    ):
+        """
+        Incrementally sync the graph with a table: upsert only nodes whose row is
+        new or changed, and delete nodes whose row is gone. Rows are compared by
+        the hash kept in the `row_hash` property of each node. Upserted nodes have
+        their embedding cleared, so `embed_objs` only re-embeds them.
+        Args:
+            table (str): name of table
+            batch_size (int): number of nodes written per transaction
+        """
+        start_time = time.perf_counter()
+        self.create_constraints()
+
+        # hashes of the rows in the table & the nodes in the graph
+        conn = _connect_postgres()
+        try:
+            node_cols = _node_cols(conn, table)
+            cur = conn.cursor()
+            cur.execute(f"SELECT pyid, md5(ROW({node_cols})::text) FROM {table} t;")
+            table_hashes = dict(cur.fetchall())
+            nodes = self.graph.query(
+                """
+                MATCH (n) WHERE n.pyid IS NOT NULL
+                RETURN n.pyid AS pyid, labels(n)[0] AS label, n.row_hash AS row_hash
+                """
+            )
+            graph_nodes = {n["pyid"]: (n["label"], n["row_hash"]) for n in nodes}
+            changed = [
+                pyid
+                for pyid, row_hash in table_hashes.items()
+                if graph_nodes.get(pyid, (None, None))[1] != row_hash
+            ]
+
+            # fetch changed rows only
+            to_write = {}  # objclass -> rows
+            to_delete = {}  # label -> pyids
+            for i in range(0, len(changed), batch_size):
+                cur.execute(
+                    f"""
+                    SELECT {node_cols}, md5(ROW({node_cols})::text) AS row_hash
+                    FROM {table} t WHERE pyid = ANY(%s);
+                    """,
+                    (changed[i : i + batch_size],),
+                )
+                cols = [col.name for col in cur.description]
+                for row in cur.fetchall():
+                    row_dict = {
+                        col: _to_neo4j_value(value) for col, value in zip(cols, row)
+                    }
+                    obj_class = row_dict.get("objclass") or "Object"
+                    to_write.setdefault(obj_class, []).append(row_dict)
+                    # node must be re-created if its class changed
+                    label = graph_nodes.get(row_dict["pyid"], (None, None))[0]
+                    if label is not None and label != obj_class:
+                        to_delete.setdefault(label, []).append(row_dict["pyid"])
+            cur.close()
+        finally:
+            conn.close()
+
+        # delete nodes that are gone from the table
+        for pyid, (label, _) in graph_nodes.items():
+            if pyid not in table_hashes:
+                to_delete.setdefault(label, []).append(pyid)
+        n_deleted = 0
+        for label, pyids in to_delete.items():
+            for i in range(0, len(pyids), batch_size):
+                self._write(
+                    f"UNWIND $pyids AS pyid MATCH (n:`{label}` {{pyid: pyid}}) DETACH DELETE n",
+                    pyids=pyids[i : i + batch_size],
+                )
+            n_deleted += len(pyids)
+
+        # upsert new & changed nodes
+        n_upserted = 0
+        for obj_class, rows in to_write.items():
+            for i in range(0, len(rows), batch_size):
+                n_upserted += self._write_nodes(
+                    obj_class, rows[i : i + batch_size], merge=True
+                )
+
+        # re-create relationships of upserted nodes
+        if changed:
+            self.create_relationships(pyids=changed, batch_size=batch_size)
+        if changed or n_deleted:
+            bump_data_version()
+        print(
+            f"graph synced: {n_upserted} upserted, {n_deleted} deleted "
+            f"in {time.perf_counter() - start_time:.1f}s"
         )
-        # goals belonging to projects
-        # Note: Adjust the label for projects if you have a specific one
-        self.graph.query(
-            """
-            MATCH (goal:Goal), (project:Project) WHERE goal.projectid = project.pyid
-            MERGE (goal)-[:IS_GOAL_OF_PROJECT]->(project)
+
+    def create_constraints(
+        self, obj_types: list = GRAPH_OBJ_TYPES, rel_specs: list = GRAPH_REL_SPECS
+    ):
+        """
+        Create a uniqueness constraint (and so an index) on pyid for each object
+        type, and an index on each parent key property.
+        Args:
+            obj_types (list): list of object types
+            rel_specs (list): list of (child label, parent key, parent label, relationship type)
+        """
+        for obj in obj_types:
+            self.graph.query(
+                f"""
+                CREATE CONSTRAINT {obj.lower()}_pyid IF NOT EXISTS
+                FOR (n:`{obj}`) REQUIRE n.pyid IS UNIQUE
+                """
+            )
+        for child, parent_key, _, _ in rel_specs:
+            self.graph.query(
+                f"""
+                CREATE INDEX {child.lower()}_{parent_key} IF NOT EXISTS
+                FOR (n:`{child}`) ON (n.`{parent_key}`)
+                """
+            )
+        self.graph.query("CALL db.awaitIndexes()")  # wait for indexes to be online
+
+    def create_relationships(
+        self,
+        rel_specs: list = GRAPH_REL_SPECS,
+        batch_size: int = GRAPH_WRITE_BATCH_SIZE,
+        pyids: list = None,
+    ):
+        """
+        Create relationships from child nodes to the parent nodes referenced by
+        their parent key properties. Parents are looked up through the pyid index,
+        in batched transactions.
+        Args:
+            rel_specs (list): list of (child label, parent key, parent label, relationship type)
+            batch_size (int): number of child nodes per transaction
+            pyids (list): only (re-)create relationships from or to these nodes
+        """
+        for child, parent_key, parent, rel_type in rel_specs:
+            start_time = time.perf_counter()
+            child_filter = f"child.`{parent_key}` IS NOT NULL"
+            if pyids is not None:
+                # drop relationships of changed children, their parent may have changed
+                self.graph.query(
+                    f"""
+                    MATCH (child:`{child}`)-[r:`{rel_type}`]->()
+                    WHERE child.pyid IN $pyids DELETE r
+                    """,
+                    {"pyids": pyids},
+                )
+                child_filter = f"(child.pyid IN $pyids OR child.`{parent_key}` IN $pyids)"
+            self.graph.query(
+                f"""
+                MATCH (child:`{child}`) WHERE {child_filter}
+                CALL {{
+                    WITH child
+                    MATCH (parent:`{parent}` {{pyid: child.`{parent_key}`}})
+                    MERGE (child)-[:`{rel_type}`]->(parent)
+                }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+                """,
+                {"pyids": pyids},
+            )
+            print(
+                f"created {child}-[{rel_type}]->{parent} relationships "
+                f"in {time.perf_counter() - start_time:.1f}s"
+            )
+
+    def vector_indexes(self) -> dict:
+        """
+        Get the vector indexes in the graph, cached until indexes are created
+        by `create_vector_index` or `embed_objs`.
+        Returns:
+            indexes (dict): node label -> index name
+        """
+        if self._vector_indexes is not None:
+            return self._vector_indexes
+        try:
+            result = self.graph.query(
+                """
+                SHOW INDEXES YIELD name, type, labelsOrTypes
+                WHERE type = 'VECTOR' RETURN name, labelsOrTypes
+                """
+            )
+        except Exception:
+            return {}  # server without vector index support
+        self._vector_indexes = {
+            r["labelsOrTypes"][0]: r["name"] for r in result if r["labelsOrTypes"]
+        }
+        return self._vector_indexes
+
+    def _write_nodes(self, obj_class: str, rows: list, merge: bool = False) -> int:
+        """
+        Create (or merge on pyid) a node per row with a single `UNWIND` query.
+        Args:
+            obj_class (str): node label
+            rows (list): list of dicts of node properties
+            merge (bool): update existing nodes with the same pyid & clear their embedding
+        Returns:
+            n_nodes (int): number of nodes written
+        """
+        if not rows:
+            return 0
+        if merge:
+            query = f"""
+            UNWIND $rows AS row MERGE (n:`{obj_class}` {{pyid: row.pyid}})
+            SET n += row, n.embedding = null
             """
-        )
+        else:
+            query = f"UNWIND $rows AS row CREATE (n:`{obj_class}`) SET n += row"
+        self._write(query, rows=rows)
+        return len(rows)
+
+    def _write(self, query: str, **params):
+        """
+        Run a write query in an explicit transaction.
+        """
+        with self.graph._driver.session(database=self.graph._database) as session:
+            session.execute_write(lambda tx: tx.run(query, **params).consume())
+
+    def run_query(
+        self,
+        query: str,
+        params: dict = None,
+        max_rows: int = None,
+        timeout: float = None,
+        read_only: bool = False,
+    ):
+        """
+        Run a query with an optional timeout and return up to `max_rows` records.
+        Args:
+            query (str): cypher query
+            params (dict): query parameters
+            max_rows (int): max number of records to fetch (default: all)
+            timeout (float): transaction timeout in seconds (default: server's)
+            read_only (bool): run the query in read access mode, writes fail
+        Returns:
+            records (list): records as dicts
+            truncated (bool): whether the query had more records
+        """
+        import neo4j
+
+        access_mode = neo4j.READ_ACCESS if read_only else neo4j.WRITE_ACCESS
+        with self.graph._driver.session(
+            database=self.graph._database, default_access_mode=access_mode
+        ) as session:
+            result = session.run(neo4j.Query(query, timeout=timeout), params or {})
+            if max_rows is None:
+                return [record.data() for record in result], False
+            records = [record.data() for record in islice(result, max_rows + 1)]
+            result.consume()  # discard the remaining records
+            return records[:max_rows], len(records) > max_rows
+
+    def explain(self, query: str, params: dict = None) -> dict:
+        """
+        Estimated plan of a query, without running it.
+        Args:
+            query (str): cypher query
+            params (dict): query parameters
+        Returns:
+            plan (dict): root operator, with "operatorType", "args" & "children"
+        """
+        with self.graph._driver.session(database=self.graph._database) as session:
+            return session.run(f"EXPLAIN {query}", params or {}).consume().plan
 
     def embed_objs(
-        self, obj_types: list = GRAPH_OBJ_TYPES, cols_to_embed: list = COLS_TO_EMBED
+        self,
+        obj_types: list = GRAPH_OBJ_TYPES,
+        cols_to_embed: list = COLS_TO_EMBED,
+        chunk_size: int = EMB_CHUNK_SIZE,
+        snapshot: bool = EMB_SNAPSHOT_ENABLED,
+        lexical: bool = SIM_SEARCH_MODE != "vector",
+        pipeline: "EmbeddingPipeline" = None,
     ):
         """
         Get embeddings from text descriptions of objects in graph.
+        Nodes without an embedding are read, embedded & written in chunks by the
+        embedding pipeline, then a vector index is created per object type, and
+        the embeddings are exported to a memory-mapped snapshot for sim search.
         Args:
         - obj_types (list): list of object types
         - text_cols (list): list of text columns to embed
+        - chunk_size (int): number of nodes read, embedded & written at a time
+        - snapshot (bool): export the embeddings to a snapshot
+        - lexical (bool): rebuild the lexical index of the embedded text
+        - pipeline (EmbeddingPipeline): embedding pipeline (default: embeddings
+          model, tokenizer & checkpoint of the config)
         """
-        embs_model = AzureOpenAIEmbeddings(
-            azure_deployment="text-embedding-ada-002"
-        )  # instantiate embeddings model
+        if pipeline is None:
+            from src.emb_pipeline import EmbeddingPipeline
 
-        url, username, password, db = load_neo4j_env_variables()  # load neo4j env vars
+            pipeline = EmbeddingPipeline()
+        self._vector_indexes = None
+        n_embedded = 0
+        for obj in obj_types:
+
+            def read_chunks(after_key, obj=obj):
+                # keyset pagination over the pyid constraint index
+                while True:
+                    rows = self.graph.query(
+                        f"""
+                        MATCH (n:{obj})
+                        WHERE n.embedding IS NULL
+                        AND any(k IN $props WHERE n[k] IS NOT NULL)
+                        AND ($after IS NULL OR n.pyid > $after)
+                        RETURN n.pyid AS pyid, [k IN $props | n[k]] AS values
+                        ORDER BY n.pyid LIMIT $limit
+                        """,
+                        params={
+                            "props": cols_to_embed,
+                            "after": after_key,
+                            "limit": chunk_size,
+                        },
+                    )
+                    if not rows:
+                        return
+                    # same text as Neo4jVector.from_existing_graph embeds
+                    yield [
+                        (
+                            row["pyid"],
+                            "".join(
+                                f"\n{k}: {'' if v is None else v}"
+                                for k, v in zip(cols_to_embed, row["values"])
+                            ),
+                        )
+                        for row in rows
+                    ]
+                    after_key = rows[-1]["pyid"]
+
+            def write_chunk(pyids, embeddings, obj=obj):
+                self._write(
+                    f"""
+                    UNWIND $rows AS row
+                    MATCH (n:{obj} {{pyid: row.pyid}})
+                    SET n.embedding = row.embedding
+                    """,
+                    rows=[
+                        {"pyid": pyid, "embedding": emb}
+                        for pyid, emb in zip(pyids, embeddings)
+                    ],
+                )
+
+            job = f"graph:{obj}:{','.join(cols_to_embed)}"
+            n_embedded += pipeline.run(job, read_chunks, write_chunk)
+            self.create_vector_index(obj)
+        if n_embedded:  # unchanged data keeps its version, e.g. for eval resumes
+            bump_data_version()
+        if snapshot:
+            self.export_emb_snapshot(obj_types, batch_size=chunk_size)
+        if lexical:
+            self.export_lexical_index(obj_types, cols_to_embed, batch_size=chunk_size)
+
+    def export_emb_snapshot(
+        self,
+        obj_types: list = GRAPH_OBJ_TYPES,
+        path: str = EMB_SNAPSHOT_DIR,
+        batch_size: int = EMB_CHUNK_SIZE,
+    ) -> str:
+        """
+        Export the node embeddings to a new snapshot version, grouped by object
+        type, which the worker processes memory-map & search in-process.
+        Args:
+        - obj_types (list): list of object types
+        - path (str): directory of the snapshots
+        - batch_size (int): number of nodes read at a time
+        Returns:
+        - version (str): the new snapshot version
+        """
+        start_time = time.perf_counter()
+        writer = SnapshotWriter(GRAPH_SNAPSHOT, path, facets=SIM_SEARCH_FILTER_FIELDS)
+        try:
+            for obj in obj_types:
+                after = None
+                while True:  # keyset pagination over the pyid constraint index
+                    rows = self.graph.query(
+                        f"""
+                        MATCH (n:{obj})
+                        WHERE n.embedding IS NOT NULL
+                        AND ($after IS NULL OR n.pyid > $after)
+                        RETURN n.pyid AS pyid, n.pylabel AS pylabel,
+                            n.embedding AS embedding, [f IN $fields | n[f]] AS facets
+                        ORDER BY n.pyid LIMIT $limit
+                        """,
+                        params={
+                            "after": after,
+                            "limit": batch_size,
+                            "fields": SIM_SEARCH_FILTER_FIELDS,
+                        },
+                    )
+                    if not rows:
+                        break
+                    facets = zip(*[row["facets"] for row in rows])
+                    writer.add(
+                        [row["pyid"] for row in rows],
+                        [row["pylabel"] for row in rows],
+                        np.asarray([row["embedding"] for row in rows], np.float32),
+                        group=obj,
+                        facets=dict(zip(SIM_SEARCH_FILTER_FIELDS, facets)),
+                    )
+                    after = rows[-1]["pyid"]
+            version = writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+        print(
+            f"embeddings snapshot {version} of graph exported: "
+            f"{writer.n_rows} nodes in {time.perf_counter() - start_time:.1f}s"
+        )
+        return version
 
-        # create vector index & embs for each object type
+    def export_lexical_index(
+        self,
+        obj_types: list = GRAPH_OBJ_TYPES,
+        cols_to_embed: list = COLS_TO_EMBED,
+        path: str = LEXICAL_DIR,
+        batch_size: int = EMB_CHUNK_SIZE,
+    ):
+        """
+        Build the lexical index of the embedded text of the nodes, grouped by
+        object type.
+        Args:
+        - obj_types (list): list of object types
+        - cols_to_embed (list): list of embedded properties
+        - path (str): directory of the indexes
+        - batch_size (int): number of nodes read at a time
+        """
+        start_time = time.perf_counter()
+        index = LexicalIndex()
         for obj in obj_types:
-            vector_index = Neo4jVector.from_existing_graph(
-                embs_model,
-                url=url,
-                username=username,
-                password=password,
-                index_name=obj,
-                node_label=obj,
-                text_node_properties=cols_to_embed,
-                embedding_node_property="embedding",
+            after = None
+            while True:  # keyset pagination over the pyid constraint index
+                rows = self.graph.query(
+                    f"""
+                    MATCH (n:{obj})
+                    WHERE n.embedding IS NOT NULL
+                    AND ($after IS NULL OR n.pyid > $after)
+                    RETURN n.pyid AS pyid, n.pylabel AS pylabel,
+                        [k IN $props | n[k]] AS values
+                    ORDER BY n.pyid LIMIT $limit
+                    """,
+                    params={"after": after, "limit": batch_size, "props": cols_to_embed},
+                )
+                if not rows:
+                    break
+                index.upsert(
+                    [row["pyid"] for row in rows],
+                    [row["pylabel"] for row in rows],
+                    [
+                        " ".join(str(v) for v in row["values"] if v is not None)
+                        for row in rows
+                    ],
+                    groups=[obj] * len(rows),
+                )
+                after = rows[-1]["pyid"]
+        index.save(GRAPH_SNAPSHOT, path)
+        print(
+            f"lexical index of graph built: {len(index)} nodes "
+            f"in {time.perf_counter() - start_time:.1f}s"
+        )
+
+    def create_vector_index(self, obj_type: str):
+        """
+        Create a vector index (named after the object type) on the embeddings of
+        its nodes, if it doesn't exist.
+        Args:
+            obj_type (str): object type (node label)
+        """
+        if obj_type in self.vector_indexes():
+            return
+        dims = self.graph.query(
+            f"""
+            MATCH (n:{obj_type}) WHERE n.embedding IS NOT NULL
+            RETURN size(n.embedding) AS dim LIMIT 1
+            """
+        )
+        if not dims:
+            return  # nothing embedded
+        self.graph.query(
+            """
+            CALL db.index.vector.createNodeIndex(
+                $name, $label, 'embedding', toInteger($dim), 'cosine'
             )
+            """,
+            params={"name": obj_type, "label": obj_type, "dim": dims[0]["dim"]},
+        )
+        self._vector_indexes = None
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+from typing import TYPE_CHECKING, List
+import numpy as np
+from src.tracing import get_tracer
+from src.config import EMBS_MODEL, EMB_CACHE_PATH, EMB_CACHE_MAX_ENTRIES
+
+if TYPE_CHECKING:  # type hints only
+    from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text before hashing: unicode NFC & collapsed whitespace.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """
+    Disk-backed (sqlite) embedding cache, keyed by a hash of the model name and
+    normalized text, with LRU eviction above a max number of entries.
+    """
+
+    def __init__(
+        self, path: str = EMB_CACHE_PATH, max_entries: int = EMB_CACHE_MAX_ENTRIES
+    ):
+        """
+        Args:
+            path (str): path to the sqlite file
+            max_entries (int): max number of cached embeddings
+        """
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY, emb BLOB NOT NULL, last_used REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+            # upper bound of the number of entries, recounted only when over max_entries
+            (self._count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        """
+        Cache key of a text embedded with a model.
+        """
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode()).hexdigest()
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Get cached embeddings.
+        Args:
+            keys (list): cache keys
+        Returns:
+            embs (dict): key -> embedding, for the keys found in the cache
+        """
+        embs = {}
+        if not keys:
+            return embs
+        with self._lock, self._conn:
+            for i in range(0, len(keys), 500):  # stay under sqlite's max variables
+                chunk = keys[i : i + 500]
+                marks = ", ".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, emb FROM embeddings WHERE key IN ({marks})", chunk
+                ).fetchall()
+                embs.update(
+                    (key, np.frombuffer(emb, dtype=np.float32).tolist())
+                    for key, emb in rows
+                )
+            # mark hits as recently used
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, key) for key in embs],
+            )
+        return embs
+
+    def put_many(self, embs: dict):
+        """
+        Add embeddings to the cache, evicting the least recently used if full.
+        Args:
+            embs (dict): key -> embedding
+        """
+        if not embs:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, emb, last_used) VALUES (?, ?, ?)",
+                [
+                    (key, np.asarray(emb, dtype=np.float32).tobytes(), now)
+                    for key, emb in embs.items()
+                ],
+            )
+            self._count += len(embs)  # replaced keys are counted too
+            if self._count <= self.max_entries:
+                return
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    """
+                    DELETE FROM embeddings WHERE key IN (
+                        SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+                    )
+                    """,
+                    (count - self.max_entries,),
+                )
+            self._count = min(count, self.max_entries)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _CachedEmbeddings:
+    """
+    Embeddings model that looks up texts in an `EmbeddingCache` first, and
+    only embeds (deduplicated) texts that are not cached. Created with
+    `cached_embeddings`, as a langchain `Embeddings`.
+    """
+
+    def __init__(self, embs_model: "Embeddings", cache: EmbeddingCache, model: str):
+        """
+        Args:
+            embs_model (Embeddings): underlying embeddings model
+            cache (EmbeddingCache): embedding cache
+            model (str): model name, part of the cache key
+        """
+        self.embs_model = embs_model
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with get_tracer().span("embed", kind="embedding", n_texts=len(texts)) as span:
+            keys = [self.cache.key(self.model, text) for text in texts]
+            embs = self.cache.get_many(list(set(keys)))
+
+            # embed each missing text once
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in embs and key not in missing:
+                    missing[key] = text
+            span["n_embedded"] = len(missing)
+            if missing:
+                new_embs = self.embs_model.embed_documents(list(missing.values()))
+                new_embs = dict(zip(missing.keys(), new_embs))
+                self.cache.put_many(new_embs)
+                embs.update(new_embs)
+
+        return [embs[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        with get_tracer().span("embed", kind="embedding", n_texts=1) as span:
+            key = self.cache.key(self.model, text)
+            emb = self.cache.get_many([key]).get(key)
+            span["n_embedded"] = int(emb is None)
+            if emb is None:
+                emb = self.embs_model.embed_query(text)
+                self.cache.put_many({key: emb})
+        return emb
+
+
+@lru_cache(maxsize=1)
+def _cached_embeddings_class() -> type:
+    from langchain_core.embeddings import Embeddings  # loaded on first use
+
+    return type("CachedEmbeddings", (_CachedEmbeddings, Embeddings), {})
+
+
+def cached_embeddings(
+    embs_model: "Embeddings", cache: EmbeddingCache, model: str
+) -> "Embeddings":
+    """
+    Embeddings model with an embedding cache (see _CachedEmbeddings).
+    """
+    return _cached_embeddings_class()(embs_model, cache, model)
+
+
+_embs_model = None
+_embs_model_lock = threading.Lock()
+
+
+def get_embs_model() -> "Embeddings":
+    """
+    Get the process-wide (cached) embeddings model.
+    """
+    global _embs_model
+    with _embs_model_lock:
+        if _embs_model is None:
+            from langchain_openai import AzureOpenAIEmbeddings  # loaded on first use
+
+            _embs_model = cached_embeddings(
+                AzureOpenAIEmbeddings(azure_deployment=EMBS_MODEL),
+                EmbeddingCache(),
+                EMBS_MODEL,
+            )
+    return _embs_model
+
+
+def set_embs_model(embs_model: "Embeddings"):
+    """
+    Replace the process-wide embeddings model, e.g. with a local stand-in.
+    """
+    global _embs_model
+    with _embs_model_lock:
+        _embs_model = embs_model
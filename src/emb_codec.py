@@ -0,0 +1,120 @@
+"""Compact (float32 / int8) binary encodings of embeddings"""
+
+import numpy as np
+
+# embeddings storage -> columns (& sql types) holding the embeddings of a row
+EMB_COLUMNS = {
+    "float64": {"embeddings": "DOUBLE PRECISION[]"},  # legacy
+    "float32": {"embeddings_f32": "BYTEA"},
+    # int8 codes are searched, float32 is kept to rescore the top candidates
+    "int8": {"embeddings_f32": "BYTEA", "embeddings_i8": "BYTEA"},
+}
+
+
+def normalize(embs):
+    """
+    L2-normalize a vector or the rows of a matrix.
+    """
+    norms = np.linalg.norm(embs, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(embs / norms, dtype=np.float32)
+
+
+def encode_f32(embs) -> list:
+    """
+    Pack each embedding as little-endian float32 bytes.
+    """
+    embs = np.asarray(embs, dtype="<f4")
+    return [row.tobytes() for row in embs]
+
+
+def decode_f32(blobs: list, n_dims: int = None) -> np.ndarray:
+    """
+    Unpack float32 embeddings into a (n, n_dims) matrix.
+    """
+    data = b"".join(bytes(blob) for blob in blobs)
+    n_dims = n_dims or (len(bytes(blobs[0])) // 4 if blobs else 0)
+    return np.frombuffer(data, dtype="<f4").reshape(len(blobs), n_dims)
+
+
+def quantize_int8(embs) -> tuple:
+    """
+    Symmetric int8 scalar quantization, with one scale factor per embedding.
+    Returns:
+        codes (np.ndarray): int8 matrix, embs ~= codes * scales[:, None]
+        scales (np.ndarray): float32 scale factor of each embedding
+    """
+    embs = np.atleast_2d(np.asarray(embs, dtype=np.float32))
+    scales = np.abs(embs).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(embs / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+# packed int8 embedding: float32 scale factor, then the int8 codes
+def _int8_dtype(n_dims: int) -> np.dtype:
+    return np.dtype([("scale", "<f4"), ("codes", "i1", (n_dims,))])
+
+
+def encode_int8(embs) -> list:
+    """
+    Quantize & pack each embedding as its scale factor followed by int8 codes.
+    """
+    codes, scales = quantize_int8(embs)
+    packed = np.empty(len(codes), dtype=_int8_dtype(codes.shape[1]))
+    packed["scale"], packed["codes"] = scales, codes
+    return [row.tobytes() for row in packed]
+
+
+def decode_int8(blobs: list) -> tuple:
+    """
+    Unpack int8 embeddings.
+    Returns:
+        codes (np.ndarray): (n, n_dims) int8 matrix
+        scales (np.ndarray): float32 scale factor of each embedding
+    """
+    data = b"".join(bytes(blob) for blob in blobs)
+    n_dims = len(bytes(blobs[0])) - 4 if blobs else 0
+    packed = np.frombuffer(data, dtype=_int8_dtype(n_dims))
+    return packed["codes"], packed["scale"]
+
+
+def encode_embs(embeddings, storage: str) -> dict:
+    """
+    Encode embeddings for a storage format.
+    Args:
+        embeddings (list): embeddings, as lists of floats
+        storage (str): "float64", "float32" or "int8"
+    Returns:
+        values (dict): column name -> value of each row
+    """
+    if storage == "float64":
+        return {"embeddings": [list(map(float, emb)) for emb in embeddings]}
+    # unit vectors, so the int8 codes . query ~ cosine / scale
+    embs = normalize(np.asarray(embeddings, dtype=np.float32))
+    values = {"embeddings_f32": encode_f32(embs)}
+    if storage == "int8":
+        values["embeddings_i8"] = encode_int8(embs)
+    return values
+
+
+def encode_facet(values: list, uniques: dict = None) -> tuple:
+    """
+    Dictionary-encode the values of a filterable field, compared case-insensitively.
+    Args:
+        values (list): values of the rows
+        uniques (dict): codes of the values seen so far, extended in place
+    Returns:
+        codes (np.ndarray): int32 code of each value, -1 for None
+        uniques (dict): lowercased value -> code
+    """
+    uniques = {} if uniques is None else uniques
+    codes = np.fromiter(
+        (
+            -1 if v is None else uniques.setdefault(str(v).lower(), len(uniques))
+            for v in values
+        ),
+        dtype=np.int32,
+        count=len(values),
+    )
+    return codes, uniques
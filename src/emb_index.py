@@ -0,0 +1,464 @@
+import threading
+import time
+import numpy as np
+from src.emb_codec import EMB_COLUMNS, decode_f32, decode_int8, encode_facet, normalize
+from src.emb_snapshot import (
+    GRAPH_SNAPSHOT,
+    EmbeddingSnapshot,
+    StringColumn,
+    current_version,
+    open_snapshot,
+    snapshot_name,
+)
+from src.tracing import get_tracer
+from src.config import (
+    EMB_RESCORE_FACTOR,
+    EMB_SNAPSHOT_CHECK_INTERVAL,
+    EMB_SNAPSHOT_DIR,
+    EMB_STORAGE,
+    SIM_SEARCH_FILTER_FIELDS,
+    TABLE_SCHEMA,
+)
+
+SCORE_BLOCK_ROWS = 65_536  # int8 rows converted to float32 at a time when scoring
+
+
+def normalize_filters(filters: dict) -> dict:
+    """
+    Validate sim search filters & normalize them to field -> lowercased values.
+    Args:
+        filters (dict): field -> value or list of values (any of them matches)
+    Raises:
+        ValueError: if a field is not filterable
+    """
+    normalized = {}
+    for field, values in (filters or {}).items():
+        if field not in SIM_SEARCH_FILTER_FIELDS:
+            raise ValueError(
+                f"cannot filter on '{field}', filterable fields: "
+                f"{', '.join(SIM_SEARCH_FILTER_FIELDS)}"
+            )
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        normalized[field] = [str(value).lower() for value in values]
+    return normalized
+
+
+def facet_cols(dbm, table: str) -> list:
+    """
+    Filterable fields that are columns of a table.
+    """
+    schema, _, name = table.rpartition(".")
+    cols = set(dbm.get_col_names(schema or TABLE_SCHEMA, name))
+    return [col for col in SIM_SEARCH_FILTER_FIELDS if col in cols]
+
+
+class EmbeddingIndex:
+    """
+    In-memory index of the embeddings of a table.
+    Embeddings are held in a contiguous, pre-normalized float32 matrix, or as
+    int8 codes with a scale factor per row, with the ids and labels of the rows
+    in side arrays of the same order. Top candidates of an int8 search are
+    rescored with float32 embeddings: from a snapshot, or else from the table.
+    The arrays may be read-only memory maps of a snapshot.
+    Filterable fields have a bitmap of the rows of each value, so a filtered
+    search only scores the matching rows.
+    """
+
+    def __init__(
+        self,
+        ids: list,
+        labels: list,
+        embs,
+        scales=None,
+        table: str = None,
+        id_col: str = "pyid",
+        full_embs=None,
+        normalized: bool = False,
+        facets: dict = None,
+    ):
+        """
+        Args:
+            ids (list): ids of the rows
+            labels (list): labels of the rows
+            embs (np.ndarray): float embeddings, or int8 codes of unit embeddings
+            scales (np.ndarray): scale factor of each row of int8 codes
+            table (str): table holding the float32 embeddings, to rescore
+                candidates of an int8 index
+            id_col (str): name of id column
+            full_embs (np.ndarray): normalized float32 embeddings, to rescore
+                candidates of an int8 index without querying the table
+            normalized (bool): whether the float embeddings are already normalized
+            facets (dict): field -> (value code of each row, -1 for None, values),
+                for the filterable fields
+        """
+        self.ids = ids if isinstance(ids, StringColumn) else np.asarray(ids, dtype=object)
+        self.labels = (
+            labels if isinstance(labels, StringColumn) else np.asarray(labels, dtype=object)
+        )
+        if scales is None:
+            self.embs = embs if normalized else normalize(np.asarray(embs, np.float32))
+            self.scales = None
+        else:
+            self.embs = embs if normalized else np.ascontiguousarray(embs, np.int8)
+            self.scales = np.asarray(scales, dtype=np.float32)
+        self.table = table
+        self.id_col = id_col
+        self.full_embs = full_embs
+        # field -> value -> packed bitmap of the rows with the value
+        self.bitmaps = {
+            field: {
+                value: np.packbits(np.asarray(codes) == code)
+                for code, value in enumerate(values)
+            }
+            for field, (codes, values) in (facets or {}).items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_table(
+        cls,
+        dbm,
+        table: str,
+        id_col: str = "pyid",
+        label_col: str = "pylabel",
+        storage: str = EMB_STORAGE,
+    ):
+        """
+        Load the embeddings of a table into an index.
+        Args:
+            dbm (SQLDBManager): sql db manager
+            table (str): name of table
+            id_col (str): name of id column
+            label_col (str): name of label column
+            storage (str): embeddings storage: "float64", "float32" or "int8"
+        """
+        fields = facet_cols(dbm, table)
+        if storage != "float64":
+            return cls._from_packed(dbm, table, id_col, label_col, storage, fields)
+        embs_col = "embeddings"
+        (n_rows,) = dbm.query(
+            f"SELECT COUNT(*) FROM {table} WHERE {embs_col} IS NOT NULL;"
+        )[0]
+        ids, labels, embs = [], [], None
+        facets = {field: [] for field in fields}
+        # fill a preallocated matrix batch by batch, so memory stays flat
+        batches = dbm.iter_batches(
+            f"SELECT {', '.join([id_col, label_col, embs_col, *fields])} "
+            f"FROM {table} WHERE {embs_col} IS NOT NULL;",
+            fmt="numpy",
+        )
+        for batch in batches:
+            batch_embs = batch[embs_col]
+            if batch_embs.dtype == object:  # arrays of unequal length
+                batch_embs = np.stack(batch_embs)
+            if embs is None:
+                embs = np.empty((n_rows, batch_embs.shape[1]), dtype=np.float32)
+            embs[len(ids) : len(ids) + len(batch_embs)] = batch_embs
+            ids.extend(batch[id_col].tolist())
+            labels.extend(batch[label_col].tolist())
+            for field, values in facets.items():
+                values.extend(batch[field].tolist())
+        if embs is None:
+            embs = np.empty((0, 0), dtype=np.float32)
+        return cls(ids, labels, embs[: len(ids)], facets=_encode_facets(facets))
+
+    @classmethod
+    def _from_packed(
+        cls, dbm, table: str, id_col: str, label_col: str, storage: str, fields: list
+    ):
+        """
+        Load float32 or int8 embeddings packed in a BYTEA column.
+        """
+        embs_col = list(EMB_COLUMNS[storage])[-1]  # the searched column
+        (n_rows,) = dbm.query(
+            f"SELECT COUNT(*) FROM {table} WHERE {embs_col} IS NOT NULL;"
+        )[0]
+        ids, labels, embs, scales = [], [], None, None
+        facets = {field: [] for field in fields}
+        batches = dbm.iter_batches(
+            f"SELECT {', '.join([id_col, label_col, embs_col, *fields])} "
+            f"FROM {table} WHERE {embs_col} IS NOT NULL;"
+        )
+        for rows in batches:
+            batch_ids, batch_labels, blobs, *batch_facets = zip(*rows)
+            if storage == "int8":
+                batch_embs, batch_scales = decode_int8(blobs)
+            else:
+                batch_embs = decode_f32(blobs)
+            if embs is None:  # preallocate, so memory stays flat
+                embs = np.empty((n_rows, batch_embs.shape[1]), dtype=batch_embs.dtype)
+                scales = np.empty(n_rows, dtype=np.float32)
+            embs[len(ids) : len(ids) + len(rows)] = batch_embs
+            if storage == "int8":
+                scales[len(ids) : len(ids) + len(rows)] = batch_scales
+            ids.extend(batch_ids)
+            labels.extend(batch_labels)
+            for values, batch_values in zip(facets.values(), batch_facets):
+                values.extend(batch_values)
+        if embs is None:
+            embs = np.empty((0, 0), dtype=np.float32)
+        n = len(ids)
+        kwargs = {"table": table, "id_col": id_col, "facets": _encode_facets(facets)}
+        if storage == "int8":
+            return cls(ids, labels, embs[:n], scales[:n], **kwargs)
+        return cls(ids, labels, embs[:n], **kwargs)
+
+    @classmethod
+    def from_snapshot(
+        cls, snapshot: EmbeddingSnapshot, group: str = None, table: str = None
+    ):
+        """
+        Index over the memory-mapped arrays of a snapshot, without copying them.
+        Args:
+            snapshot (EmbeddingSnapshot): open snapshot
+            group (str): only index the rows of a group (e.g. object type)
+            table (str): name of the table the snapshot was exported from
+        """
+        start, end = snapshot.groups[group] if group else (0, len(snapshot))
+        rows = slice(start, end)
+        ids, labels = snapshot.ids.slice(start, end), snapshot.labels.slice(start, end)
+        facets = {
+            field: (codes[rows], values)
+            for field, (codes, values) in snapshot.facets.items()
+        }
+        kwargs = {"table": table, "normalized": True, "facets": facets}
+        if snapshot.codes is not None:
+            return cls(
+                ids,
+                labels,
+                snapshot.codes[rows],
+                snapshot.scales[rows],
+                full_embs=snapshot.embs[rows],
+                **kwargs,
+            )
+        return cls(ids, labels, snapshot.embs[rows], **kwargs)
+
+    @property
+    def quantized(self) -> bool:
+        return self.scales is not None
+
+    def filter_rows(self, filters: dict) -> np.ndarray:
+        """
+        Rows matching all filters, from the bitmaps of their values.
+        Args:
+            filters (dict): field -> value or list of values (any of them matches)
+        Returns:
+            rows (np.ndarray): sorted positions of the matching rows
+        Raises:
+            ValueError: if a field is not filterable in this index
+        """
+        mask = None
+        for field, values in normalize_filters(filters).items():
+            if field not in self.bitmaps:
+                raise ValueError(f"cannot filter on '{field}', not indexed")
+            field_mask = np.zeros((len(self) + 7) // 8, dtype=np.uint8)
+            for value in values:
+                bitmap = self.bitmaps[field].get(value)
+                if bitmap is not None:
+                    field_mask |= bitmap
+            mask = field_mask if mask is None else mask & field_mask
+        return np.flatnonzero(np.unpackbits(mask, count=len(self)))
+
+    def scores(self, query_emb, rows=None):
+        """
+        Cosine similarity of every row (or of some rows) with a normalized query
+        embedding (approximate for an int8 index).
+        """
+        embs, scales = self.embs, self.scales
+        if rows is not None:
+            embs = embs[rows]
+            scales = scales[rows] if scales is not None else None
+        if scales is None:
+            return embs @ query_emb  # rows are normalized
+        sims = np.empty(len(embs), dtype=np.float32)
+        for start in range(0, len(embs), SCORE_BLOCK_ROWS):
+            block = embs[start : start + SCORE_BLOCK_ROWS].astype(np.float32)
+            sims[start : start + len(block)] = block @ query_emb
+        return sims * scales
+
+    def search(
+        self,
+        query_emb,
+        k: int = 10,
+        threshold: float = 0.0,
+        dbm=None,
+        filters: dict = None,
+    ) -> list:
+        """
+        Find the top-k rows most similar to the query embedding.
+        Args:
+            query_emb (list): query embedding
+            k (int): max number of matches to return
+            threshold (float): min cosine similarity of a match
+            dbm (SQLDBManager): sql db manager, to rescore the top candidates of
+                an int8 index with their float32 embeddings
+            filters (dict): field -> value or list of values, only rows matching
+                all fields are scored
+        Returns:
+            matches (list): list of dicts with id, name & sim, sorted by sim
+        Raises:
+            ValueError: if a filter field is not filterable
+        """
+        rows = self.filter_rows(filters) if filters else None
+        if len(self) == 0 or k <= 0 or (rows is not None and len(rows) == 0):
+            return []
+        query_emb = normalize(np.asarray(query_emb, dtype=np.float32))
+        sims = self.scores(query_emb, rows)
+
+        # top candidates (more of them if they are rescored)
+        rescore = self.quantized and (
+            self.full_embs is not None or (dbm is not None and self.table is not None)
+        )
+        n_candidates = k * EMB_RESCORE_FACTOR if rescore else k
+        if n_candidates < len(sims):
+            idx = np.argpartition(-sims, n_candidates - 1)[:n_candidates]
+        else:
+            idx = np.arange(len(sims))
+        cand_sims = sims[idx]
+        if rows is not None:
+            idx = rows[idx]  # positions in the index
+        if rescore:
+            cand_sims = self.rescore(dbm, idx, query_emb)
+
+        # threshold & sort
+        keep = cand_sims > threshold
+        idx, cand_sims = idx[keep], cand_sims[keep]
+        order = np.argsort(-cand_sims)[:k]
+
+        return [
+            {"id": self.ids[i], "name": self.labels[i], "sim": float(sim)}
+            for i, sim in zip(idx[order], cand_sims[order])
+        ]
+
+    def rescore(self, dbm, idx, query_emb) -> np.ndarray:
+        """
+        Exact cosine similarity of rows with the query, from their float32 embeddings.
+        """
+        if self.full_embs is not None:
+            return self.full_embs[idx] @ query_emb  # rows are normalized
+        rows = dict(
+            dbm.query(
+                f"SELECT {self.id_col}, embeddings_f32 FROM {self.table} "
+                f"WHERE {self.id_col} = ANY(%s);",
+                ([self.ids[i] for i in idx],),
+            )
+        )
+        sims = np.full(len(idx), -1.0, dtype=np.float32)
+        found = [j for j, i in enumerate(idx) if rows.get(self.ids[i]) is not None]
+        if found:
+            embs = decode_f32([rows[self.ids[idx[j]]] for j in found])
+            sims[found] = normalize(embs) @ query_emb
+        return sims
+
+
+def _encode_facets(facets: dict) -> dict:
+    """
+    Dictionary-encode the values of the filterable fields.
+    """
+    encoded = {}
+    for field, values in facets.items():
+        codes, uniques = encode_facet(values)
+        encoded[field] = (codes, list(uniques))
+    return encoded
+
+
+# process-level indexes, keyed by table name: (index, snapshot version, last check)
+_indexes = {}
+_lock = threading.Lock()
+_snapshot_dir = EMB_SNAPSHOT_DIR
+
+
+def set_snapshot_dir(path: str):
+    """
+    Set the directory the indexes are memory-mapped from (None to always load
+    them from the db), e.g. for benchmarks. Drops the loaded indexes.
+    """
+    global _snapshot_dir
+    with _lock:
+        _snapshot_dir = path
+        _indexes.clear()
+
+
+def _get_index(key: str, name: str, load_snapshot, load_table):
+    """
+    Get a cached index, (re)loading it on first use or when a new version of its
+    snapshot was published.
+    """
+    with _lock:
+        entry = _indexes.get(key)
+        snapshot_dir = _snapshot_dir
+        now = time.monotonic()
+        if (
+            entry is not None
+            and snapshot_dir
+            and now - entry[2] > EMB_SNAPSHOT_CHECK_INTERVAL
+        ):
+            if current_version(name, snapshot_dir) != entry[1]:
+                entry = None  # new snapshot version: swap it in
+            else:
+                entry = _indexes[key] = (entry[0], entry[1], now)
+        if entry is None:
+            with get_tracer().span("emb_index.load", kind="db", table=key) as span:
+                snapshot = open_snapshot(name, snapshot_dir) if snapshot_dir else None
+                if snapshot is not None:
+                    index, version = load_snapshot(snapshot), snapshot.version
+                    span["source"] = f"snapshot {version}"
+                else:
+                    index, version = load_table(), None
+                if isinstance(index, dict):
+                    span["rows"] = sum(map(len, index.values()))
+                elif index is not None:
+                    span["rows"] = len(index)
+            entry = _indexes[key] = (index, version, now)
+    return entry[0]
+
+
+def get_emb_index(dbm, table: str) -> EmbeddingIndex:
+    """
+    Get the index for a table: memory-mapped from its snapshot if one was
+    exported, else loaded from the table on first use.
+    Args:
+        dbm (SQLDBManager): sql db manager, used if the index must be loaded
+        table (str): name of table
+    """
+    return _get_index(
+        table,
+        snapshot_name(table),
+        lambda snapshot: EmbeddingIndex.from_snapshot(snapshot, table=table),
+        lambda: EmbeddingIndex.from_table(dbm, table),
+    )
+
+
+def get_graph_emb_indexes() -> dict:
+    """
+    Get the indexes of the graph nodes per object type, memory-mapped from the
+    graph snapshot, or None if it was never exported.
+    """
+    return _get_index(
+        GRAPH_SNAPSHOT,
+        GRAPH_SNAPSHOT,
+        lambda snapshot: {
+            label: EmbeddingIndex.from_snapshot(snapshot, group=label)
+            for label in snapshot.groups
+        },
+        lambda: None,  # searched in neo4j
+    )
+
+
+def invalidate_emb_index(table: str = None):
+    """
+    Drop the index for a table (or all indexes), so it is reloaded on next use.
+    Args:
+        table (str): name of table, or None for all tables
+    """
+    with _lock:
+        if table is None:
+            _indexes.clear()
+        else:
+            name = snapshot_name(table)
+            for key in list(_indexes):
+                if key == table or snapshot_name(key) == name:
+                    del _indexes[key]
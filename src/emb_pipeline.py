@@ -0,0 +1,222 @@
+"""Chunked, concurrent & resumable embedding of texts streamed from a db"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Iterable, List
+from src.emb_cache import get_embs_model
+from src.tracing import get_tracer
+from src.utils import retry_with_backoff
+from src.config import (
+    EMB_BATCH_MAX_TEXTS,
+    EMB_BATCH_MAX_TOKENS,
+    EMB_CHECKPOINT_PATH,
+    EMB_MAX_RETRIES,
+    EMB_MAX_TEXT_TOKENS,
+    EMB_MAX_WORKERS,
+    EMBS_MODEL,
+)
+
+if TYPE_CHECKING:  # type hints only
+    from langchain_core.embeddings import Embeddings
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """
+    Tokenizer of the embeddings model, or None if it can't be loaded (tiktoken
+    not installed, or its BPE file not cached & no network access), in which
+    case token counts are estimated from the number of characters.
+    """
+    try:
+        import tiktoken  # optional dependency, installed with langchain-openai
+
+        return tiktoken.encoding_for_model(EMBS_MODEL)
+    except Exception as e:
+        print(f"tokenizer of {EMBS_MODEL} not available, estimating tokens: {e}")
+        return None
+
+
+def truncate_chars(text: str, max_tokens: int = EMB_MAX_TEXT_TOKENS) -> tuple:
+    """
+    Truncate a text to the max input size of the embeddings model, estimating
+    ~4 chars per token (no tokenizer needed).
+    Returns:
+        text (str): truncated text
+        n_tokens (int): estimated number of tokens of the truncated text
+    """
+    text = text[: max_tokens * 4]
+    return text, len(text) // 4 + 1
+
+
+def truncate_tokens(text: str, max_tokens: int = EMB_MAX_TEXT_TOKENS) -> tuple:
+    """
+    Truncate a text to the max input size of the embeddings model.
+    Returns:
+        text (str): truncated text
+        n_tokens (int): number of tokens of the truncated text
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return truncate_chars(text, max_tokens)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) > max_tokens:
+        tokens = tokens[:max_tokens]
+        text = encoding.decode(tokens)
+    return text, len(tokens)
+
+
+class EmbeddingCheckpoint:
+    """
+    Last key written per embedding job, in a json file replaced atomically
+    after each chunk.
+    """
+
+    def __init__(self, path: str = EMB_CHECKPOINT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _save(self, jobs: dict):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(jobs, f)
+        os.replace(tmp_path, self.path)  # atomic
+
+    def get(self, job: str):
+        with self._lock:
+            return self._load().get(job)
+
+    def set(self, job: str, last_key):
+        with self._lock:
+            jobs = self._load()
+            jobs[job] = last_key
+            self._save(jobs)
+
+    def clear(self, job: str):
+        with self._lock:
+            jobs = self._load()
+            if jobs.pop(job, None) is not None:
+                self._save(jobs)
+
+
+class EmbeddingPipeline:
+    """
+    Embed (key, text) pairs streamed in chunks. Each chunk is split into request
+    batches by token count, the batches are embedded concurrently with retry &
+    backoff, and the chunk is written as soon as it is done. The key of the
+    last written row is checkpointed, so an interrupted job resumes after it
+    (sources must stream rows ordered by key).
+    """
+
+    def __init__(
+        self,
+        embs_model: "Embeddings" = None,
+        max_batch_tokens: int = EMB_BATCH_MAX_TOKENS,
+        max_batch_texts: int = EMB_BATCH_MAX_TEXTS,
+        max_workers: int = EMB_MAX_WORKERS,
+        max_retries: int = EMB_MAX_RETRIES,
+        checkpoint: EmbeddingCheckpoint = None,
+        truncate: Callable[[str], tuple] = truncate_tokens,
+    ):
+        """
+        Args:
+            embs_model (Embeddings): embeddings model (default: cached model)
+            max_batch_tokens (int): max tokens per embeddings request
+            max_batch_texts (int): max texts per embeddings request
+            max_workers (int): max concurrent embeddings requests
+            max_retries (int): max retries of a failed request
+            checkpoint (EmbeddingCheckpoint): progress of the jobs
+            truncate (callable): truncate(text) -> (text, n_tokens), e.g.
+                truncate_chars to not load the tokenizer
+        """
+        self.embs_model = embs_model or get_embs_model()
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_texts = max_batch_texts
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.checkpoint = checkpoint or EmbeddingCheckpoint()
+        self.truncate = truncate
+
+    def batches(self, texts: List[str]) -> List[List[str]]:
+        """
+        Split texts into request batches by token count & number of texts.
+        """
+        batches, batch, batch_tokens = [], [], 0
+        for text in texts:
+            text, n_tokens = self.truncate(text)
+            if batch and (
+                batch_tokens + n_tokens > self.max_batch_tokens
+                or len(batch) >= self.max_batch_texts
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += n_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed(self, texts: List[str], executor: ThreadPoolExecutor) -> List[list]:
+        """
+        Embed texts in concurrent request batches, in order.
+        """
+        futures = [
+            executor.submit(
+                retry_with_backoff,
+                self.embs_model.embed_documents,
+                batch,
+                max_retries=self.max_retries,
+            )
+            for batch in self.batches(texts)
+        ]
+        return [emb for future in futures for emb in future.result()]
+
+    def run(
+        self,
+        job: str,
+        read_chunks: Callable[[object], Iterable[list]],
+        write_chunk: Callable[[list, list], None],
+    ) -> int:
+        """
+        Run an embedding job, resuming from its checkpoint.
+        Args:
+            job (str): job name, key of the checkpoint
+            read_chunks (callable): read_chunks(after_key) yields chunks of
+                (key, text) pairs ordered by key, with keys > after_key
+                (all if None); keys are checkpointed as strings
+            write_chunk (callable): write_chunk(keys, embeddings) stores a chunk
+        Returns:
+            n_rows (int): number of rows embedded
+        """
+        after_key = self.checkpoint.get(job)
+        if after_key is not None:
+            print(f"resuming embedding job {job} after {after_key}")
+        n_rows, start_time = 0, time.perf_counter()
+        tracer = get_tracer()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for chunk in read_chunks(after_key):
+                if not chunk:
+                    continue
+                keys = [key for key, _ in chunk]
+                with tracer.span("embed_chunk", kind="embedding", job=job) as span:
+                    embs = self.embed([text for _, text in chunk], executor)
+                    write_chunk(keys, embs)
+                    span["rows"] = len(keys)
+                self.checkpoint.set(job, str(keys[-1]))
+                n_rows += len(keys)
+                print(
+                    f"{job}: embedded {n_rows} rows "
+                    f"in {time.perf_counter() - start_time:.1f}s"
+                )
+        self.checkpoint.clear(job)  # done, next run starts over
+        return n_rows
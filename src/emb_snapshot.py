@@ -0,0 +1,284 @@
+"""On-disk embedding snapshots, memory-mapped & shared by worker processes"""
+
+import json
+import os
+import shutil
+import struct
+import time
+import numpy as np
+from src.emb_codec import encode_facet, normalize, quantize_int8
+from src.utils import get_data_version
+from src.config import EMB_SNAPSHOT_DIR, TABLE_SCHEMA
+
+SNAPSHOT_FORMAT = 1
+CURRENT = "CURRENT"  # file holding the name of the current version
+GRAPH_SNAPSHOT = "graph"  # snapshot of the embeddings of the graph nodes
+NPY_HEADER_SIZE = 128  # fixed size .npy header, written once all rows are known
+
+
+def snapshot_name(table: str) -> str:
+    """
+    Name of the snapshot (and indexes) of a table: "<schema>__<table>", tables
+    referenced without schema being in the default schema; GRAPH_SNAPSHOT for
+    the graph.
+    """
+    if table == GRAPH_SNAPSHOT:
+        return table
+    if "." not in table:
+        table = f"{TABLE_SCHEMA}.{table}"
+    return table.replace(".", "__")
+
+
+def _npy_header(dtype, shape: tuple) -> bytes:
+    """
+    .npy (v1.0) header of a C-order array, padded to NPY_HEADER_SIZE bytes.
+    """
+    header = repr(
+        {"descr": np.dtype(dtype).str, "fortran_order": False, "shape": tuple(shape)}
+    )
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode()
+
+
+class StringColumn:
+    """
+    Strings stored as one utf-8 blob with offsets, decoded on access.
+    """
+
+    def __init__(self, data, offsets):
+        """
+        Args:
+            data (np.ndarray): utf-8 bytes of all strings (uint8)
+            offsets (np.ndarray): start of each string in data, then the end
+        """
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        i = int(i)
+        return bytes(self.data[self.offsets[i] : self.offsets[i + 1]]).decode()
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def slice(self, start: int, end: int):
+        """
+        Strings start..end, without copying.
+        """
+        return StringColumn(self.data, self.offsets[start : end + 1])
+
+
+class SnapshotWriter:
+    """
+    Write a new snapshot version batch by batch, then publish it atomically by
+    replacing the CURRENT pointer. Readers keep using the version they opened.
+    Layout of a version directory:
+        embs.npy (float32, normalized), codes.npy & scales.npy (int8, optional),
+        ids.bin & labels.bin (utf-8) with ids_offsets.npy & labels_offsets.npy,
+        facet_<field>.npy (int32 value codes of a filterable field, optional),
+        meta.json (version header, with the values of the facet codes)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        root: str = EMB_SNAPSHOT_DIR,
+        quantize: bool = False,
+        facets: list = (),
+    ):
+        """
+        Args:
+            name (str): snapshot name
+            root (str): directory of the snapshots
+            quantize (bool): also write int8 codes & scales
+            facets (list): filterable fields, given with each batch
+        """
+        self.name = name
+        self.root = os.path.join(root, name)
+        self.version = f"v{time.time_ns()}"
+        self.dir = os.path.join(self.root, self.version)
+        os.makedirs(self.dir)
+        self.quantize = quantize
+        self.n_rows, self.dim = 0, None
+        self.groups = {}  # group -> [start, end) of its rows
+        self.facets = {field: {} for field in facets}  # field -> value codes
+        self._files = {
+            file: open(os.path.join(self.dir, file), "wb")
+            for file in ["embs.npy", "ids.bin", "labels.bin"]
+            + (["codes.npy", "scales.npy"] if quantize else [])
+            + [f"facet_{field}.npy" for field in facets]
+        }
+        for file, f in self._files.items():
+            if file.endswith(".npy"):
+                f.write(b"\0" * NPY_HEADER_SIZE)  # placeholder
+        self._offsets = {"ids": [0], "labels": [0]}
+
+    def add(
+        self, ids: list, labels: list, embs, group: str = None, facets: dict = None
+    ):
+        """
+        Append a batch of rows. Rows of a group must be added contiguously.
+        Args:
+            ids (list): ids of the rows
+            labels (list): labels of the rows
+            embs (np.ndarray): embeddings of the rows
+            group (str): group of the rows, e.g. object type
+            facets (dict): field -> values of the rows, for the filterable fields
+        """
+        embs = normalize(np.asarray(embs, dtype=np.float32))
+        if self.dim is None:
+            self.dim = embs.shape[1]
+        self._files["embs.npy"].write(embs.astype("<f4").tobytes())
+        if self.quantize:
+            codes, scales = quantize_int8(embs)
+            self._files["codes.npy"].write(codes.tobytes())
+            self._files["scales.npy"].write(scales.astype("<f4").tobytes())
+        for key, values in (("ids", ids), ("labels", labels)):
+            f, offsets = self._files[f"{key}.bin"], self._offsets[key]
+            for value in values:
+                data = ("" if value is None else str(value)).encode()
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        for field, uniques in self.facets.items():
+            values = (facets or {}).get(field) or [None] * len(embs)
+            codes, _ = encode_facet(values, uniques)
+            self._files[f"facet_{field}.npy"].write(codes.astype("<i4").tobytes())
+        if group is not None:
+            start = self.groups.get(group, [self.n_rows])[0]
+            self.groups[group] = [start, self.n_rows + len(embs)]
+        self.n_rows += len(embs)
+
+    def commit(self) -> str:
+        """
+        Finalize the version & make it the current one.
+        Returns:
+            version (str): the new version
+        """
+        dim = self.dim or 0
+        shapes = {
+            "embs.npy": ("<f4", (self.n_rows, dim)),
+            "codes.npy": ("i1", (self.n_rows, dim)),
+            "scales.npy": ("<f4", (self.n_rows,)),
+            **{f"facet_{field}.npy": ("<i4", (self.n_rows,)) for field in self.facets},
+        }
+        for file, f in self._files.items():
+            if file in shapes:
+                f.seek(0)
+                f.write(_npy_header(*shapes[file]))
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        for key, offsets in self._offsets.items():
+            np.save(os.path.join(self.dir, f"{key}_offsets.npy"), np.asarray(offsets))
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "name": self.name,
+            "version": self.version,
+            "data_version": get_data_version(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "n_rows": self.n_rows,
+            "dim": dim,
+            "quantized": self.quantize,
+            "groups": self.groups,
+            "facets": {field: list(uniques) for field, uniques in self.facets.items()},
+        }
+        with open(os.path.join(self.dir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        # publish: atomic swap of the pointer to the current version
+        tmp_path = os.path.join(self.root, f"{CURRENT}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(self.version)
+        previous = current_version(self.name, os.path.dirname(self.root))
+        os.replace(tmp_path, os.path.join(self.root, CURRENT))
+
+        # keep the previous version for readers still switching, drop older ones
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if os.path.isdir(path) and entry not in (self.version, previous):
+                shutil.rmtree(path, ignore_errors=True)
+        return self.version
+
+    def abort(self):
+        """
+        Discard the version being written.
+        """
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class EmbeddingSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot version: all processes opening
+    it share the same page-cached copy.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): directory of the snapshot version
+        """
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        if self.meta["format"] != SNAPSHOT_FORMAT:
+            raise ValueError(f"unsupported snapshot format {self.meta['format']}")
+        self.version = self.meta["version"]
+        self.groups = self.meta["groups"]
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        def strings(key):
+            data_path = os.path.join(path, f"{key}.bin")
+            offsets = load(f"{key}_offsets.npy")
+            data = (
+                np.memmap(data_path, dtype=np.uint8, mode="r")
+                if os.path.getsize(data_path)
+                else np.empty(0, dtype=np.uint8)  # can't map an empty file
+            )
+            return StringColumn(data, offsets)
+
+        empty = self.meta["n_rows"] == 0
+        self.embs = (
+            np.empty((0, self.meta["dim"]), np.float32) if empty else load("embs.npy")
+        )
+        self.codes = self.scales = None
+        if self.meta["quantized"] and not empty:
+            self.codes, self.scales = load("codes.npy"), load("scales.npy")
+        self.ids, self.labels = strings("ids"), strings("labels")
+        # field -> (value code of each row, values)
+        self.facets = {
+            field: (
+                np.empty(0, np.int32) if empty else load(f"facet_{field}.npy"),
+                values,
+            )
+            for field, values in self.meta.get("facets", {}).items()
+        }
+
+    def __len__(self):
+        return self.meta["n_rows"]
+
+
+def current_version(name: str, root: str = EMB_SNAPSHOT_DIR) -> str:
+    """
+    Current version of a snapshot, or None if it was never exported.
+    """
+    try:
+        with open(os.path.join(root, name, CURRENT), "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def open_snapshot(name: str, root: str = EMB_SNAPSHOT_DIR) -> EmbeddingSnapshot:
+    """
+    Open the current version of a snapshot, or None if it was never exported.
+    """
+    version = current_version(name, root)
+    if version is None:
+        return None
+    return EmbeddingSnapshot(os.path.join(root, name, version))
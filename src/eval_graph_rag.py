@@ -5,16 +5,23 @@ import pandas as pd
 from langchain_openai import ChatOpenAI, AzureChatOpenAI
 
 from src.utils import *
-from src.data_utils import Neo4jGraphManager
+from src.conn_pool import get_pool
 from src.tools import GraphQueryAgent
+from src.answer_cache import AnswerCache
+from src.eval_runner import EvalRunner
+from src.prompt_templates import kg_rag_agent_sys_prompt
+from src.tracing import MemorySink, get_tracer
 from src.config import *
 
 
 def main():
-    ngm = Neo4jGraphManager.from_env()  # instantiate neo4j graph manager
-    ngm.from_table(
-        f"{TABLE_SCHEMA}.{TABLE_NAME}", reset=True
-    )  # create graph from table
+    ngm = get_pool().graph_manager()  # shared with the agent's tools
+    if INCREMENTAL_SYNC:
+        ngm.sync_from_table(f"{TABLE_SCHEMA}.{TABLE_NAME}")  # sync changed rows
+    else:
+        ngm.from_table(
+            f"{TABLE_SCHEMA}.{TABLE_NAME}", reset=True
+        )  # create graph from table
 
     # embed graph objects
     ngm.embed_objs()
@@ -26,29 +33,32 @@ def main():
 
     # eval on test set
     df_queries = pd.read_csv(TEST_QUERIES_PATH, sep=";", index_col="id")
-    responses = {}
-    gqa = GraphQueryAgent(ngm.graph, llm)  # instantiate graph query agent
-
-    # iter thru queries and generate responses
-    for qid, row in df_queries.iterrows():
-        query = row["query"]
-        try:
-            result = gqa.run(query)
-            responses[qid] = result
-            print(result)
-        except Exception as e:
-            print(f"error: {e}")
+    # no answer cache: answers of earlier runs would skew accuracy & latency
+    gqa = GraphQueryAgent(ngm.graph, llm, answer_cache=AnswerCache(enabled=False))
+
+    # run queries concurrently, resuming from the checkpoint
+    trace_sink = MemorySink()  # collect spans of the runs
+    get_tracer().add_sink(trace_sink)
+    # answers in the checkpoint are only reused for the same data & agent config
+    agent_config = {
+        "agent": gqa.cache_namespace(),  # kind & schema
+        "model": OPENAI_LLM_VERSION,
+        "max_tokens": MAX_TOKENS,
+        "temperature": TEMPERATURE,
+        "prompt": kg_rag_agent_sys_prompt,
+    }
+    runner = EvalRunner(gqa.run, GRAPH_CHECKPOINT_PATH, config=agent_config)
+    df_responses = runner.run(df_queries)
 
     # save responses to csv
-    df_responses = pd.DataFrame.from_dict(
-        responses, orient="index", columns=["response"]
-    )
     responses_path = GRAPH_RESPONSES_EVAL_PATH
     os.makedirs(os.path.dirname(responses_path), exist_ok=True)
     with open(responses_path, "w") as f:
         df_responses.to_csv(f, sep=";")
     # compute accuracy of responses
-    eval_res = eval_rag_responses(GRAPH_RESPONSES_EVAL_PATH, GRAPH_RESULTS_PATH)
+    eval_res = eval_rag_responses(
+        GRAPH_RESPONSES_EVAL_PATH, GRAPH_RESULTS_PATH, trace_stats=trace_sink.aggregate()
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+"""Concurrent, resumable evaluation of a RAG agent on a test set of queries"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
+from langchain_core.callbacks import BaseCallbackHandler
+from src.utils import get_data_version, retry_with_backoff
+from src.config import EVAL_MAX_CALLS_PER_MIN, EVAL_MAX_RETRIES, EVAL_MAX_WORKERS
+
+if TYPE_CHECKING:  # type hints only
+    import pandas as pd
+
+
+class RateLimiter:
+    """
+    Client-side rate limiter (token bucket) shared between threads.
+    """
+
+    def __init__(self, max_calls_per_min: float = EVAL_MAX_CALLS_PER_MIN):
+        self.interval = 60.0 / max_calls_per_min
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a call is allowed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimitCallback(BaseCallbackHandler):
+    """
+    Callback that rate-limits each LLM call of an agent.
+    """
+
+    def __init__(self, rate_limiter: RateLimiter):
+        self.rate_limiter = rate_limiter
+
+    def on_llm_start(self, *args, **kwargs):
+        self.rate_limiter.acquire()
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self.rate_limiter.acquire()
+
+
+class EvalRunner:
+    """
+    Run an agent on a test set of queries with bounded concurrency.
+    Each answer is appended to a checkpoint file (jsonl) as soon as it is done,
+    and queries already answered in the checkpoint are skipped on resume. The
+    checkpoint is keyed by the data version & the agent config: a checkpoint
+    written for other data or another agent is ignored & overwritten.
+    """
+
+    def __init__(
+        self,
+        run_fn,
+        checkpoint_path: str,
+        max_workers: int = EVAL_MAX_WORKERS,
+        max_calls_per_min: float = EVAL_MAX_CALLS_PER_MIN,
+        max_retries: int = EVAL_MAX_RETRIES,
+        config: dict = None,
+    ):
+        """
+        Args:
+            run_fn (callable): agent run function, called as run_fn(query, callbacks=...)
+            checkpoint_path (str): path to the checkpoint file
+            max_workers (int): max number of queries run concurrently
+            max_calls_per_min (float): max number of LLM calls per minute
+            max_retries (int): max number of retries of a query on transient errors
+            config (dict): agent config the answers depend on, e.g. model,
+                prompt & schema; answers of another config are not reused
+        """
+        self.run_fn = run_fn
+        self.checkpoint_path = checkpoint_path
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.config = config or {}
+        self.callbacks = [RateLimitCallback(RateLimiter(max_calls_per_min))]
+        self._lock = threading.Lock()
+
+    def checkpoint_key(self) -> dict:
+        """
+        Key of the answers of a run: data version & hash of the agent config.
+        """
+        config = json.dumps(self.config, sort_keys=True, default=str)
+        return {
+            "data_version": get_data_version(),
+            "config_hash": hashlib.sha256(config.encode()).hexdigest()[:16],
+        }
+
+    def load_checkpoint(self) -> dict:
+        """
+        Load answered queries from the checkpoint file, if it was written with
+        the same key (first line).
+        Returns:
+            results (dict): query id -> result dict
+        """
+        results = {}
+        if not os.path.exists(self.checkpoint_path):
+            return results
+        with open(self.checkpoint_path, "r") as f:
+            lines = [line for line in f if line.strip()]
+        header = json.loads(lines[0]) if lines else {}
+        if header.get("checkpoint") != self.checkpoint_key():
+            print(
+                f"ignoring checkpoint {self.checkpoint_path}: written for another "
+                f"data version or agent config"
+            )
+            return results
+        for line in lines[1:]:
+            result = json.loads(line)
+            results[result["id"]] = result
+        return results
+
+    def _run_query(self, qid, query: str) -> dict:
+        """
+        Run a single query & append its result to the checkpoint.
+        """
+        start_time = time.perf_counter()
+        response = retry_with_backoff(
+            self.run_fn, query, callbacks=self.callbacks, max_retries=self.max_retries
+        )
+        result = {
+            "id": qid.item() if hasattr(qid, "item") else qid,  # numpy -> python
+            "response": response,
+            "latency": time.perf_counter() - start_time,
+        }
+        with self._lock, open(self.checkpoint_path, "a") as f:
+            f.write(json.dumps(result, default=str) + "\n")
+        return result
+
+    def run(self, df_queries: "pd.DataFrame") -> "pd.DataFrame":
+        """
+        Run the agent on all queries not answered yet.
+        Args:
+            df_queries (pd.DataFrame): queries, indexed by id, with a "query" column
+        Returns:
+            df_responses (pd.DataFrame): responses & latencies, indexed by id
+        """
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        # ids are read back from json, so key results by id as string
+        results = {str(qid): result for qid, result in self.load_checkpoint().items()}
+        if not results:  # fresh run: start a new checkpoint
+            with open(self.checkpoint_path, "w") as f:
+                f.write(json.dumps({"checkpoint": self.checkpoint_key()}) + "\n")
+        todo = [
+            (qid, row["query"])
+            for qid, row in df_queries.iterrows()
+            if str(qid) not in results
+        ]
+        print(
+            f"{len(results)} answers reused from checkpoint {self.checkpoint_path}, "
+            f"{len(todo)} queries to run"
+        )
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            futures = {
+                executor.submit(self._run_query, qid, query): qid for qid, query in todo
+            }
+            for i, future in enumerate(as_completed(futures)):
+                qid = futures[future]
+                try:
+                    result = future.result()
+                    results[str(qid)] = result
+                    print(f"[{i + 1}/{len(todo)}] query {qid}: {result['latency']:.1f}s")
+                except Exception as e:
+                    print(f"error in query {qid}: {e}")
+
+        import pandas as pd  # loaded on first use
+
+        df_responses = pd.DataFrame.from_records(
+            list(results.values()), columns=["id", "response", "latency"]
+        ).set_index("id")
+        return df_responses
@@ -5,14 +5,19 @@ import pandas as pd
 from langchain_openai import ChatOpenAI, AzureChatOpenAI
 
 from src.utils import *
-from src.data_utils import SQLDBManager
+from src.conn_pool import get_pool
 from src.tools import SQLQueryAgent
+from src.answer_cache import AnswerCache
+from src.eval_runner import EvalRunner
+from src.prompt_templates import sql_rag_agent_sys_prompt
+from src.tracing import MemorySink, get_tracer
 from src.config import *
 
 
 def main():
     ## Prepare & init DB
-    dbm = SQLDBManager.from_env(
+    pool = get_pool()  # shared with the agent's tools
+    dbm = pool.sql_manager(
         schema=TABLE_SCHEMA, include_tables=[TABLE_NAME]
     )  # instantiate SQLDBManager
     llm = AzureChatOpenAI(
@@ -23,10 +28,13 @@ def main():
     src_table = f"{TABLE_SCHEMA}.{TABLE_NAME}"
     data_table = f"{src_table}_filtered"
 
-    dbm = SQLDBManager.from_env()  # instantiate SQLDBManager
+    dbm = pool.sql_manager()  # instantiate SQLDBManager
 
-    # filter data table and create new
-    dbm.filter_table(src_table, REQ_COLS_PATH, TABLE_PRIMARY_KEY, overwrite=True)
+    # filter data table and create new (or sync only changed rows)
+    if INCREMENTAL_SYNC:
+        dbm.sync_table(src_table, REQ_COLS_PATH, TABLE_PRIMARY_KEY)
+    else:
+        dbm.filter_table(src_table, REQ_COLS_PATH, TABLE_PRIMARY_KEY, overwrite=True)
 
     # clean html
     dbm.clean_html(data_table, [TEXT_COL], TABLE_PRIMARY_KEY)  # clean html
@@ -36,32 +44,37 @@ def main():
         f"{TABLE_SCHEMA}.{TABLE_NAME}",
         cols_to_embed=COLS_TO_EMBED,
         pk=TABLE_PRIMARY_KEY,
+        incremental=INCREMENTAL_SYNC,
     )
 
     # eval on test set
     df_queries = pd.read_csv(TEST_QUERIES_PATH, sep=";", index_col="id")
-    responses = {}
-    dqa = SQLQueryAgent(dbm.db, llm)  # instantiate db query agent
+    # no answer cache: answers of earlier runs would skew accuracy & latency
+    dqa = SQLQueryAgent(dbm.db, llm, answer_cache=AnswerCache(enabled=False))
 
-    # iter thru queries and generate responses
-    for qid, row in df_queries.iterrows():
-        query = row["query"]
-        try:
-            result = dqa.run(query=query)
-            responses[qid] = result
-        except Exception as e:
-            print(f"error: {e}")
+    # run queries concurrently, resuming from the checkpoint
+    trace_sink = MemorySink()  # collect spans of the runs
+    get_tracer().add_sink(trace_sink)
+    # answers in the checkpoint are only reused for the same data & agent config
+    agent_config = {
+        "agent": dqa.cache_namespace(),  # kind & schema
+        "model": OPENAI_LLM_VERSION,
+        "max_tokens": MAX_TOKENS,
+        "temperature": TEMPERATURE,
+        "prompt": sql_rag_agent_sys_prompt,
+    }
+    runner = EvalRunner(dqa.run, SQL_CHECKPOINT_PATH, config=agent_config)
+    df_responses = runner.run(df_queries)
 
     # save responses to csv
-    df_responses = pd.DataFrame.from_dict(
-        responses, orient="index", columns=["response"]
-    )
     responses_path = SQL_RESPONSES_EVAL_PATH
     os.makedirs(os.path.dirname(responses_path), exist_ok=True)
     with open(responses_path, "w") as f:
         df_responses.to_csv(f, sep=";")
     # compute accuracy of responses
-    eval_rag_responses(responses_path, SQL_RESULTS_PATH)
+    eval_rag_responses(
+        responses_path, SQL_RESULTS_PATH, trace_stats=trace_sink.aggregate()
+    )
 
 
 if __name__ == "__main__":
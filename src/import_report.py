@@ -0,0 +1,137 @@
+"""Import-time report of the src modules, from `python -X importtime`, to check startup in CI"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from src.config import IMPORT_REPORT_MODULES, IMPORT_TIME_BUDGET_MS, LAZY_PACKAGES
+
+# "import time: <self us> | <cumulative us> | <2 spaces per nesting level><module>"
+LINE_REGEX = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def _importtime(code: str) -> list:
+    """
+    Run code in a fresh interpreter & parse its import-time log.
+    Returns:
+        entries (list): dicts with module, depth, self_us & cumulative_us, in
+            the order the imports finished
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"'{code}' failed:\n{proc.stderr[-2000:]}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = LINE_REGEX.match(line)
+        if match:
+            entries.append(
+                {
+                    "module": match.group(4),
+                    "depth": len(match.group(3)) // 2,
+                    "self_us": int(match.group(1)),
+                    "cumulative_us": int(match.group(2)),
+                }
+            )
+    return entries
+
+
+def import_report(module: str, repeats: int = 3, top: int = 15) -> dict:
+    """
+    Import-time breakdown of a module, excluding the interpreter startup.
+    The fastest of a few runs is kept, as import times are noisy.
+    Args:
+        module (str): module to import, e.g. "src.tools"
+        repeats (int): number of runs
+        top (int): number of slowest modules & packages reported
+    Returns:
+        report (dict): total time, slowest modules (cumulative) & top-level
+            packages (self time), and the lazy packages that were loaded
+    """
+    startup = {entry["module"] for entry in _importtime("pass")}
+    runs = []
+    for _ in range(repeats):
+        entries = [e for e in _importtime(f"import {module}") if e["module"] not in startup]
+        total_us = sum(e["cumulative_us"] for e in entries if e["depth"] == 0)
+        runs.append((total_us, entries))
+    total_us, entries = min(runs, key=lambda run: run[0])
+
+    packages = defaultdict(int)  # top-level package -> self time
+    for entry in entries:
+        packages[entry["module"].split(".")[0]] += entry["self_us"]
+    slowest = sorted(entries, key=lambda e: e["cumulative_us"], reverse=True)[:top]
+    loaded = {entry["module"].split(".")[0] for entry in entries}
+    return {
+        "module": module,
+        "total_ms": total_us / 1000,
+        "n_modules": len(entries),
+        "slowest_modules": [
+            {"module": e["module"], "cumulative_ms": e["cumulative_us"] / 1000}
+            for e in slowest
+        ],
+        "packages": [
+            {"package": package, "self_ms": self_us / 1000}
+            for package, self_us in sorted(
+                packages.items(), key=lambda item: item[1], reverse=True
+            )[:top]
+        ],
+        "lazy_packages_loaded": sorted(loaded & set(LAZY_PACKAGES)),
+    }
+
+
+def check(report: dict, budget_ms: float = IMPORT_TIME_BUDGET_MS) -> list:
+    """
+    Startup regressions of a module: over the time budget, or eagerly loading
+    a package that must be imported on first use.
+    Returns:
+        errors (list): error messages, empty if the module passes
+    """
+    errors = []
+    if report["total_ms"] > budget_ms:
+        errors.append(
+            f"{report['module']}: import takes {report['total_ms']:.0f}ms, "
+            f"over the budget of {budget_ms:.0f}ms"
+        )
+    if report["lazy_packages_loaded"]:
+        errors.append(
+            f"{report['module']}: eagerly imports "
+            f"{', '.join(report['lazy_packages_loaded'])}"
+        )
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modules", nargs="+", default=IMPORT_REPORT_MODULES)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--out", default="outputs/import_report.json")
+    args = parser.parse_args()
+
+    reports, errors = [], []
+    for module in args.modules:
+        report = import_report(module, args.repeats, args.top)
+        reports.append(report)
+        errors += check(report, args.budget_ms)
+        print(f"{module}: {report['total_ms']:.0f}ms, {report['n_modules']} modules")
+        for package in report["packages"][:5]:
+            print(f"    {package['package']:<24} {package['self_ms']:>8.1f}ms")
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump({"budget_ms": args.budget_ms, "reports": reports}, f, indent=2)
+    for error in errors:
+        print(f"error: {error}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""In-process BM25 index of the embedded text, to answer keyword queries without embedding them"""
+
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from src.emb_snapshot import snapshot_name
+from src.config import (
+    BM25_B,
+    BM25_K1,
+    EMB_SNAPSHOT_CHECK_INTERVAL,
+    LEXICAL_DIR,
+    LEXICAL_MIN_MARGIN,
+    RRF_K,
+)
+
+TOKEN_REGEX = re.compile(r"\w+")
+
+
+def tokenize(text) -> list:
+    """
+    Lowercased word tokens of a text.
+    """
+    return TOKEN_REGEX.findall(str(text).lower()) if text is not None else []
+
+
+class LexicalIndex:
+    """
+    Inverted index of the texts of the rows, scored with BM25. Rows are keyed by
+    their id and can be inserted, updated & deleted incrementally; each row may
+    belong to a group (e.g. object type) to restrict searches to.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        """
+        Args:
+            k1 (float): term frequency saturation
+            b (float): document length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> doc -> term frequency
+        self.docs = {}  # doc -> (id, name, group, length, term frequencies)
+        self.keys = {}  # id -> doc
+        self.total_len = 0
+        self.next_doc = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def upsert(self, ids: list, names: list, texts: list, groups: list = None):
+        """
+        Index rows, replacing the text of rows already indexed.
+        Args:
+            ids (list): ids of the rows
+            names (list): labels of the rows
+            texts (list): texts of the rows
+            groups (list): group of each row
+        """
+        groups = groups or [None] * len(ids)
+        with self._lock:
+            for id, name, text, group in zip(ids, names, texts, groups):
+                self._remove(id)
+                tfs = Counter(tokenize(text))
+                length = sum(tfs.values())
+                doc = self.keys[id] = self.next_doc
+                self.next_doc += 1
+                self.docs[doc] = (id, name, group, length, tfs)
+                for term, tf in tfs.items():
+                    self.postings[term][doc] = tf
+                self.total_len += length
+
+    def delete(self, ids: list) -> int:
+        """
+        Remove rows from the index.
+        Returns:
+            n_deleted (int): number of rows removed
+        """
+        with self._lock:
+            return sum(self._remove(id) for id in ids)
+
+    def _remove(self, id) -> bool:
+        doc = self.keys.pop(id, None)
+        if doc is None:
+            return False
+        _, _, _, length, tfs = self.docs.pop(doc)
+        for term in tfs:
+            postings = self.postings[term]
+            postings.pop(doc, None)
+            if not postings:
+                del self.postings[term]
+        self.total_len -= length
+        return True
+
+    def search(self, query: str, k: int = 10, groups: list = None) -> list:
+        """
+        Top-k rows by BM25 score of the query terms.
+        Args:
+            query (str): query text
+            k (int): max number of matches
+            groups (list): only search rows of these groups
+        Returns:
+            matches (list): dicts with id, name, score, sim (score relative to a
+                row matching each query term once, in [0, 1]) & coverage (share
+                of the query terms found in the row), sorted by score
+        """
+        terms = set(tokenize(query))
+        n_docs = len(self.docs)
+        if not terms or not n_docs or k <= 0:
+            return []
+        avg_len = self.total_len / n_docs or 1.0
+        scores, matched = defaultdict(float), defaultdict(int)
+        max_score = 0.0  # score of an average length row with each term once
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            max_score += idf
+            for doc, tf in postings.items():
+                length = self.docs[doc][3]
+                norm = self.k1 * (1 - self.b + self.b * length / avg_len)
+                scores[doc] += idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[doc] += 1
+        if groups is not None:
+            groups = set(groups)
+            scores = {doc: s for doc, s in scores.items() if self.docs[doc][2] in groups}
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [
+            {
+                "id": self.docs[doc][0],
+                "name": self.docs[doc][1],
+                "score": score,
+                "sim": min(1.0, score / max_score),
+                "coverage": matched[doc] / len(terms),
+            }
+            for doc, score in top
+        ]
+
+    def save(self, name: str, root: str = LEXICAL_DIR):
+        """
+        Persist the index, replacing the previous one atomically.
+        Args:
+            name (str): index name, e.g. table name
+            root (str): directory of the indexes
+        """
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, f"{name}.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self._lock, open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "k1": self.k1,
+                    "b": self.b,
+                    "docs": [
+                        [id, row_name, group, tfs]
+                        for id, row_name, group, _, tfs in self.docs.values()
+                    ],
+                },
+                f,
+                default=str,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, name: str, root: str = LEXICAL_DIR):
+        """
+        Load an index, or None if it was never built.
+        """
+        try:
+            with open(os.path.join(root, f"{name}.json"), "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        index = cls(data["k1"], data["b"])
+        for doc, (id, row_name, group, tfs) in enumerate(data["docs"]):
+            length = sum(tfs.values())
+            index.keys[id] = doc
+            index.docs[doc] = (id, row_name, group, length, tfs)
+            for term, tf in tfs.items():
+                index.postings[term][doc] = tf
+            index.total_len += length
+        index.next_doc = len(index.docs)
+        return index
+
+
+def is_confident(query: str, matches: list, min_margin: float = LEXICAL_MIN_MARGIN) -> bool:
+    """
+    Whether lexical matches answer a query on their own: the query is a phrase
+    of the top match's name, or the top match has all query terms & a clear
+    score margin over the next one.
+    """
+    if not matches:
+        return False
+    phrase = " ".join(tokenize(query))
+    if phrase and f" {phrase} " in f" {' '.join(tokenize(matches[0]['name']))} ":
+        return True
+    if matches[0]["coverage"] < 1:
+        return False
+    return len(matches) == 1 or matches[0]["score"] >= min_margin * matches[1]["score"]
+
+
+def rrf_fuse(rankings: list, k: int = 10, rrf_k: int = RRF_K) -> list:
+    """
+    Fuse rankings by reciprocal rank: sum of 1 / (rrf_k + rank) over rankings.
+    Args:
+        rankings (list): lists of matches (dicts with an id), best first
+        k (int): max number of matches
+        rrf_k (int): rank offset, damping the weight of the top ranks
+    Returns:
+        matches (list): matches with the fields of all rankings (the first
+            ranking's on conflicts) & the fused score, sorted by score
+    """
+    scores, merged = defaultdict(float), {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            scores[match["id"]] += 1 / (rrf_k + rank)
+            merged[match["id"]] = {**match, **merged.get(match["id"], {})}
+    top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+    return [
+        {
+            **{key: v for key, v in merged[id].items() if key != "coverage"},
+            "score": score,
+        }
+        for id, score in top
+    ]
+
+
+# process-level indexes, keyed by name: (index, file mtime, last check)
+_indexes = {}
+_lock = threading.Lock()
+_lexical_dir = LEXICAL_DIR
+
+
+def set_lexical_dir(path: str):
+    """
+    Set the directory the indexes are loaded from (None to disable lexical
+    search), e.g. for benchmarks. Drops the loaded indexes.
+    """
+    global _lexical_dir
+    with _lock:
+        _lexical_dir = path
+        _indexes.clear()
+
+
+def _mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_lexical_index(table: str) -> LexicalIndex:
+    """
+    Get the lexical index of a table (or of the graph), loaded on first use &
+    reloaded when it was saved again, or None if it was never built.
+    Args:
+        table (str): name of table, or "graph"
+    """
+    name = snapshot_name(table)
+    with _lock:
+        if _lexical_dir is None:
+            return None
+        path = os.path.join(_lexical_dir, f"{name}.json")
+        entry = _indexes.get(name)
+        now = time.monotonic()
+        if entry is not None and now - entry[2] > EMB_SNAPSHOT_CHECK_INTERVAL:
+            if _mtime(path) != entry[1]:
+                entry = None  # saved again: reload
+            else:
+                entry = _indexes[name] = (entry[0], entry[1], now)
+        if entry is None:
+            mtime = _mtime(path)
+            index = LexicalIndex.load(name, _lexical_dir) if mtime else None
+            entry = _indexes[name] = (index, mtime, now)
+    return entry[0]
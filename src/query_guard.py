@@ -0,0 +1,179 @@
+import json
+import re
+from src.config import (
+    QUERY_MAX_COST,
+    QUERY_MAX_GRAPH_ROWS,
+    QUERY_MAX_ROWS,
+    QUERY_READ_ONLY,
+    QUERY_TIMEOUT,
+)
+
+# string literals, quoted identifiers & comments, blanked before keyword checks
+SQL_NOISE = re.compile(r"'(?:[^']|'')*'|\"[^\"]*\"|--[^\n]*|/\*.*?\*/", re.DOTALL)
+CYPHER_NOISE = re.compile(
+    r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|//[^\n]*|/\*.*?\*/", re.DOTALL
+)
+SQL_READS = re.compile(r"\s*(SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+SQL_WRITES = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|INTO|CREATE|DROP|ALTER|TRUNCATE)\b", re.IGNORECASE
+)
+CYPHER_WRITES = re.compile(
+    r"\b(CREATE|MERGE|DELETE|DETACH|SET|REMOVE|DROP|FOREACH|LOAD\s+CSV)\b"
+    r"|\bCALL\s+(apoc\.(create|merge|refactor|periodic)|db\.create|dbms\.|gds\.\w+\.write)"
+    r"|\bIN\s+TRANSACTIONS\b",
+    re.IGNORECASE,
+)
+
+
+class QueryRejected(Exception):
+    """
+    A generated query rejected by the guard, with a hint for the agent.
+    """
+
+    def __init__(self, reason: str, hint: str, details: dict = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.hint = hint
+        self.details = details or {}
+
+    def to_message(self) -> str:
+        return error_message("query_rejected", self.reason, self.hint, **self.details)
+
+
+def error_message(error: str, reason: str, hint: str, **details) -> str:
+    """
+    Structured error returned to the agent instead of a result.
+    Args:
+        error (str): error type, e.g. "query_rejected", "timeout" or "query_failed"
+        reason (str): what went wrong
+        hint (str): how the agent can recover
+        details: extra fields, e.g. plan estimates
+    """
+    return json.dumps(
+        {"error": error, "reason": reason, "hint": hint, **details}, default=str
+    )
+
+
+def failure_message(e: Exception) -> str:
+    """
+    Structured error for a query that failed or timed out.
+    """
+    if "timeout" in str(e).lower() or "timed out" in str(e).lower():
+        return error_message(
+            "timeout",
+            f"query ran longer than {QUERY_TIMEOUT}s",
+            "add conditions or a smaller LIMIT so the query runs faster",
+        )
+    return error_message(
+        "query_failed", str(e), "fix the query using the schema and retry"
+    )
+
+
+def _check_statement(text: str, writes: re.Pattern, read_only: bool):
+    """
+    Check a query with literals & comments blanked: single statement, no writes.
+    """
+    if ";" in text.strip().rstrip(";"):
+        raise QueryRejected(
+            "multiple statements", "send a single query, without ';' in between"
+        )
+    if read_only and (match := writes.search(text)):
+        raise QueryRejected(
+            f"write statement ({match.group(0).upper()}) in read-only mode",
+            "only read queries are allowed, rewrite the query to read data",
+        )
+
+
+def guard_sql(
+    dbm, sql: str, limit: int = QUERY_MAX_ROWS, read_only: bool = QUERY_READ_ONLY
+) -> str:
+    """
+    Check a generated sql query before running it: single statement, no writes
+    in read-only mode, a LIMIT (injected if missing) & an estimated cost within
+    budget.
+    Args:
+        dbm (SQLDBManager): sql db manager, used to explain the query
+        sql (str): sql query
+        limit (int): LIMIT injected into queries without one
+        read_only (bool): reject write statements
+    Returns:
+        sql (str): the query to run, with a LIMIT
+    Raises:
+        QueryRejected: if the query must not be run
+    """
+    sql = sql.strip().rstrip(";").strip()
+    text = SQL_NOISE.sub(" ", sql)
+    is_read = SQL_READS.match(text) is not None
+    if read_only and not is_read:
+        raise QueryRejected(
+            f"statement ({text.split()[0].upper() if text.split() else ''}) "
+            "is not a read query in read-only mode",
+            "only SELECT queries are allowed",
+        )
+    _check_statement(text, SQL_WRITES, read_only)
+    if is_read and not re.search(r"\b(LIMIT|FETCH\s+FIRST)\b", text, re.IGNORECASE):
+        sql = f"{sql}\nLIMIT {int(limit)}"
+
+    plan = dbm.explain(sql)
+    cost, rows = plan["Total Cost"], plan["Plan Rows"]
+    if cost > QUERY_MAX_COST:
+        raise QueryRejected(
+            f"estimated cost {cost:.0f} exceeds the budget of {QUERY_MAX_COST}",
+            "filter on indexed columns (e.g. pyid), avoid joins without conditions, "
+            "or select fewer rows",
+            {"estimated_cost": cost, "estimated_rows": rows},
+        )
+    return sql
+
+
+def _plan_rows(plan: dict) -> tuple:
+    """
+    Max estimated rows over the operators of a neo4j plan & the operator types.
+    """
+    rows = plan.get("args", {}).get("EstimatedRows", 0)
+    ops = {plan.get("operatorType", "").split("@")[0]}
+    for child in plan.get("children", []):
+        child_rows, child_ops = _plan_rows(child)
+        rows = max(rows, child_rows)
+        ops |= child_ops
+    return rows, ops
+
+
+def guard_cypher(
+    ngm, query: str, limit: int = QUERY_MAX_ROWS, read_only: bool = QUERY_READ_ONLY
+) -> str:
+    """
+    Check a generated cypher query before running it: single statement, no
+    writes in read-only mode, a LIMIT (injected if missing) & estimated rows
+    of every operator within budget.
+    Args:
+        ngm (Neo4jGraphManager): neo4j graph manager, used to explain the query
+        query (str): cypher query
+        limit (int): LIMIT injected into queries without one
+        read_only (bool): reject write statements
+    Returns:
+        query (str): the query to run, with a LIMIT
+    Raises:
+        QueryRejected: if the query must not be run
+    """
+    query = query.strip().rstrip(";").strip()
+    text = CYPHER_NOISE.sub(" ", query)
+    _check_statement(text, CYPHER_WRITES, read_only)
+    if (
+        re.search(r"\bRETURN\b", text, re.IGNORECASE)
+        and not re.search(r"\b(LIMIT|UNION)\b", text, re.IGNORECASE)
+    ):
+        query = f"{query}\nLIMIT {int(limit)}"
+
+    plan = ngm.explain(query)
+    rows, ops = _plan_rows(plan)
+    if rows > QUERY_MAX_GRAPH_ROWS:
+        hint = "match from a node with a known pyid or label, and add conditions"
+        if "CartesianProduct" in ops:
+            hint = "connect the MATCH patterns, unconnected ones make a cartesian product"
+        raise QueryRejected(
+            f"estimated {rows:.0f} rows exceed the budget of {QUERY_MAX_GRAPH_ROWS}",
+            hint,
+            {"estimated_rows": rows},
+        )
+    return query
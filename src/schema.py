@@ -0,0 +1,219 @@
+from abc import ABC, abstractmethod
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import TYPE_CHECKING
+from src.data_utils import SQLDBManager
+from src.config import (
+    SCHEMA_CHECK_INTERVAL,
+    SCHEMA_EXCLUDED_PROPS,
+    SCHEMA_MAX_SAMPLE_CHARS,
+    SCHEMA_SAMPLE_ROWS,
+)
+
+if TYPE_CHECKING:  # type hints only
+    from langchain.graphs import Neo4jGraph
+    from langchain.sql_database import SQLDatabase
+
+
+class SchemaSnapshot(ABC):
+    """
+    Compact schema of a database for agent prompts, built once and reused.
+    A cheap fingerprint of the schema is checked at most every `check_interval`
+    seconds, and the snapshot is rebuilt when it changes.
+    """
+
+    def __init__(self, check_interval: float = SCHEMA_CHECK_INTERVAL):
+        """
+        Args:
+            check_interval (float): min seconds between schema change checks
+        """
+        self.check_interval = check_interval
+        self._text = None
+        self._fingerprint = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def compute_fingerprint(self) -> str:
+        """
+        Cheap hash of the schema, used to detect changes.
+        """
+
+    @abstractmethod
+    def build(self) -> str:
+        """
+        Render the compact schema.
+        """
+
+    @property
+    def text(self) -> str:
+        """
+        Compact schema, rebuilt if the schema changed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._text is None or now - self._checked > self.check_interval:
+                fingerprint = self.compute_fingerprint()
+                if self._text is None or fingerprint != self._fingerprint:
+                    self._text = self.build()
+                    self._fingerprint = fingerprint
+                self._checked = now
+            return self._text
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Fingerprint of the schema of the current snapshot.
+        """
+        self.text  # build snapshot if needed
+        return self._fingerprint
+
+    def refresh(self):
+        """
+        Rebuild the snapshot on next use.
+        """
+        with self._lock:
+            self._text = None
+
+
+class SQLSchemaSnapshot(SchemaSnapshot):
+    """
+    Schema of the usable tables of a sql db: columns with types and a few sample
+    rows with truncated values, without excluded (e.g. embeddings) columns.
+    """
+
+    def __init__(
+        self,
+        db: "SQLDatabase",
+        excluded_cols: list = SCHEMA_EXCLUDED_PROPS,
+        sample_rows: int = SCHEMA_SAMPLE_ROWS,
+        max_sample_chars: int = SCHEMA_MAX_SAMPLE_CHARS,
+        **kwargs,
+    ):
+        """
+        Args:
+            db (SQLDatabase): sql db
+            excluded_cols (list): columns left out of the schema
+            sample_rows (int): number of sample rows per table
+            max_sample_chars (int): max length of a sample value
+        """
+        super().__init__(**kwargs)
+        self.dbm = SQLDBManager()
+        self.dbm.db = db
+        self.excluded_cols = set(excluded_cols)
+        self.sample_rows = sample_rows
+        self.max_sample_chars = max_sample_chars
+
+    def _columns(self) -> list:
+        """
+        (table, column, type) of the usable tables.
+        """
+        tables = set(self.dbm.db.get_usable_table_names())
+        schema = getattr(self.dbm.db, "_schema", None) or "public"
+        rows = self.dbm.query(
+            """
+            SELECT table_name, column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema = %s
+            ORDER BY table_name, ordinal_position;
+            """,
+            (schema,),
+        )
+        return [row for row in rows if row[0] in tables]
+
+    def compute_fingerprint(self) -> str:
+        return hashlib.sha256(json.dumps(self._columns()).encode()).hexdigest()
+
+    def build(self) -> str:
+        schema = getattr(self.dbm.db, "_schema", None) or "public"
+        tables = {}
+        for table, col, col_type in self._columns():
+            if col not in self.excluded_cols:
+                tables.setdefault(table, []).append((col, col_type))
+
+        lines = []
+        for table, cols in tables.items():
+            lines.append(f"Table {schema}.{table}:")
+            lines.append(
+                "columns: " + ", ".join(f"{col} ({col_type})" for col, col_type in cols)
+            )
+            if self.sample_rows:
+                col_names = ", ".join(f'"{col}"' for col, _ in cols)
+                rows = self.dbm.query(
+                    f'SELECT {col_names} FROM {schema}."{table}" LIMIT {int(self.sample_rows)};'
+                )
+                lines.append("sample rows:")
+                lines.extend(
+                    " | ".join(self._truncate(value) for value in row) for row in rows
+                )
+            lines.append("")
+        return "\n".join(lines)
+
+    def _truncate(self, value) -> str:
+        value = " ".join(str(value).split())
+        if len(value) > self.max_sample_chars:
+            value = value[: self.max_sample_chars] + "..."
+        return value
+
+
+class GraphSchemaSnapshot(SchemaSnapshot):
+    """
+    Schema of a neo4j graph: node labels with property types and relationship
+    patterns, without excluded (e.g. embedding) properties.
+    """
+
+    def __init__(
+        self,
+        graph: "Neo4jGraph",
+        excluded_props: list = SCHEMA_EXCLUDED_PROPS,
+        **kwargs,
+    ):
+        """
+        Args:
+            graph (Neo4jGraph): neo4j graph
+            excluded_props (list): properties left out of the schema
+        """
+        super().__init__(**kwargs)
+        self.graph = graph
+        self.excluded_props = set(excluded_props)
+
+    def compute_fingerprint(self) -> str:
+        result = self.graph.query(
+            """
+            CALL db.labels() YIELD label WITH collect(label) AS labels
+            CALL db.relationshipTypes() YIELD relationshipType
+            WITH labels, collect(relationshipType) AS rels
+            CALL db.propertyKeys() YIELD propertyKey
+            RETURN labels, rels, collect(propertyKey) AS props
+            """
+        )
+        return hashlib.sha256(json.dumps(result, default=str).encode()).hexdigest()
+
+    def build(self) -> str:
+        if self._text is not None and hasattr(self.graph, "refresh_schema"):
+            self.graph.refresh_schema()  # schema changed since the last snapshot
+        structured = getattr(self.graph, "structured_schema", None)
+        if not structured:
+            # only the schema string is available, drop excluded properties from it
+            pattern = "|".join(map(re.escape, self.excluded_props))
+            return re.sub(
+                rf"\{{property: ({pattern}), type: [^}}]*\}},? ?", "", self.graph.schema
+            )
+
+        lines = ["Nodes:"]
+        for label, props in structured.get("node_props", {}).items():
+            props = [
+                f"{p['property']}: {p['type']}"
+                for p in props
+                if p["property"] not in self.excluded_props
+            ]
+            lines.append(f"{label}({', '.join(props)})")
+        lines.append("Relationships:")
+        lines.extend(
+            f"(:{rel['start']})-[:{rel['type']}]->(:{rel['end']})"
+            for rel in structured.get("relationships", [])
+        )
+        return "\n".join(lines)
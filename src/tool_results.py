@@ -0,0 +1,154 @@
+import itertools
+import json
+import threading
+from collections import OrderedDict
+from numbers import Number
+from src.config import (
+    SCHEMA_EXCLUDED_PROPS,
+    TOOL_RESULT_MAX_CHARS,
+    TOOL_RESULT_MAX_CURSORS,
+    TOOL_RESULT_MAX_ROWS,
+    TOOL_RESULT_MAX_VALUE_CHARS,
+)
+
+MIN_VECTOR_LEN = 64  # numeric lists at least this long are taken for embeddings
+
+
+def strip_embeddings(value, excluded: set = frozenset(SCHEMA_EXCLUDED_PROPS)):
+    """
+    Recursively drop embedding (& hash) keys and embedding-like numeric lists
+    from a result value.
+    Args:
+        value: row, node, list or scalar
+        excluded (set): keys to drop
+    """
+    if isinstance(value, dict):
+        return {
+            k: strip_embeddings(v, excluded)
+            for k, v in value.items()
+            if k not in excluded and not _is_vector(v)
+        }
+    if isinstance(value, (list, tuple)):
+        return [strip_embeddings(v, excluded) for v in value if not _is_vector(v)]
+    return value
+
+
+def _is_vector(value) -> bool:
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) >= MIN_VECTOR_LEN
+        and all(isinstance(v, Number) for v in value[:MIN_VECTOR_LEN])
+    )
+
+
+def _truncate_values(value, max_chars: int):
+    if isinstance(value, dict):
+        return {k: _truncate_values(v, max_chars) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_truncate_values(v, max_chars) for v in value]
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "..."
+    return value
+
+
+class ResultPages:
+    """
+    Shapes tool results to a row & char budget per page. Rows beyond the first
+    page are kept under a cursor, which the agent passes to the fetch_more tool
+    to get the next page. Only the most recent `max_cursors` results are kept.
+    """
+
+    def __init__(
+        self,
+        max_rows: int = TOOL_RESULT_MAX_ROWS,
+        max_chars: int = TOOL_RESULT_MAX_CHARS,
+        max_value_chars: int = TOOL_RESULT_MAX_VALUE_CHARS,
+        max_cursors: int = TOOL_RESULT_MAX_CURSORS,
+    ):
+        """
+        Args:
+            max_rows (int): max rows per page
+            max_chars (int): max chars per page
+            max_value_chars (int): max chars of a single value
+            max_cursors (int): max number of results kept for paging
+        """
+        self.max_rows = max_rows
+        self.max_chars = max_chars
+        self.max_value_chars = max_value_chars
+        self.max_cursors = max_cursors
+        self._results = OrderedDict()  # cursor -> (rows, offset, truncated)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def first_page(self, rows: list, truncated: bool = False) -> str:
+        """
+        Shape a result & render its first page.
+        Args:
+            rows (list): result rows, as dicts
+            truncated (bool): whether the result was cut before all rows were fetched
+        """
+        rows = [strip_embeddings(row) for row in rows]
+        with self._lock:
+            cursor = f"c{next(self._ids)}"
+            self._results[cursor] = (rows, 0, truncated)
+            while len(self._results) > self.max_cursors:
+                self._results.popitem(last=False)
+        return self._page(cursor)
+
+    def next_page(self, cursor: str) -> str:
+        """
+        Render the next page of a result.
+        Args:
+            cursor (str): cursor returned with the previous page
+        """
+        cursor = cursor.strip().strip("'\"")
+        with self._lock:
+            if cursor not in self._results:
+                return f"error: unknown or expired cursor '{cursor}', rerun the query"
+        return self._page(cursor)
+
+    def _page(self, cursor: str) -> str:
+        with self._lock:
+            rows, offset, truncated = self._results[cursor]
+        page, n_chars = [], 2
+        for row in rows[offset : offset + self.max_rows]:
+            row = _truncate_values(row, self.max_value_chars)
+            row_chars = len(json.dumps(row, default=str)) + 2
+            if page and n_chars + row_chars > self.max_chars:
+                break
+            page.append(row)
+            n_chars += row_chars
+        offset += len(page)
+
+        text = json.dumps(page, default=str)
+        if offset < len(rows):
+            with self._lock:
+                self._results[cursor] = (rows, offset, truncated)
+            text += (
+                f"\n[more available: {len(rows) - offset} more rows, "
+                f"call fetch_more with cursor '{cursor}']"
+            )
+        else:
+            with self._lock:
+                self._results.pop(cursor, None)
+            if truncated:
+                text += (
+                    f"\n[result truncated after {len(rows)} rows, "
+                    "refine the query to see the rest]"
+                )
+        return text
+
+
+_result_pages = None
+_result_pages_lock = threading.Lock()
+
+
+def get_result_pages() -> ResultPages:
+    """
+    Get the process-wide result pages shared by the tools.
+    """
+    global _result_pages
+    with _result_pages_lock:
+        if _result_pages is None:
+            _result_pages = ResultPages()
+    return _result_pages
@@ -1,17 +1,49 @@
-from ast import literal_eval
-from typing import List, Union
+from typing import TYPE_CHECKING, List, Optional, Union
 import re
-from urllib import response
-import numpy as np
-from langchain_openai import AzureOpenAIEmbeddings, ChatOpenAI, AzureChatOpenAI
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain.sql_database import SQLDatabase
-from langchain.graphs import Neo4jGraph
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.tools import Tool
-from src.data_utils import Neo4jGraphManager, SQLDBManager
+from src.ann_index import get_ann_index
+from src.answer_cache import AnswerCache, get_answer_cache
+from src.conn_pool import get_pool
+from src.emb_cache import get_embs_model
+from src.emb_index import get_emb_index, get_graph_emb_indexes, normalize_filters
+from src.emb_snapshot import GRAPH_SNAPSHOT
+from src.lexical_index import get_lexical_index, is_confident, rrf_fuse
+from src.query_guard import (
+    QueryRejected,
+    error_message,
+    failure_message,
+    guard_cypher,
+    guard_sql,
+)
+from src.schema import GraphSchemaSnapshot, SQLSchemaSnapshot
+from src.tool_results import get_result_pages
+from src.tracing import get_tracer, tracing_callback
+from src.config import (
+    ANN_ENABLED,
+    ANN_MIN_ROWS,
+    ANSWER_CACHE_ENABLED,
+    DB_SIM_THRESHOLD,
+    FAST_PATH_ATTRS,
+    FAST_PATH_ENABLED,
+    FAST_PATH_FILLER_WORDS,
+    GRAPH_OBJ_TYPES,
+    GRAPH_REL_SPECS,
+    GRAPH_SIM_THRESHOLD,
+    OBJ_TYPE_PATTERNS,
+    PYID_PREFIXES,
+    QUERY_READ_ONLY,
+    QUERY_TIMEOUT,
+    SIM_SEARCH_FILTER_FIELDS,
+    SIM_SEARCH_MODE,
+    SIM_SEARCH_TOP_K,
+    TOOL_RESULT_MAX_FETCH_ROWS,
+)
 from src.prompt_templates import kg_rag_agent_sys_prompt, sql_rag_agent_sys_prompt
 
+if TYPE_CHECKING:  # type hints only, langchain is imported when an agent is built
+    from langchain.graphs import Neo4jGraph
+    from langchain.sql_database import SQLDatabase
+    from langchain_openai import AzureChatOpenAI, ChatOpenAI
+
 
 def query_graph(query):
     """
@@ -19,11 +51,26 @@ def query_graph(query):
     Args:
     - query (str): cypher query
     """
-    ngm = Neo4jGraphManager.from_env()  # instantiate neo4j graph manager
-    try:
-        result = ngm.graph.query(query)
-    except Exception as e:
-        result = f"error: {e}"
+    ngm = get_pool().graph_manager()  # shared neo4j graph manager
+    with get_tracer().span("query_graph", kind="db", query=query) as span:
+        try:
+            query = guard_cypher(ngm, query)  # explain, limit & block writes
+            records, truncated = ngm.run_query(
+                query,
+                max_rows=TOOL_RESULT_MAX_FETCH_ROWS,
+                timeout=QUERY_TIMEOUT,
+                read_only=QUERY_READ_ONLY,
+            )
+            span["rows"] = len(records)
+        except QueryRejected as e:
+            span["rejected"] = e.reason
+            return e.to_message()
+        except Exception as e:
+            span["error"] = str(e)
+            return failure_message(e)
+        # first page of the result, without embeddings
+        result = get_result_pages().first_page(records, truncated)
+        span["result_chars"] = len(result)
     return result
 
 
@@ -33,84 +80,430 @@ def query_db(query):
     Args:
     - query (str): SQL query
     """
-    dbm = SQLDBManager.from_env()  # instantiate sql db manager
-    result = dbm.db.run(query)
+    dbm = get_pool().sql_manager()  # shared sql db manager
+    with get_tracer().span("query_db", kind="db", query=query) as span:
+        try:
+            query = guard_sql(dbm, query)  # explain, limit & block writes
+            rows, truncated = dbm.query_records(
+                query,
+                max_rows=TOOL_RESULT_MAX_FETCH_ROWS,
+                timeout=QUERY_TIMEOUT,
+                read_only=QUERY_READ_ONLY,
+            )
+            span["rows"] = len(rows)
+        except QueryRejected as e:
+            span["rejected"] = e.reason
+            return e.to_message()
+        except Exception as e:
+            span["error"] = str(e)
+            return failure_message(e)
+        # first page of the result, without embeddings
+        result = get_result_pages().first_page(rows, truncated)
+        span["result_chars"] = len(result)
     return result
 
 
-def graph_sim_search(user_query):
+def fetch_more(cursor):
+    """
+    Fetch the next page of a query result.
+    Args:
+    - cursor (str): cursor given with the previous page
+    """
+    return get_result_pages().next_page(cursor)
+
+
+def _filter_error(e: ValueError) -> str:
+    return error_message(
+        "invalid_filter",
+        str(e),
+        f"filter only on {', '.join(SIM_SEARCH_FILTER_FIELDS)}, or search without filters",
+    )
+
+
+def graph_sim_search(
+    user_query: str,
+    labels: Optional[List[str]] = None,
+    k: int = SIM_SEARCH_TOP_K,
+    filters: Optional[dict] = None,
+):
     """
     Find similar entities in graph using user query.
     Args:
     - user_query (str): user query
+    - labels (list): object types to search (default: all embedded types)
+    - k (int): max number of matches
+    - filters (dict): field -> value or list of values, only matching entities
+      are searched
+    """
+    try:
+        filters = normalize_filters(filters)
+    except ValueError as e:
+        return _filter_error(e)
+    labels = labels or GRAPH_OBJ_TYPES
+    return _hybrid_search(
+        user_query,
+        GRAPH_SNAPSHOT,
+        k,
+        filters,
+        lambda: _graph_vector_search(user_query, labels, k, filters),
+        groups=labels,
+    )
+
+
+def _graph_vector_search(user_query, labels, k, filters):
+    """
+    Embed the query & search the embeddings of the nodes of some object types.
     """
-    ngm = Neo4jGraphManager.from_env()  # instantiate neo4j graph manager
-    embs_model = AzureOpenAIEmbeddings(
-        azure_deployment="text-embedding-ada-002"
-    )  # instantiate embeddings model
+    ngm = get_pool().graph_manager()  # shared neo4j graph manager
+    embs_model = get_embs_model()  # cached embeddings model
     matches = []
     embedding = embs_model.embed_query(user_query)
-    threshold = 0.75  # similarity threshold
-    query = """
-        WITH $embedding AS inputEmbedding
-        MATCH (n)
-        WHERE gds.similarity.cosine(inputEmbedding, n.embedding) > $threshold
-        RETURN n, gds.similarity.cosine(inputEmbedding, n.embedding) AS sim
-        """
-    result = ngm.graph.query(
-        query, params={"embedding": embedding, "threshold": threshold}
-    )
-    for r in result:
-        matches.append(
-            {"id": r["n"]["pyid"], "name": r["n"]["pylabel"], "sim": r["sim"]}
-        )
-    # sort matches by similarity
-    matches = sorted(matches, key=lambda x: x["sim"], reverse=True)
+    threshold = GRAPH_SIM_THRESHOLD  # similarity threshold
+    with get_tracer().span("graph_sim_search", kind="db", labels=labels) as span:
+        # top-k per label from the memory-mapped snapshot, if exported;
+        # filters select the rows to score from the bitmaps of the index
+        snapshot_indexes = get_graph_emb_indexes() or {}  # label -> index
+        for label in labels:
+            if label in snapshot_indexes:
+                try:
+                    matches.extend(
+                        snapshot_indexes[label].search(
+                            embedding, k=k, threshold=threshold, filters=filters
+                        )
+                    )
+                except ValueError as e:
+                    return _filter_error(e)
+        labels = [label for label in labels if label not in snapshot_indexes]
+        span["snapshot_labels"] = len(snapshot_indexes)
+        span["filters"] = list(filters)
+
+        # top-k per label from the vector indexes, which can't filter before
+        # scoring: filtered searches scan the matching nodes instead
+        vector_indexes = ngm.vector_indexes() if labels and not filters else {}
+        for label in labels:
+            if label not in vector_indexes:
+                continue
+            result = ngm.graph.query(
+                """
+                CALL db.index.vector.queryNodes($index, $k, $embedding) YIELD node, score
+                RETURN node.pyid AS id, node.pylabel AS name, 2 * score - 1 AS sim
+                """,
+                params={"index": vector_indexes[label], "k": k, "embedding": embedding},
+            )  # neo4j scores cosine similarity as (1 + cos) / 2
+            matches.extend(result)
+
+        # scan labels without a vector index
+        unindexed = [label for label in labels if label not in vector_indexes]
+        if unindexed:
+            # fields are validated, values are passed as parameters
+            filter_clause = "".join(
+                f" AND toLower(toString(n.{field})) IN $filters.{field}"
+                for field in filters
+            )
+            query = f"""
+                WITH $embedding AS inputEmbedding
+                MATCH (n)
+                WHERE n.embedding IS NOT NULL AND any(l IN labels(n) WHERE l IN $labels)
+                {filter_clause}
+                WITH n, gds.similarity.cosine(inputEmbedding, n.embedding) AS sim
+                WHERE sim > $threshold
+                RETURN n.pyid AS id, n.pylabel AS name, sim
+                ORDER BY sim DESC LIMIT $k
+                """
+            matches.extend(
+                ngm.graph.query(
+                    query,
+                    params={
+                        "embedding": embedding,
+                        "threshold": threshold,
+                        "labels": unindexed,
+                        "k": k,
+                        "filters": filters,
+                    },
+                )
+            )
+        span["rows"] = len(matches)
+
+    # merge across labels & apply threshold
+    matches = [m for m in matches if m["sim"] > threshold]
+    matches = sorted(matches, key=lambda x: x["sim"], reverse=True)[:k]
     return matches
 
 
-def db_sim_search(user_query, table="pegadata.ppm_work_filtered"):
+def db_sim_search(
+    user_query: str,
+    table: str = "pegadata.ppm_work_filtered",
+    k: int = SIM_SEARCH_TOP_K,
+    filters: Optional[dict] = None,
+):
     """
     Find similar entities in database using user query.
     Args:
     - user_query (str): user query
     - table (str): table name
+    - k (int): max number of matches
+    - filters (dict): field -> value or list of values, only matching rows
+      are scored
     """
-    dbm = SQLDBManager.from_env()  # instantiate sql db manager
-    embs_model = AzureOpenAIEmbeddings(
-        azure_deployment="text-embedding-ada-002"
-    )  # instantiate embeddings model
-    matches = []
-    query_emb = embs_model.embed_query(user_query)
-    threshold = 0.8  # similarity threshold
-    query = f"SELECT pyid, pylabel, embeddings FROM {table};"
-    result = dbm.db.run(query)
-    result = literal_eval(result)  # convert string to list
-    for row in result:
-        id, label, emb = row
-        emb = np.array(emb)  # convert the embedding string to a numpy array
-
-        # calculate cosine similarity
-        cos_sim = np.dot(query_emb, emb) / (
-            np.linalg.norm(query_emb) * np.linalg.norm(emb)
-        )
+    try:
+        filters = normalize_filters(filters)
+    except ValueError as e:
+        return _filter_error(e)
+    return _hybrid_search(
+        user_query,
+        table,
+        k,
+        filters,
+        lambda: _db_vector_search(user_query, table, k, filters),
+    )
+
+
+def _hybrid_search(user_query, name, k, filters, vector_search, groups=None):
+    """
+    Search the lexical index first (without filters), and only embed the query
+    if lexical matches are not conclusive; both rankings are then fused.
+    Args:
+    - user_query (str): user query
+    - name (str): table name, or "graph"
+    - k (int): max number of matches
+    - filters (dict): normalized filters, not supported by the lexical index
+    - vector_search (callable): embeds the query & returns vector matches
+    - groups (list): object types searched in the lexical index
+    Returns:
+    - matches (list): matches in one schema whatever the route (see
+      _sim_matches), or an error message
+    """
+    lexical = None
+    if SIM_SEARCH_MODE != "vector" and not filters:
+        lexical = get_lexical_index(name)
+    if lexical is None:
+        return _sim_matches(vector_search(), "vector")
+    with get_tracer().span("lexical_search", kind="index", table=name) as span:
+        lex_matches = lexical.search(user_query, k=k, groups=groups)
+        confident = is_confident(user_query, lex_matches)
+        span["rows"] = len(lex_matches)
+        span["confident"] = confident
+    if SIM_SEARCH_MODE == "lexical" or confident:
+        return _sim_matches(lex_matches, "lexical")  # no embeddings call
+    matches = vector_search()
+    if isinstance(matches, str) or not lex_matches:
+        return _sim_matches(matches, "vector")  # error or nothing to fuse
+    # the cosine similarity of the vector match is kept for rows found by both
+    sources = {m["id"]: "vector" for m in matches}
+    for m in lex_matches:
+        sources[m["id"]] = "both" if m["id"] in sources else "lexical"
+    return _sim_matches(rrf_fuse([matches, lex_matches], k=k), sources)
+
 
-        if cos_sim > threshold:
-            matches.append({"id": id, "name": label, "sim": cos_sim})
+def _sim_matches(matches, source):
+    """
+    Sim search matches in the schema of the tools: id, name, sim (similarity
+    in [0, 1]: cosine similarity of the embeddings, or for lexical matches the
+    BM25 score relative to a row matching each query term once) & source
+    ("vector", "lexical" or "both"). Error messages are returned as is.
+    Args:
+    - matches (list): matches, or an error message
+    - source (str | dict): source of all matches, or id -> source
+    """
+    if isinstance(matches, str):
+        return matches
+    return [
+        {
+            "id": m["id"],
+            "name": m["name"],
+            "sim": m["sim"],
+            "source": source if isinstance(source, str) else source[m["id"]],
+        }
+        for m in matches
+    ]
 
-    # sort matches by similarity
-    matches = sorted(matches, key=lambda x: x["sim"], reverse=True)
+
+def _db_vector_search(user_query, table, k, filters):
+    """
+    Embed the query & search the embeddings of a table.
+    """
+    dbm = get_pool().sql_manager()  # shared sql db manager
+    embs_model = get_embs_model()  # cached embeddings model
+    query_emb = embs_model.embed_query(user_query)
+    # approximate search of large tables, if their ANN index was built;
+    # filtered searches score the matching rows of the exact index instead
+    ann = get_ann_index(table) if ANN_ENABLED and not filters else None
+    if ann is not None and len(ann) >= ANN_MIN_ROWS:
+        with get_tracer().span("db_sim_search", kind="ann", table=table) as span:
+            matches = ann.search(query_emb, k=k, threshold=DB_SIM_THRESHOLD)
+            span["rows"] = len(matches)
+        return matches
+    index = get_emb_index(dbm, table)  # memory-mapped snapshot, or loaded once per process
+    with get_tracer().span("db_sim_search", kind="index", table=table) as span:
+        span["filters"] = list(filters)
+        # int8 indexes rescore their top candidates with float32 embeddings
+        # from the snapshot, or else from the db
+        try:
+            matches = index.search(
+                query_emb, k=k, threshold=DB_SIM_THRESHOLD, dbm=dbm, filters=filters
+            )
+        except ValueError as e:
+            return _filter_error(e)
+        span["rows"] = len(matches)
     return matches
 
 
+PYID_REGEX = re.compile(
+    r"\b(" + "|".join(PYID_PREFIXES) + r")-(\d+)\b", re.IGNORECASE
+)  # pyid of an object, e.g. "US-1"
+
+
+def route_query(user_query: str) -> Optional[dict]:
+    """
+    Resolve a query naming a single object (by pyid) and a single attribute or
+    relation of it, e.g. "status of US-123" or "which epic does US-42 belong to".
+    Queries with any other word than the template's & filler words are not
+    resolved, e.g. "how many stories are in EPIC-5" or "when was the status
+    of US-12 last changed".
+    Args:
+    - user_query (str): user query
+    Returns:
+    - route (dict): pyid, label & kind ("attr", "parent" or "children") with
+      the attribute or relation spec, or None if the query is not resolved
+    """
+    pyids = {f"{p.upper()}-{n}" for p, n in PYID_REGEX.findall(user_query)}
+    if len(pyids) != 1:
+        return None
+    pyid = pyids.pop()
+    label = PYID_PREFIXES[pyid.split("-")[0]]
+    text = PYID_REGEX.sub(" ", user_query).lower()  # "EPIC-1" is not a mention
+
+    routes = [
+        {"kind": "attr", "attr": attr}
+        for attr, pattern in FAST_PATH_ATTRS.items()
+        if re.search(pattern, text)
+    ]
+    for spec in GRAPH_REL_SPECS:
+        child, _, parent, _ = spec
+        if child == label and re.search(OBJ_TYPE_PATTERNS[parent], text):
+            routes.append({"kind": "parent", "spec": spec})
+        if parent == label and re.search(OBJ_TYPE_PATTERNS[child], text):
+            routes.append({"kind": "children", "spec": spec})
+    if len(routes) != 1:
+        return None  # nothing asked, or ambiguous
+    route = routes[0]
+
+    # words left once the attribute or related type & the type of the object
+    # are removed must all be filler words
+    if route["kind"] == "attr":
+        pattern = FAST_PATH_ATTRS[route["attr"]]
+    else:
+        child, _, parent, _ = route["spec"]
+        pattern = OBJ_TYPE_PATTERNS[parent if route["kind"] == "parent" else child]
+    rest = re.sub(OBJ_TYPE_PATTERNS[label], " ", re.sub(pattern, " ", text))
+    if set(re.findall(r"\w+", rest)) - FAST_PATH_FILLER_WORDS:
+        return None  # asks more than the attribute or relation
+    return {"pyid": pyid, "label": label, **route}
+
+
+def _format_values(values: list) -> Optional[str]:
+    values = [str(v) for v in values if v is not None and str(v).strip()]
+    return ", ".join(values) if values else None
+
+
+def fast_path_db(user_query: str, table="pegadata.ppm_work_filtered") -> Optional[str]:
+    """
+    Answer a direct id lookup with a single parameterized SQL query.
+    Args:
+    - user_query (str): user query
+    - table (str): table name
+    Returns:
+    - response (str): the answer, or None if the query must go to the agent
+    """
+    route = route_query(user_query)
+    if route is None:
+        return None
+    if route["kind"] == "attr":
+        sql = f"SELECT {route['attr']} FROM {table} WHERE pyid = %s;"
+    elif route["kind"] == "parent":
+        sql = f"SELECT {route['spec'][1]} FROM {table} WHERE pyid = %s;"
+    else:
+        sql = f"SELECT pyid FROM {table} WHERE {route['spec'][1]} = %s ORDER BY pyid;"
+    dbm = get_pool().sql_manager()  # shared sql db manager
+    with get_tracer().span("fast_path_db", kind="db", route=route["kind"]) as span:
+        try:
+            rows = dbm.query(sql, (route["pyid"],))
+        except Exception as e:
+            print(f"fast path failed, falling back to the agent: {e}")
+            return None
+        span["rows"] = len(rows)
+    return _format_values([row[0] for row in rows])
+
+
+def fast_path_graph(user_query: str) -> Optional[str]:
+    """
+    Answer a direct id lookup with a single parameterized cypher query.
+    Args:
+    - user_query (str): user query
+    Returns:
+    - response (str): the answer, or None if the query must go to the agent
+    """
+    route = route_query(user_query)
+    if route is None:
+        return None
+    label = route["label"]
+    if route["kind"] == "attr":
+        query = f"MATCH (n:{label} {{pyid: $pyid}}) RETURN n.{route['attr']} AS value"
+    elif route["kind"] == "parent":
+        _, _, parent, rel_type = route["spec"]
+        query = f"""
+            MATCH (n:{label} {{pyid: $pyid}})-[:{rel_type}]->(p:{parent})
+            RETURN p.pyid AS value
+            """
+    else:
+        child, _, _, rel_type = route["spec"]
+        query = f"""
+            MATCH (c:{child})-[:{rel_type}]->(n:{label} {{pyid: $pyid}})
+            RETURN c.pyid AS value ORDER BY value
+            """
+    ngm = get_pool().graph_manager()  # shared neo4j graph manager
+    with get_tracer().span("fast_path_graph", kind="db", route=route["kind"]) as span:
+        try:
+            result = ngm.graph.query(query, params={"pyid": route["pyid"]})
+        except Exception as e:
+            print(f"fast path failed, falling back to the agent: {e}")
+            return None
+        span["rows"] = len(result)
+    return _format_values([r["value"] for r in result])
+
+
+def parse_output(output: str) -> str:
+    """
+    Extract the final answer from the output of an agent.
+    """
+    if "Final Answer:" in output:
+        split_output = re.split("(?i)Final Answer:", output)
+        return split_output[1].strip() if len(split_output[1].strip()) > 1 else "N/A"
+    return output
+
+
 class GraphQueryAgent:
     def __init__(
         self,
-        graph: Neo4jGraph,
-        llm: Union[ChatOpenAI, AzureChatOpenAI],
+        graph: Optional["Neo4jGraph"],
+        llm: Union["ChatOpenAI", "AzureChatOpenAI"],
+        verbose: bool = True,
+        answer_cache: AnswerCache = None,
+        fast_path: bool = FAST_PATH_ENABLED,
     ):
+        from langchain.agents import AgentExecutor, create_openai_tools_agent
+        from langchain.tools import StructuredTool, Tool
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+        if graph is None:
+            graph = get_pool().graph_manager().graph  # share the tools' connections
         self.graph = graph  # neo4j graph
         self.llm = llm  # llm
+        if answer_cache is None and ANSWER_CACHE_ENABLED:
+            answer_cache = get_answer_cache()
+        self.answer_cache = answer_cache  # cache of answers to previous queries
+        self.fast_path = fast_path  # answer direct id lookups without the llm
+        self.schema = GraphSchemaSnapshot(graph)  # compact schema for prompts
         # define tools
         self.tools = [
             Tool(
@@ -122,13 +515,30 @@ class GraphQueryAgent:
                     - query (str): cypher query
                 """,
             ),
-            Tool(
+            StructuredTool.from_function(
                 name="graph_sim_search",
                 func=graph_sim_search,
-                description="""
+                description=f"""
                     Find similar entities in graph using user query.
                     Args:
                     - user_query (str): user query
+                    - filters (dict, optional): only search entities whose fields
+                      have one of the given values, e.g.
+                      {{"pystatuswork": ["Open", "Pending"]}}; filterable fields:
+                      {", ".join(SIM_SEARCH_FILTER_FIELDS)}
+                    Returns matches, most relevant first, as dicts with id, name,
+                    sim (similarity in [0, 1]) & source ("vector" for semantic,
+                    "lexical" for keyword or "both").
+                """,
+            ),
+            Tool(
+                name="fetch_more",
+                func=fetch_more,
+                description="""
+                    Fetch the next page of a query result marked as having more
+                    rows available.
+                    Args:
+                    - cursor (str): cursor given with the previous page
                 """,
             ),
         ]
@@ -146,39 +556,75 @@ class GraphQueryAgent:
         # define agent
         self.agent = create_openai_tools_agent(self.llm, self.tools, self.prompt)
         self.agent_exec = AgentExecutor.from_agent_and_tools(
-            agent=self.agent, tools=self.tools, verbose=True
+            agent=self.agent, tools=self.tools, verbose=verbose
         )
 
-    def run(self, query):
+    def run(self, query, callbacks: list = None):
         """
         Run agent with user query.
         Args:
         - query (str): user query
+        - callbacks (list): langchain callback handlers for this run
         """
-        result = self.agent_exec.invoke(
-            {"input": query, "schema": self.graph.schema, "tools": self.tools}
-        )
-        # parse the output
-        if "Final Answer:" in result["output"]:
-            split_output = re.split("(?i)Final Answer:", result["output"])
-            response = (
-                split_output[1].strip() if len(split_output[1].strip()) > 1 else "N/A"
-            )
-        else:
-            response = result["output"]
+        # answer from cache if the query (or a very similar one) was answered before
+        namespace = self.cache_namespace()
+        if self.answer_cache is not None:
+            response = self.answer_cache.get(query, namespace)
+            if response is not None:
+                return response
+
+        tracer = get_tracer()
+        with tracer.span("graph_agent.run", kind="agent", query=query) as span:
+            # direct id & attribute lookups are answered with a single query
+            response = fast_path_graph(query) if self.fast_path else None
+            span["fast_path"] = response is not None
+            if response is None:
+                result = self.agent_exec.invoke(
+                    {"input": query, "schema": self.schema.text, "tools": self.tools},
+                    config={"callbacks": [tracing_callback(tracer), *(callbacks or [])]},
+                )
+                response = parse_output(result["output"])
+        if self.answer_cache is not None and response != "N/A":
+            self.answer_cache.put(query, response, namespace)
         return response
 
+    def refresh_schema(self):
+        """
+        Rebuild the schema snapshot, e.g. after a migration.
+        """
+        self.schema.refresh()
+
+    def cache_namespace(self) -> str:
+        """
+        Answer cache namespace of the agent: its kind & a hash of its schema.
+        """
+        return f"graph:{self.schema.fingerprint}"
+
 
 class SQLQueryAgent:
     """SQL-RAG agent using tools."""
 
     def __init__(
         self,
-        db: SQLDatabase,
-        llm: Union[ChatOpenAI, AzureChatOpenAI],
+        db: Optional["SQLDatabase"],
+        llm: Union["ChatOpenAI", "AzureChatOpenAI"],
+        verbose: bool = True,
+        answer_cache: AnswerCache = None,
+        fast_path: bool = FAST_PATH_ENABLED,
     ):
+        from langchain.agents import AgentExecutor, create_openai_tools_agent
+        from langchain.tools import StructuredTool, Tool
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+        if db is None:
+            db = get_pool().sql_manager().db  # share the tools' connections
         self.db = db  # sql db
         self.llm = llm  # llm
+        if answer_cache is None and ANSWER_CACHE_ENABLED:
+            answer_cache = get_answer_cache()
+        self.answer_cache = answer_cache  # cache of answers to previous queries
+        self.fast_path = fast_path  # answer direct id lookups without the llm
+        self.schema = SQLSchemaSnapshot(db)  # compact schema for prompts
 
         # define tools
         self.tools = [
@@ -191,14 +637,31 @@ class SQLQueryAgent:
                     - query (str): sql query
                 """,
             ),
-            Tool(
+            StructuredTool.from_function(
                 name="db_sim_search",
                 func=db_sim_search,
-                description="""
+                description=f"""
                     Find similar entities in database using user query.
                     Args:
                     - user_query (str): user query
                     - table (str): table name
+                    - filters (dict, optional): only search rows whose columns
+                      have one of the given values, e.g.
+                      {{"pystatuswork": ["Open", "Pending"]}}; filterable columns:
+                      {", ".join(SIM_SEARCH_FILTER_FIELDS)}
+                    Returns matches, most relevant first, as dicts with id, name,
+                    sim (similarity in [0, 1]) & source ("vector" for semantic,
+                    "lexical" for keyword or "both").
+                """,
+            ),
+            Tool(
+                name="fetch_more",
+                func=fetch_more,
+                description="""
+                    Fetch the next page of a query result marked as having more
+                    rows available.
+                    Args:
+                    - cursor (str): cursor given with the previous page
                 """,
             ),
         ]
@@ -216,20 +679,41 @@ class SQLQueryAgent:
         # define agent
         self.agent = create_openai_tools_agent(self.llm, self.tools, self.prompt)
         self.agent_exec = AgentExecutor.from_agent_and_tools(
-            agent=self.agent, tools=self.tools, verbose=True
+            agent=self.agent, tools=self.tools, verbose=verbose
         )
 
-    def run(self, query: str):
-        """Run agent with user query."""
-        result = self.agent_exec.invoke(
-            {"input": query, "schema": self.db.table_info, "tools": self.tools}
-        )
-        # parse the output
-        if "Final Answer:" in result["output"]:
-            split_output = re.split("(?i)Final Answer:", result["output"])
-            response = (
-                split_output[1].strip() if len(split_output[1].strip()) > 1 else "N/A"
-            )
-        else:
-            response = result["output"]
+    def run(self, query: str, callbacks: list = None):
+        """Run agent with user query, with optional langchain callback handlers."""
+        # answer from cache if the query (or a very similar one) was answered before
+        namespace = self.cache_namespace()
+        if self.answer_cache is not None:
+            response = self.answer_cache.get(query, namespace)
+            if response is not None:
+                return response
+
+        tracer = get_tracer()
+        with tracer.span("sql_agent.run", kind="agent", query=query) as span:
+            # direct id & attribute lookups are answered with a single query
+            response = fast_path_db(query) if self.fast_path else None
+            span["fast_path"] = response is not None
+            if response is None:
+                result = self.agent_exec.invoke(
+                    {"input": query, "schema": self.schema.text, "tools": self.tools},
+                    config={"callbacks": [tracing_callback(tracer), *(callbacks or [])]},
+                )
+                response = parse_output(result["output"])
+        if self.answer_cache is not None and response != "N/A":
+            self.answer_cache.put(query, response, namespace)
         return response
+
+    def refresh_schema(self):
+        """
+        Rebuild the schema snapshot, e.g. after a migration.
+        """
+        self.schema.refresh()
+
+    def cache_namespace(self) -> str:
+        """
+        Answer cache namespace of the agent: its kind & a hash of its schema.
+        """
+        return f"sql:{self.schema.fingerprint}"
@@ -0,0 +1,242 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING
+from src.config import TRACE_PATH
+
+if TYPE_CHECKING:  # type hints only
+    from langchain_core.callbacks import BaseCallbackHandler
+
+# ids of the current trace & span, per thread / task
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span_id = contextvars.ContextVar("span_id", default=None)
+
+
+class JsonlSink:
+    """
+    Span sink appending each span as a json line to a file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+
+    def write(self, span: dict):
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(span, default=str) + "\n")
+
+
+class MemorySink:
+    """
+    Span sink collecting spans in memory, with aggregate stats per span name.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def write(self, span: dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def aggregate(self) -> dict:
+        """
+        Aggregate spans per name: count, total & mean duration, and sums of
+        token & row counts.
+        """
+        stats = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            s = stats.setdefault(span["name"], {"count": 0, "total_ms": 0.0})
+            s["count"] += 1
+            s["total_ms"] += span["duration_ms"]
+            for key in ("prompt_tokens", "completion_tokens", "rows"):
+                if span.get(key) is not None:
+                    s[key] = s.get(key, 0) + span[key]
+        for s in stats.values():
+            s["mean_ms"] = s["total_ms"] / s["count"]
+        return {
+            "n_traces": len({span["trace_id"] for span in spans}),
+            "spans": stats,
+        }
+
+
+class Tracer:
+    """
+    Emits timed spans (agent runs & steps, llm calls, embedding calls, db
+    queries) to pluggable sinks. Spans of the same agent run share a trace id.
+    """
+
+    def __init__(self, sinks: list = None):
+        self.sinks = list(sinks or [])
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attrs):
+        """
+        Time a block of code as a span, nested in the current span if any.
+        Yields the dict of span attributes, which the block can update
+        (e.g. with a row count).
+        Args:
+            name (str): span name
+            kind (str): span kind: agent, llm, embedding, db, index, ...
+            attrs: span attributes
+        """
+        if not self.sinks:
+            yield attrs
+            return
+        span_id = uuid.uuid4().hex[:16]
+        parent_id = _span_id.get()
+        trace_token = _trace_id.set(_trace_id.get() or span_id)
+        span_token = _span_id.set(span_id)
+        start, start_time = time.time(), time.perf_counter()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs["error"] = repr(e)
+            raise
+        finally:
+            trace_id = _trace_id.get()
+            _span_id.reset(span_token)
+            _trace_id.reset(trace_token)
+            self.emit(
+                {
+                    "trace_id": trace_id,
+                    "span_id": span_id,
+                    "parent_id": parent_id,
+                    "name": name,
+                    "kind": kind,
+                    "start": start,
+                    "duration_ms": (time.perf_counter() - start_time) * 1000,
+                    **attrs,
+                }
+            )
+
+    def record(self, name: str, kind: str, start: float, end: float, **attrs):
+        """
+        Emit a span timed outside of a `span` block, in the current span.
+        Args:
+            start (float): start time (epoch seconds)
+            end (float): end time (epoch seconds)
+        """
+        if not self.sinks:
+            return
+        self.emit(
+            {
+                "trace_id": _trace_id.get(),
+                "span_id": uuid.uuid4().hex[:16],
+                "parent_id": _span_id.get(),
+                "name": name,
+                "kind": kind,
+                "start": start,
+                "duration_ms": (end - start) * 1000,
+                **attrs,
+            }
+        )
+
+    def emit(self, span: dict):
+        for sink in self.sinks:
+            try:
+                sink.write(span)
+            except Exception as e:
+                print(f"error writing span: {e}")
+
+
+class _TracingCallback:
+    """
+    Langchain callback emitting a span per llm call (with token counts) and per
+    agent step (from one llm call to the next, including the tool calls).
+    Use one instance per agent run, created with `tracing_callback`.
+    """
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._llm_starts = {}  # run id -> start time
+        self._step = 0
+        self._step_start = None
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start_llm(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start_llm(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage", {})
+        self.tracer.record(
+            "llm_call",
+            "llm",
+            self._llm_starts.pop(run_id, time.time()),
+            time.time(),
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.tracer.record(
+            "llm_call",
+            "llm",
+            self._llm_starts.pop(run_id, time.time()),
+            time.time(),
+            error=repr(error),
+        )
+
+    def on_agent_finish(self, finish, **kwargs):
+        self._end_step()
+
+    def _start_llm(self, run_id):
+        # each llm call starts a new agent step
+        self._end_step()
+        self._step_start = time.time()
+        self._llm_starts[run_id] = self._step_start
+
+    def _end_step(self):
+        if self._step_start is None:
+            return
+        self.tracer.record(
+            "agent_step", "agent", self._step_start, time.time(), step=self._step
+        )
+        self._step += 1
+        self._step_start = None
+
+
+@lru_cache(maxsize=1)
+def _tracing_callback_class() -> type:
+    # langchain is imported on first use, to keep imports of the tools fast
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    return type("TracingCallback", (_TracingCallback, BaseCallbackHandler), {})
+
+
+def tracing_callback(tracer: Tracer) -> "BaseCallbackHandler":
+    """
+    Langchain callback tracing an agent run (see _TracingCallback).
+    """
+    return _tracing_callback_class()(tracer)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Get the process-wide tracer, writing to TRACE_PATH if set.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer([JsonlSink(TRACE_PATH)] if TRACE_PATH else [])
+    return _tracer
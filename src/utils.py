@@ -1,19 +1,98 @@
 import os
 import re
 import json
+import random
+import time
+from functools import lru_cache
 from typing import Literal
 from dotenv import load_dotenv
-import pandas as pd
+from src.config import DATA_VERSION_PATH, EVAL_MAX_RETRIES
+
+
+_dotenv_loaded = False
 
 
 def get_env_variable(var_name):
-    load_dotenv()
+    global _dotenv_loaded
+    if not _dotenv_loaded:
+        load_dotenv()  # read .env once per process
+        _dotenv_loaded = True
     value = os.environ.get(var_name)
     if value is None:
         raise EnvironmentError(f"Environment variable {var_name} not set.")
     return value
 
 
+_data_version_path = DATA_VERSION_PATH
+
+
+def set_data_version_path(path: str):
+    """
+    Set the file holding the data version, e.g. to a temp file for benchmarks.
+    """
+    global _data_version_path
+    _data_version_path = path
+
+
+def get_data_version(path: str = None) -> int:
+    """
+    Get the version of the data, bumped by the data pipeline whenever it changes the data.
+    """
+    path = path or _data_version_path
+    try:
+        with open(path, "r") as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def bump_data_version(path: str = None) -> int:
+    """
+    Bump the version of the data, e.g. to invalidate cached answers.
+    """
+    path = path or _data_version_path
+    version = get_data_version(path) + 1
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(version))
+    os.replace(tmp_path, path)  # atomic
+    return version
+
+
+@lru_cache(maxsize=1)
+def retryable_errors() -> tuple:
+    """
+    Errors worth retrying: rate limits & transient api errors (openai is
+    imported on first use).
+    """
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+
+def retry_with_backoff(
+    fn, *args, max_retries: int = EVAL_MAX_RETRIES, base_delay: float = 1.0, **kwargs
+):
+    """
+    Call a function, retrying with exponential backoff & jitter on transient errors.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except retryable_errors() as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * 2**attempt * (1 + random.random())
+            print(f"retrying in {delay:.1f}s after error: {e}")
+            time.sleep(delay)
+
+
 def load_postgres_env_variables():
     """
     Load environment variables for postgres database.
@@ -39,15 +118,20 @@ def load_neo4j_env_variables():
     return uri, user, password, db
 
 
-def eval_rag_responses(responses_eval_path: str, results_path: str) -> dict:
+def eval_rag_responses(
+    responses_eval_path: str, results_path: str, trace_stats: dict = None
+) -> dict:
     """
     Evaluate RAG responses and return metrics dict.
     Args:
         responses_eval_path: Path to the responses_eval.csv file.
         results_path: Path to save the results.
+        trace_stats: Aggregated tracing spans to add to the results (optional).
     Returns:
         metrics: Dict with metrics.
     """
+    import pandas as pd  # loaded on first use
+
     df_responses_eval = pd.read_csv(responses_eval_path, sep=";", index_col="id")
     num_queries_easy = len(df_responses_eval[df_responses_eval["difficulty"] == "easy"])
     num_queries_hard = len(df_responses_eval[df_responses_eval["difficulty"] == "hard"])
@@ -77,6 +161,11 @@ def eval_rag_responses(responses_eval_path: str, results_path: str) -> dict:
         "accuracy_easy": num_correct_easy / num_queries_easy,
         "accuracy_hard": num_correct_hard / num_queries_hard,
     }
+    if "latency" in df_responses_eval:
+        eval_res["latency_mean"] = df_responses_eval["latency"].mean()
+        eval_res["latency_p95"] = df_responses_eval["latency"].quantile(0.95)
+    if trace_stats is not None:
+        eval_res["trace"] = trace_stats
 
     with open(results_path, "w") as f:
         json.dump(eval_res, f)
@@ -0,0 +1,47 @@
+"""Exact & semantic hits of the answer cache"""
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+from src.answer_cache import AnswerCache, query_ids
+from src.utils import set_data_version_path
+from src.config import DATA_VERSION_PATH
+
+
+class SameEmbeddings:
+    """
+    Embeds every query to the same vector: all queries are semantic hits.
+    """
+
+    def embed_query(self, text: str) -> list:
+        return [1.0, 0.0]
+
+
+@pytest.fixture(autouse=True)
+def data_version(tmp_path):
+    set_data_version_path(str(tmp_path / "data_version"))
+    yield
+    set_data_version_path(DATA_VERSION_PATH)
+
+
+def test_query_ids():
+    assert query_ids("Status of US-123?") == {"us-123"}
+    assert query_ids("stories done in 2023 of EPIC-5") == {"2023", "epic-5"}
+    assert query_ids("who owns the login story") == frozenset()
+
+
+def test_semantic_hit_requires_same_ids():
+    cache = AnswerCache(embs_model=SameEmbeddings(), sim_threshold=0.97)
+    cache.put("status of US-123", "Open")
+    assert cache.get("What is the status of US-123?") == "Open"
+    assert cache.get("status of US-124") is None
+    assert cache.get("status of US-123 and US-124") is None
+    assert cache.get("status of the login story") is None
+
+
+def test_disabled_cache():
+    cache = AnswerCache(embs_model=SameEmbeddings(), enabled=False)
+    cache.put("status of US-123", "Open")
+    assert cache.get("status of US-123") is None
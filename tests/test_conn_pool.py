@@ -0,0 +1,68 @@
+"""Locking of the connection pool"""
+
+import threading
+import time
+import pytest
+
+pytest.importorskip("numpy")
+
+from src.conn_pool import ConnectionPool
+
+
+class Manager:
+    """
+    Stand-in db manager, with a ping that can be held up.
+    """
+
+    def __init__(self, ping_delay: float = 0.0):
+        self.ping_delay = ping_delay
+        self.closed = False
+
+    def ping(self) -> bool:
+        time.sleep(self.ping_delay)
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def test_slow_ping_does_not_block_other_keys():
+    pool = ConnectionPool(health_check_interval=0)
+    pool._get("slow", lambda: Manager(ping_delay=0.5))
+    thread = threading.Thread(target=pool._get, args=("slow", Manager))
+    thread.start()
+    time.sleep(0.05)  # the thread is pinging the slow manager
+    start = time.monotonic()
+    pool._get("fast", Manager)
+    assert time.monotonic() - start < 0.25
+    thread.join()
+
+
+def test_concurrent_gets_connect_once():
+    pool = ConnectionPool()
+    n_connects = []
+
+    def factory():
+        n_connects.append(1)
+        time.sleep(0.1)
+        return Manager()
+
+    managers = []
+    threads = [
+        threading.Thread(target=lambda: managers.append(pool._get("key", factory)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(n_connects) == 1
+    assert len({id(manager) for manager in managers}) == 1
+
+
+def test_unhealthy_manager_is_replaced():
+    pool = ConnectionPool(health_check_interval=0)
+    manager = pool._get("key", Manager)
+    manager.ping = lambda: False
+    assert pool._get("key", Manager) is not manager
+    assert manager.closed
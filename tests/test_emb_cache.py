@@ -0,0 +1,38 @@
+"""LRU eviction of the embedding cache"""
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from src.emb_cache import EmbeddingCache
+
+
+def count(cache: EmbeddingCache) -> int:
+    return cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def test_put_many_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embs.sqlite"), max_entries=3)
+    for key in "abc":
+        cache.put_many({key: [1.0]})
+    cache.get_many(["a"])  # "b" is now the least recently used
+    cache.put_many({"d": [1.0]})
+    assert count(cache) == 3
+    assert set(cache.get_many(list("abcd"))) == {"a", "c", "d"}
+
+
+def test_put_many_replacing_keys_does_not_evict(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embs.sqlite"), max_entries=2)
+    for _ in range(5):
+        cache.put_many({"a": [1.0], "b": [2.0]})
+    assert set(cache.get_many(["a", "b"])) == {"a", "b"}
+
+
+def test_count_is_loaded_when_the_cache_opens(tmp_path):
+    path = str(tmp_path / "embs.sqlite")
+    cache = EmbeddingCache(path, max_entries=2)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    cache.close()
+    cache = EmbeddingCache(path, max_entries=2)
+    cache.put_many({"c": [3.0]})
+    assert count(cache) == 2
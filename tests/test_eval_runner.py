@@ -0,0 +1,113 @@
+"""Resuming an evaluation from its checkpoint"""
+
+import json
+import pytest
+
+pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("langchain_core")
+
+from src.bench_fakes import FakeEmbeddings, FakeSQLDatabase, match, sql_manager
+from src.emb_pipeline import EmbeddingCheckpoint, EmbeddingPipeline, truncate_chars
+from src.eval_runner import EvalRunner
+from src.utils import get_data_version, set_data_version_path
+from src.config import DATA_VERSION_PATH
+
+
+@pytest.fixture(autouse=True)
+def data_version(tmp_path):
+    set_data_version_path(str(tmp_path / "data_version"))
+    yield
+    set_data_version_path(DATA_VERSION_PATH)
+
+
+def embed(tmp_path, n_changed: int = 0):
+    """
+    Incremental embed_objs, as run by the eval scripts before the eval, on a
+    table where n_changed rows changed since they were last embedded.
+    """
+
+    def handler(sql, params):
+        if match(r"format_type", sql):
+            return ["format_type"], [("text",)], 1
+        if match(r"^\s*UPDATE", sql):
+            return None, [], n_changed
+        if match(r"^\s*SELECT", sql):
+            rows = [(f"US-{i}", f"story {i}") for i in range(n_changed)]
+            return ["pyid", "pylabel"], rows, n_changed
+        return None, [], 0
+
+    pipeline = EmbeddingPipeline(
+        FakeEmbeddings(8),
+        checkpoint=EmbeddingCheckpoint(str(tmp_path / "embed.json")),
+        truncate=truncate_chars,
+    )
+    sql_manager(FakeSQLDatabase(handler)).embed_objs(
+        "data",
+        ["pylabel"],
+        "pyid",
+        incremental=True,
+        snapshot=False,
+        ann=False,
+        lexical=False,
+        pipeline=pipeline,
+    )
+
+
+class Agent:
+    def __init__(self):
+        self.queries = []
+
+    def run(self, query: str, callbacks: list = None) -> str:
+        self.queries.append(query)
+        return f"answer to {query}"
+
+
+def run_eval(tmp_path, agent: Agent, n_changed: int = 0) -> "pd.DataFrame":
+    embed(tmp_path, n_changed)
+    df_queries = pd.DataFrame(
+        {"query": ["q1", "q2", "q3"]}, index=pd.Index([1, 2, 3], name="id")
+    )
+    runner = EvalRunner(
+        agent.run,
+        str(tmp_path / "checkpoint.jsonl"),
+        max_workers=1,
+        config={"agent": "sql:schema"},
+    )
+    return runner.run(df_queries)
+
+
+def test_embed_objs_keeps_data_version_when_nothing_changed(tmp_path):
+    embed(tmp_path)
+    assert get_data_version() == 0
+    embed(tmp_path, n_changed=2)
+    assert get_data_version() == 1
+
+
+def test_rerun_on_unchanged_data_resumes(tmp_path):
+    agent = Agent()
+    run_eval(tmp_path, agent)
+    assert sorted(agent.queries) == ["q1", "q2", "q3"]
+
+    # interrupted before the last answer was written
+    path = tmp_path / "checkpoint.jsonl"
+    lines = path.read_text().splitlines(keepends=True)
+    path.write_text("".join(lines[:-1]))
+    missing = json.loads(lines[-1])["id"]
+    agent.queries = []
+
+    df_responses = run_eval(tmp_path, agent)
+    assert agent.queries == [f"q{missing}"]  # only the missing answer is run
+    assert sorted(df_responses.index.astype(str)) == ["1", "2", "3"]
+
+    agent.queries = []
+    run_eval(tmp_path, agent)
+    assert agent.queries == []  # all answers reused
+
+
+def test_rerun_after_data_change_starts_over(tmp_path):
+    agent = Agent()
+    run_eval(tmp_path, agent)
+    agent.queries = []
+    run_eval(tmp_path, agent, n_changed=1)
+    assert sorted(agent.queries) == ["q1", "q2", "q3"]
@@ -0,0 +1,55 @@
+"""Fusion of the lexical & vector rankings of the sim-search tools"""
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+from src import tools
+from src.lexical_index import LexicalIndex, rrf_fuse, set_lexical_dir
+from src.emb_snapshot import snapshot_name
+from src.config import LEXICAL_DIR
+
+
+@pytest.fixture
+def lexical_dir(tmp_path):
+    index = LexicalIndex()
+    index.upsert(
+        ["US-1", "US-2", "US-3"],
+        ["story one", "story two", "story three"],
+        ["checkout testing", "checkout testing again", "login page"],
+    )
+    index.save(snapshot_name("data"), str(tmp_path))
+    set_lexical_dir(str(tmp_path))
+    yield tmp_path
+    set_lexical_dir(LEXICAL_DIR)
+
+
+def test_rrf_fuse_merges_rows_of_both_rankings():
+    vector = [{"id": "US-2", "sim": 0.9}, {"id": "US-4", "sim": 0.8}]
+    lexical = [{"id": "US-1", "sim": 0.7}, {"id": "US-2", "sim": 0.6}]
+    fused = rrf_fuse([vector, lexical], k=10)
+    assert [m["id"] for m in fused] == ["US-2", "US-1", "US-4"]
+    assert fused[0]["sim"] == 0.9  # first ranking's fields win
+
+
+def test_hybrid_search_returns_each_row_once(lexical_dir, monkeypatch):
+    monkeypatch.setattr(tools, "SIM_SEARCH_MODE", "hybrid")
+    vector = [
+        {"id": "US-2", "name": "story two", "sim": 0.91},
+        {"id": "US-4", "name": "story four", "sim": 0.85},
+    ]
+    matches = tools._hybrid_search("checkout testing", "data", 10, {}, lambda: vector)
+
+    ids = [m["id"] for m in matches]
+    assert len(ids) == len(set(ids))
+    by_id = {m["id"]: m for m in matches}
+    assert set(by_id) == {"US-1", "US-2", "US-4"}
+    assert by_id["US-2"]["source"] == "both"
+    assert by_id["US-2"]["sim"] == 0.91  # cosine similarity of the vector match
+    assert by_id["US-1"]["source"] == "lexical"
+    assert by_id["US-4"]["source"] == "vector"
+    assert ids[0] == "US-2"  # found by both rankings
+    for m in matches:
+        assert set(m) == {"id", "name", "sim", "source"}
+        assert 0 <= m["sim"] <= 1
@@ -0,0 +1,53 @@
+"""Routing of direct id lookups to the fast path"""
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+from src.tools import route_query
+
+
+@pytest.mark.parametrize(
+    "query, kind, target",
+    [
+        ("What is the status of US-123?", "attr", "pystatuswork"),
+        ("status of us-7", "attr", "pystatuswork"),
+        ("What's the category of user story US-1?", "attr", "category"),
+        ("Describe EPIC-2", "attr", "description"),
+        ("Which epic does US-42 belong to?", "parent", "Epic"),
+        ("What is the goal of EPIC-3?", "parent", "Goal"),
+        ("List all user stories of EPIC-5", "children", "UserStory"),
+        ("Show me the epics of GOAL-1", "children", "Epic"),
+    ],
+)
+def test_direct_lookups_are_routed(query, kind, target):
+    route = route_query(query)
+    assert route is not None and route["kind"] == kind
+    if kind == "attr":
+        assert route["attr"] == target
+    else:
+        child, _, parent, _ = route["spec"]
+        assert (parent if kind == "parent" else child) == target
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        # counts, filters & time phrases over the children
+        "How many user stories are in EPIC-5?",
+        "Which user stories of EPIC-5 are still pending?",
+        "Which user stories of EPIC-5 were completed last week?",
+        # history of an attribute
+        "When was the status of US-12 last changed?",
+        # attribute of a related object
+        "Who is responsible for the epic of US-3?",
+        "Which goal does the epic of US-3 belong to?",
+        # several objects, or nothing asked
+        "Status of US-1 and US-2",
+        "Tell me about US-4",
+        "status of US-12 in 2023",
+    ],
+)
+def test_other_queries_go_to_the_agent(query):
+    assert route_query(query) is None
@@ -0,0 +1,41 @@
+"""Caching of the graph's vector index list"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+from src.bench_fakes import FakeNeo4jGraph, graph_manager
+
+
+class Graph(FakeNeo4jGraph):
+    """
+    Fake graph counting the index listings, with embedded nodes of every label.
+    """
+
+    n_listings = 0
+
+    def query(self, query: str, params: dict = None) -> list:
+        if "SHOW INDEXES" in query:
+            self.n_listings += 1
+        if "size(n.embedding)" in query:
+            return [{"dim": 2}]
+        return super().query(query, params)
+
+
+def graph() -> Graph:
+    return Graph({"Epic": (["EPIC-1"], ["epic"], np.eye(1, 2, dtype=np.float32))})
+
+
+def test_vector_indexes_are_listed_once():
+    ngm = graph_manager(graph())
+    assert ngm.vector_indexes() == {"Epic": "Epic"}
+    assert ngm.vector_indexes() == {"Epic": "Epic"}
+    assert ngm.graph.n_listings == 1
+
+
+def test_create_vector_index_clears_the_cache():
+    ngm = graph_manager(graph())
+    ngm.create_vector_index("Story")
+    ngm.vector_indexes()
+    assert ngm.graph.n_listings == 2